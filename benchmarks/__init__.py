@@ -0,0 +1,28 @@
+"""
+性能基准: 求解器、环境步进和 Web 接口。
+
+用法 (在仓库根目录):
+    python -m benchmarks --list                     # 列出所有用例
+    python -m benchmarks --quick --save base.json   # 运行并保存基线
+    python -m benchmarks --quick --compare base.json --threshold 0.25
+
+每个用例在一个新的子进程中运行, 报告:
+    wall_time: 一次运行的耗时 (秒, 多次重复取最小值); 求解器是收敛所需的时间
+    <计数>_per_sec: 每秒的 sweep / step / 请求数
+    peak_rss_mb: 子进程的峰值常驻内存
+    alloc_peak_mb: tracemalloc 记录的一次运行中 Python 和 NumPy 分配的峰值
+以及用例自己的计数 (例如 sweeps)。
+
+--compare 时, 任何一个指标比基线差超过 threshold (相对值) 就以退出码 1 结束;
+*_per_sec 越大越好, 其他指标越小越好。
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 与 web/app.py 一样, src 和 web 中的模块按顶层模块导入
+for path in (os.path.join(ROOT, "web"), os.path.join(ROOT, "src")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
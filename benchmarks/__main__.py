@@ -0,0 +1,76 @@
+import argparse
+import re
+import sys
+
+from benchmarks.cases import CASES
+from benchmarks.runner import compare, load_baseline, run_cases, save_baseline
+
+
+def format_metrics(metrics):
+    if "error" in metrics:
+        return f"ERROR {metrics['error']}"
+    parts = [f"{metrics['wall_time'] * 1000:10.2f} ms"]
+    parts += [
+        f"{name} {value:,.1f}" for name, value in metrics.items() if name.endswith("_per_sec")
+    ]
+    parts.append(f"rss {metrics['peak_rss_mb']:.0f} MB")
+    parts.append(f"alloc {metrics['alloc_peak_mb']:.1f} MB")
+    return "  ".join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="求解器、环境和 Web 接口的性能基准"
+    )
+    parser.add_argument("-k", "--filter", default=None, help="只运行名字匹配该正则的用例")
+    parser.add_argument("--quick", action="store_true", help="只运行小地图上的快速用例")
+    parser.add_argument("--list", action="store_true", help="列出用例后退出")
+    parser.add_argument("--save", metavar="PATH", help="把结果保存为 JSON 基线")
+    parser.add_argument("--compare", metavar="PATH", help="与 JSON 基线比较")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="允许的相对退化, 默认 0.25 (差 25%% 以内不算退化)",
+    )
+    args = parser.parse_args(argv)
+
+    cases = [
+        case
+        for case in CASES.values()
+        if (not args.quick or case.quick)
+        and (args.filter is None or re.search(args.filter, case.name))
+    ]
+    if args.list:
+        for case in cases:
+            print(case.name)
+        return 0
+
+    width = max(len(case.name) for case in cases)
+    results = run_cases(
+        cases,
+        report=lambda name, metrics: print(
+            f"{name:<{width}}  {format_metrics(metrics)}", flush=True
+        ),
+    )
+
+    if args.save:
+        save_baseline(args.save, results)
+        print(f"saved {len(results)} results to {args.save}")
+
+    if args.compare:
+        regressions = compare(results, load_baseline(args.compare), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressions (threshold {args.threshold:.0%}):")
+            for name, metric, base, value, worse in regressions:
+                if metric == "error":
+                    print(f"  {name} failed: {value}")
+                    continue
+                print(f"  {name} {metric}: {base:.4g} -> {value:.4g} ({worse:+.0%})")
+            return 1
+        print(f"\nno regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+from benchmarks import endpoints, environment, solvers
+
+# 用例名 -> Case, 按求解器、环境、Web 接口的顺序
+CASES = {
+    case.name: case
+    for module in (solvers, environment, endpoints)
+    for case in module.cases()
+}
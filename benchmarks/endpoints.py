@@ -0,0 +1,183 @@
+import os
+
+from benchmarks.runner import Case
+from benchmarks.solvers import DENSITY, SEED
+from sweep import make_env
+
+NUM_REQUESTS = 20
+
+
+def init_payload(size):
+    env = make_env({"env_size": [size, size], "density": DENSITY, "seed": SEED})
+    return dict(
+        algorithm="value_iteration",
+        env_size=[size, size],
+        start_state=list(env.start_state),
+        target_state=list(env.target_state),
+        forbidden_states=[list(s) for s in env.forbidden_states],
+        gamma=0.9,
+        theta=0.001,
+    )
+
+
+def make_client(cache=False):
+    """导入 Flask 应用并返回测试客户端; cache 为 False 时关闭求解缓存"""
+    os.environ["RL_SOLVE_CACHE_DIR"] = ""
+    if not cache:
+        os.environ["RL_SOLVE_CACHE_MB"] = "0"
+    from app import app
+
+    return app.test_client()
+
+
+def check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.status_code}: {response.get_data(as_text=True)}")
+    return response
+
+
+def init_setup(size):
+    def setup():
+        client = make_client()
+        payload = init_payload(size)
+
+        def run():
+            check(client.post("/api/init", json=payload))
+            return {"requests": 1}
+
+        return run
+
+    return setup
+
+
+def solve_setup(size, cache):
+    def setup():
+        client = make_client(cache)
+        payload = init_payload(size)
+        if cache:
+            check(client.post("/api/init", json=payload))
+            check(client.post("/api/run_value_iteration"))
+
+        def run():
+            check(client.post("/api/init", json=payload))
+            check(client.post("/api/run_value_iteration"))
+            return {"requests": 2}
+
+        return run
+
+    return setup
+
+
+def stream_setup(size):
+    def setup():
+        client = make_client()
+        payload = init_payload(size)
+
+        def run():
+            check(client.post("/api/init", json=payload))
+            response = check(client.get("/api/stream_iteration"))
+            # 读完整个事件流
+            response.get_data()
+            return {"requests": 2}
+
+        return run
+
+    return setup
+
+
+def step_iteration_setup(size, encoding):
+    def setup():
+        client = make_client()
+        payload = init_payload(size)
+
+        def run():
+            check(client.post("/api/init", json=payload))
+            since = None
+            for iteration in range(1, NUM_REQUESTS + 1):
+                check(
+                    client.post(
+                        "/api/step_iteration",
+                        json={"encoding": encoding, "since": since},
+                    )
+                )
+                since = iteration
+            return {"requests": NUM_REQUESTS + 1}
+
+        return run
+
+    return setup
+
+
+def get_iteration_setup(size, encoding):
+    def setup():
+        client = make_client()
+        check(client.post("/api/init", json=init_payload(size)))
+        check(client.post("/api/run_value_iteration"))
+
+        def run():
+            for iteration in range(1, NUM_REQUESTS + 1):
+                check(
+                    client.post(
+                        "/api/get_iteration",
+                        json={"iteration": iteration, "encoding": encoding},
+                    )
+                )
+            return {"requests": NUM_REQUESTS}
+
+        return run
+
+    return setup
+
+
+def rollout_setup(size):
+    def setup():
+        client = make_client()
+        check(client.post("/api/init", json=init_payload(size)))
+        check(client.post("/api/run_value_iteration"))
+
+        def run():
+            check(
+                client.post(
+                    "/api/rollout",
+                    json={
+                        "start_states": "all",
+                        "max_steps": 4 * size,
+                        "encoding": "binary",
+                        "seed": SEED,
+                    },
+                )
+            )
+            return {"requests": 1}
+
+        return run
+
+    return setup
+
+
+def cases():
+    return [
+        Case("web/init/50x50", init_setup(50), quick=True),
+        Case("web/run_value_iteration/50x50", solve_setup(50, cache=False), quick=True),
+        Case(
+            "web/run_value_iteration_cached/50x50",
+            solve_setup(50, cache=True),
+            quick=True,
+        ),
+        Case("web/stream_iteration/50x50", stream_setup(50), quick=True),
+        Case(
+            "web/step_iteration/100x100/binary",
+            step_iteration_setup(100, "binary"),
+            quick=True,
+        ),
+        Case(
+            "web/get_iteration/100x100/json",
+            get_iteration_setup(100, "json"),
+            quick=True,
+        ),
+        Case(
+            "web/get_iteration/100x100/binary",
+            get_iteration_setup(100, "binary"),
+            quick=True,
+        ),
+        Case("web/rollout/100x100", rollout_setup(100), quick=True),
+    ]
@@ -0,0 +1,146 @@
+import os
+import tempfile
+
+import numpy as np
+
+from benchmarks.runner import Case
+from benchmarks.solvers import DENSITY, SEED
+from grid_world import GridWorld, VectorGridWorld
+from maps import load_map
+from sweep import make_env
+
+# (边长, 每次运行的步数); 障碍物多的地图上 step 更慢, 少跑一些
+STEP_SIZES = ((5, 10000), (50, 10000), (200, 2000))
+VECTOR_SIZE = 200
+VECTOR_ENVS = 1024
+VECTOR_STEPS = 200
+MODEL_SIZE = 1000
+
+
+def make_map(size):
+    if size == 5:
+        # 默认的 5x5 地图
+        return GridWorld()
+    return make_env({"env_size": [size, size], "density": DENSITY, "seed": SEED})
+
+
+def step_setup(size, num_steps):
+    """GridWorld.step: 逐步执行随机动作, 与 Web 界面和示例脚本的用法相同"""
+
+    def setup():
+        env = make_map(size)
+        env.next_state_table
+        rng = np.random.default_rng(SEED)
+        actions = [env.action_space[a] for a in rng.integers(0, env.num_actions, num_steps)]
+
+        def run():
+            env.reset()
+            for action in actions:
+                env.step(action)
+            return {"steps": num_steps}
+
+        return run
+
+    return setup
+
+
+def transition_setup(size, num_steps):
+    """GridWorld.get_next_state_and_reward: 逐个查询 (s, a) 的转移"""
+
+    def setup():
+        env = make_map(size)
+        env.next_state_table
+        rng = np.random.default_rng(SEED)
+        states = rng.integers(0, env.num_states, num_steps).tolist()
+        actions = rng.integers(0, env.num_actions, num_steps).tolist()
+
+        def run():
+            for state, action in zip(states, actions):
+                env.get_next_state_and_reward(state, action)
+            return {"steps": num_steps}
+
+        return run
+
+    return setup
+
+
+def vector_step_setup():
+    """VectorGridWorld.step: VECTOR_ENVS 个智能体同时推进"""
+
+    def setup():
+        env = make_map(VECTOR_SIZE)
+        env.next_state_table
+        vec_env = VectorGridWorld(env, VECTOR_ENVS)
+        rng = np.random.default_rng(SEED)
+        actions = rng.integers(0, env.num_actions, (VECTOR_STEPS, VECTOR_ENVS))
+
+        def run():
+            vec_env.reset()
+            for step_actions in actions:
+                vec_env.step(step_actions)
+            return {"steps": VECTOR_STEPS * VECTOR_ENVS}
+
+        return run
+
+    return setup
+
+
+def build_model_setup():
+    """构建 1000x1000 地图的转移表"""
+
+    def setup():
+        env = make_map(MODEL_SIZE)
+
+        def run():
+            env.invalidate_model()
+            env.next_state_table
+            return {"states": env.num_states}
+
+        return run
+
+    return setup
+
+
+def load_map_setup():
+    """从 .npy 占用数组 (内存映射) 读入 1000x1000 地图并构建转移表"""
+
+    def setup():
+        env = make_map(MODEL_SIZE)
+        path = os.path.join(tempfile.mkdtemp(), "map.npy")
+        np.save(path, env.occupancy.mask())
+
+        def run():
+            loaded = load_map(path, target_state=env.target_state)
+            loaded.next_state_table
+            return {"states": loaded.num_states}
+
+        return run
+
+    return setup
+
+
+def cases():
+    result = []
+    for size, num_steps in STEP_SIZES:
+        result.append(
+            Case(f"env/step/{size}x{size}", step_setup(size, num_steps), quick=True)
+        )
+        result.append(
+            Case(
+                f"env/get_next_state_and_reward/{size}x{size}",
+                transition_setup(size, num_steps),
+                quick=True,
+            )
+        )
+    result.append(
+        Case(
+            f"env/vector_step/{VECTOR_SIZE}x{VECTOR_SIZE}x{VECTOR_ENVS}",
+            vector_step_setup(),
+            quick=True,
+        )
+    )
+    result.append(
+        Case(f"env/build_model/{MODEL_SIZE}x{MODEL_SIZE}", build_model_setup())
+    )
+    result.append(Case(f"env/load_map/{MODEL_SIZE}x{MODEL_SIZE}", load_map_setup()))
+    return result
@@ -0,0 +1,144 @@
+import json
+import math
+import platform
+import resource
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+class Case:
+    """
+    一个基准用例。
+
+    setup() 做不计时的准备工作, 返回 run; run() 执行一次被测的操作,
+    返回 {计数名: 数量} (例如 {"sweeps": 67}), 用于计算每秒的吞吐量。
+    quick 为 True 的用例在 --quick 时运行。
+    """
+
+    def __init__(self, name, setup, quick=False):
+        self.name = name
+        self.setup = setup
+        self.quick = quick
+
+
+# 重复运行直到累计耗时达到 MIN_TIME 秒, 至少 MIN_REPEAT 次, 最多 MAX_REPEAT 次;
+# 单次超过 SLOW_TIME 秒的用例只运行一次
+MIN_TIME = 0.5
+MIN_REPEAT = 3
+MAX_REPEAT = 100
+SLOW_TIME = 2.0
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位是 KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(case):
+    """在当前进程中运行一个用例, 返回指标字典"""
+    run = case.setup()
+
+    start_time = time.perf_counter()
+    counts = run()
+    times = [time.perf_counter() - start_time]
+    if times[0] < SLOW_TIME:
+        repeat = min(max(MIN_REPEAT, math.ceil(MIN_TIME / max(times[0], 1e-9))), MAX_REPEAT)
+        for _ in range(repeat - 1):
+            start_time = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start_time)
+
+    # 分配统计单独运行一次, 避免 tracemalloc 的开销影响计时
+    tracemalloc.start()
+    run()
+    _, alloc_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    wall_time = min(times)
+    metrics = dict(
+        wall_time=wall_time,
+        repeat=len(times),
+        peak_rss_mb=peak_rss_mb(),
+        alloc_peak_mb=alloc_peak / 1024**2,
+    )
+    for name, count in counts.items():
+        metrics[name] = count
+        metrics[f"{name}_per_sec"] = count / wall_time
+    return metrics
+
+
+def _measure_by_name(name):
+    from benchmarks.cases import CASES
+
+    return measure(CASES[name])
+
+
+def run_cases(cases, report=None):
+    """每个用例在一个新的子进程中依次运行, 返回 {用例名: 指标}"""
+    results = {}
+    # 一次只运行一个用例, 避免互相争抢 CPU 影响计时
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+        for case in cases:
+            try:
+                results[case.name] = executor.submit(_measure_by_name, case.name).result()
+            except Exception as error:
+                results[case.name] = dict(error=f"{type(error).__name__}: {error}")
+            if report is not None:
+                report(case.name, results[case.name])
+    return results
+
+
+def environment():
+    return dict(
+        python=platform.python_version(),
+        numpy=np.__version__,
+        platform=platform.platform(),
+        machine=platform.machine(),
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump(dict(environment=environment(), results=results), f, indent=2)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_sec")
+
+
+# 不参与比较的指标
+IGNORED_METRICS = ("repeat",)
+
+
+def compare(results, baseline, threshold):
+    """
+    返回 [(用例名, 指标, 基线值, 当前值, 变差的比例)], 只包含变差超过
+    threshold 的指标; 出错的用例也算作退化。
+    """
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        if "error" in metrics:
+            regressions.append((name, "error", None, metrics["error"], math.inf))
+            continue
+        for metric, base in baseline[name].items():
+            if metric in IGNORED_METRICS or metric not in metrics:
+                continue
+            value = metrics[metric]
+            if higher_is_better(metric):
+                worse = base / value - 1 if value > 0 else math.inf
+            else:
+                worse = value / base - 1 if base > 0 else (math.inf if value > 0 else 0.0)
+            if worse > threshold:
+                regressions.append((name, metric, base, value, worse))
+    return regressions
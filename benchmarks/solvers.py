@@ -0,0 +1,85 @@
+import contextlib
+import io
+
+from benchmarks.runner import Case
+from sweep import make_algorithm, make_env
+
+# 固定的障碍物密度和随机种子, 保证每次基准使用相同的地图
+DENSITY = 0.2
+SEED = 0
+SIZES = (5, 10, 20, 50, 100, 200, 500, 1000)
+QUICK_SIZE = 50
+
+# (算法类名, 构造参数, 额外参数, 障碍物密度, 最大边长)
+# 最大边长按单次运行不超过十几秒选取: 逐状态 Python 循环的算法只跑小地图。
+# MonteCarloGreedy 默认的内核采样把 episode 截断在 max_episode_length 步,
+# 随机障碍物围住的格子也能结束; kernels=None 时的 sample_episode 没有长度上限,
+# 这些格子会让 episode 无法结束, 所以只在没有障碍物的地图上运行
+SOLVERS = (
+    ("ValueIteration", {}, {}, DENSITY, 1000),
+    ("GaussSeidelValueIteration", {"order": "bfs"}, {}, DENSITY, 500),
+    ("PrioritizedSweeping", {}, {}, DENSITY, 500),
+    ("MultigridValueIteration", {}, {}, 0.0, 1000),
+    ("PolicyIteration", {}, {}, DENSITY, 20),
+    ("PolicyIteration", {"evaluation": "krylov"}, {}, DENSITY, 200),
+    ("TruncatedPolicyIteration", {}, {}, DENSITY, 10),
+    ("TruncatedPolicyIteration", {"truncation": "adaptive"}, {}, DENSITY, 100),
+    ("MonteCarloGreedy", {}, {"max_iterations": 1, "num_samples": 2}, DENSITY, 20),
+    (
+        "MonteCarloGreedy",
+        {"kernels": None},
+        {"max_iterations": 1, "num_samples": 2},
+        0.0,
+        5,
+    ),
+    (
+        "MonteCarloGreedy",
+        {"batched": True},
+        {"max_iterations": 20, "num_samples": 10},
+        DENSITY,
+        10,
+    ),
+)
+
+
+def case_name(algorithm, options, size):
+    suffix = "".join(f"-{key}={value}" for key, value in options.items())
+    return f"solver/{algorithm}{suffix}/{size}x{size}"
+
+
+def solver_setup(algorithm, options, extra, density, size):
+    def setup():
+        env = make_env({"env_size": [size, size], "density": density, "seed": SEED})
+        # 转移表在准备阶段建好, 不计入求解时间
+        env.next_state_table
+        params = dict(gamma=0.9, theta=0.001, seed=SEED, **extra)
+
+        def run():
+            solver = make_algorithm(env, algorithm, options, params)
+            # 屏蔽算法自己的进度输出
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+                io.StringIO()
+            ):
+                try:
+                    solver.iteration()
+                finally:
+                    if hasattr(solver, "close"):
+                        solver.close()
+            return {"sweeps": solver.current_iteration_num}
+
+        return run
+
+    return setup
+
+
+def cases():
+    return [
+        Case(
+            case_name(algorithm, options, size),
+            solver_setup(algorithm, options, extra, density, size),
+            quick=size <= QUICK_SIZE,
+        )
+        for algorithm, options, extra, density, max_size in SOLVERS
+        for size in SIZES
+        if size <= max_size
+    ]
@@ -7,6 +7,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 
+from occupancy import OccupancyGrid
+
 
 class Action:
     DOWN = (0, 1)
@@ -16,7 +18,32 @@ class Action:
     STAY = (0, 0)
 
 
+def model_field(name):
+    """
+    转移模型参数的属性, 值保存在 "_" + name 中, 赋值时使缓存的转移模型失效。
+    原地修改 (例如 forbidden_states.append) 不经过赋值, 需要手动调用 invalidate_model。
+    """
+    attribute = "_" + name
+
+    def get(self):
+        return getattr(self, attribute)
+
+    def set(self, value):
+        setattr(self, attribute, value)
+        self.invalidate_model()
+
+    return property(get, set)
+
+
 class GridWorld:
+    # 修改这些属性会使缓存的转移模型失效
+    env_size = model_field("env_size")
+    target_state = model_field("target_state")
+    forbidden_states = model_field("forbidden_states")
+    action_space = model_field("action_space")
+    reward_target = model_field("reward_target")
+    reward_forbidden = model_field("reward_forbidden")
+    reward_step = model_field("reward_step")
 
     def __init__(
         self,
@@ -26,11 +53,14 @@ class GridWorld:
         forbidden_states=[(2, 1), (3, 3), (1, 3)],
     ):
 
+        # 表格化的转移模型, 在第一次访问时构建
+        self._next_state_table = None
+        self._reward_table = None
+        self._occupancy = None
+
         self.env_size = env_size
-        self.num_states = env_size[0] * env_size[1]
         self.start_state = start_state
         self.target_state = target_state
-        self.target_state_idx = self.xy_to_state_idx(target_state[0], target_state[1])
         self.forbidden_states = forbidden_states
 
         self.agent_state = start_state
@@ -41,7 +71,6 @@ class GridWorld:
             Action.LEFT,
             Action.STAY,
         ]
-        self.num_actions = len(self.action_space)
 
         self.reward_target = 1
         self.reward_forbidden = -1
@@ -57,6 +86,104 @@ class GridWorld:
         self.color_trajectory = (0, 1, 0)
         self.color_agent = (0, 0, 1)
 
+    @property
+    def num_states(self):
+        return self.env_size[0] * self.env_size[1]
+
+    @property
+    def num_actions(self):
+        return len(self.action_space)
+
+    @property
+    def target_state_idx(self):
+        return self.xy_to_state_idx(self.target_state[0], self.target_state[1])
+
+    @property
+    def occupancy(self):
+        """
+        按位压缩的禁止状态网格 (OccupancyGrid), (x, y) in env.occupancy 是 O(1) 的。
+        forbidden_states 本身可以是 OccupancyGrid (例如 maps.load_map 读入的
+        大地图), 也可以是 (x, y) 列表, 列表在第一次访问时转换。
+        """
+        if self._occupancy is None:
+            if isinstance(self.forbidden_states, OccupancyGrid):
+                if self.forbidden_states.env_size != tuple(self.env_size):
+                    raise ValueError(
+                        f"Occupancy grid size {self.forbidden_states.env_size} "
+                        f"does not match env_size {tuple(self.env_size)}"
+                    )
+                self._occupancy = self.forbidden_states
+            else:
+                self._occupancy = OccupancyGrid.from_states(
+                    self.forbidden_states, self.env_size
+                )
+        return self._occupancy
+
+    def is_forbidden(self, x, y):
+        return self.occupancy.is_blocked(x, y)
+
+    @property
+    def next_state_table(self):
+        """next_state_table[s, a]: 在状态 s 执行动作 a 后到达的状态索引"""
+        if self._next_state_table is None:
+            self._build_model()
+        return self._next_state_table
+
+    @property
+    def reward_table(self):
+        """reward_table[s, a]: 在状态 s 执行动作 a 得到的即时奖励"""
+        if self._reward_table is None:
+            self._build_model()
+        return self._reward_table
+
+    def invalidate_model(self):
+        """
+        丢弃缓存的转移模型, 下次访问时重新构建。
+        原地修改地图 (例如 forbidden_states.append) 后需要手动调用。
+        """
+        self._next_state_table = None
+        self._reward_table = None
+        self._occupancy = None
+
+    def _build_model(self):
+        """一次性向量化地计算所有 (s, a) 的下一个状态和奖励"""
+        width, height = self.env_size
+        states = np.arange(self.num_states)
+        xs = states % width
+        ys = states // width
+
+        forbidden = self._forbidden_cells()
+
+        # 按列 (动作) 连续存储, 沿动作轴的 max/argmax 可以逐列进行
+        shape = (self.num_states, self.num_actions)
+        next_state_table = np.empty(shape, dtype=np.intp, order="F")
+        reward_table = np.empty(shape, dtype=np.float64, order="F")
+        for action_idx, (dx, dy) in enumerate(self.action_space):
+            new_xs = xs + dx
+            new_ys = ys + dy
+            # 撞墙: 留在原地并受到惩罚
+            out_of_bounds = (
+                (new_xs < 0) | (new_xs >= width) | (new_ys < 0) | (new_ys >= height)
+            )
+            new_states = np.where(out_of_bounds, states, new_ys * width + new_xs)
+            to_target = ~out_of_bounds & (new_states == self.target_state_idx)
+            # 进入禁止状态: 留在原地并受到惩罚
+            to_forbidden = ~out_of_bounds & ~to_target & forbidden[new_states]
+
+            next_state_table[:, action_idx] = np.where(to_forbidden, states, new_states)
+            reward_table[:, action_idx] = np.select(
+                [out_of_bounds | to_forbidden, to_target],
+                [self.reward_forbidden, self.reward_target],
+                default=self.reward_step,
+            )
+
+        self._next_state_table = next_state_table
+        self._reward_table = reward_table
+
+    def _forbidden_cells(self):
+        """按行主序展开的完整网格上的禁止状态掩码"""
+        return self.occupancy.mask().ravel()
+
     def reset(self):
         self.agent_state = self.start_state
         self.traj = [self.agent_state]
@@ -104,33 +231,10 @@ class GridWorld:
         return y * self.env_size[0] + x
 
     def get_next_state_and_reward(self, state_idx, action_idx):
-        action = self.action_space[action_idx]
-        state = self.state_idx_to_xy(state_idx)
-        x, y = state
-        new_state = (x + action[0], y + action[1])
-        if y + 1 > self.env_size[1] - 1 and action == Action.DOWN:  # down
-            y = self.env_size[1] - 1
-            reward = self.reward_forbidden
-        elif x + 1 > self.env_size[0] - 1 and action == Action.RIGHT:  # right
-            x = self.env_size[0] - 1
-            reward = self.reward_forbidden
-        elif y - 1 < 0 and action == Action.UP:  # up
-            y = 0
-            reward = self.reward_forbidden
-        elif x - 1 < 0 and action == Action.LEFT:  # left
-            x = 0
-            reward = self.reward_forbidden
-        elif new_state == self.target_state:  # stay
-            x, y = self.target_state
-            reward = self.reward_target
-        elif new_state in self.forbidden_states:  # stay
-            x, y = state
-            reward = self.reward_forbidden
-        else:
-            x, y = new_state
-            reward = self.reward_step
-
-        return self.xy_to_state_idx(x, y), reward
+        return (
+            int(self.next_state_table[state_idx, action_idx]),
+            self.reward_table[state_idx, action_idx].item(),
+        )
 
     def _is_done(self, state):
         return state == self.target_state
@@ -218,8 +322,7 @@ class GridWorld:
 
     def add_policy(self, policy_matrix):
         for state, state_action_group in enumerate(policy_matrix):
-            x = state % self.env_size[0]
-            y = state // self.env_size[0]
+            x, y = self.state_idx_to_xy(state)
             for i, action_probability in enumerate(state_action_group):
                 if action_probability != 0:
                     dx, dy = self.action_space[i]
@@ -253,8 +356,340 @@ class GridWorld:
         """
         values = np.round(values, precision)
         for i, value in enumerate(values):
-            x = i % self.env_size[0]
-            y = i // self.env_size[0]
+            x, y = self.state_idx_to_xy(i)
             self.ax.text(
                 x, y, str(value), ha="center", va="center", fontsize=10, color="black"
             )
+
+
+def reachable_cells(blocked, width, height, start_cell):
+    """
+    在完整网格上从 start_cell 出发做广度优先搜索, 返回可达格子的掩码。
+
+    blocked 和返回值都是按行主序展开的一维布尔数组; 每一层的所有边界格子
+    一起向四个方向扩展。
+    """
+    reachable = np.zeros(width * height, dtype=bool)
+    reachable[start_cell] = True
+    frontier = np.array([start_cell], dtype=np.intp)
+    while frontier.size:
+        xs = frontier % width
+        ys = frontier // width
+        neighbours = np.concatenate(
+            [
+                frontier[ys + 1 < height] + width,
+                frontier[xs + 1 < width] + 1,
+                frontier[ys > 0] - width,
+                frontier[xs > 0] - 1,
+            ]
+        )
+        neighbours = np.unique(neighbours[~blocked[neighbours]])
+        frontier = neighbours[~reachable[neighbours]]
+        reachable[frontier] = True
+    return reachable
+
+
+class SparseGridWorld(GridWorld):
+    """
+    只为从起点可达、且不是禁止状态的格子建立状态的 GridWorld。
+
+    状态索引是压缩后的索引: free_cells[s] 是状态 s 在完整网格中按行主序的
+    位置, state_idx_to_xy / xy_to_state_idx 负责与 (x, y) 坐标互相转换。
+    转移模型是确定性的, 每个状态恰好有 num_actions 条出边, 所以压缩后的
+    [S_free, A] 转移表就是行长固定、不需要行指针的 CSR 存储。
+    内存和计算量只与可达的空闲格子数量有关, 而不是网格面积。
+
+    forbidden_mask: 可选的 [height, width] 布尔数组, 与 forbidden_states 合并,
+    适合障碍物很多的地图。
+    """
+
+    start_state = model_field("start_state")
+    forbidden_mask = model_field("forbidden_mask")
+
+    def __init__(self, *args, forbidden_mask=None, **kwargs):
+        self._free_cells = None
+        self.forbidden_mask = forbidden_mask
+        super().__init__(*args, **kwargs)
+
+    @property
+    def num_states(self):
+        return len(self.free_cells)
+
+    @property
+    def free_cells(self):
+        """压缩后的状态索引 -> 完整网格中的行主序位置, 严格递增"""
+        if self._free_cells is None:
+            self._build_model()
+        return self._free_cells
+
+    def invalidate_model(self):
+        super().invalidate_model()
+        self._free_cells = None
+
+    def _forbidden_cells(self):
+        forbidden = super()._forbidden_cells()
+        if self.forbidden_mask is not None:
+            forbidden |= np.asarray(self.forbidden_mask, dtype=bool).ravel()
+        return forbidden
+
+    def state_idx_to_xy(self, state_idx):
+        cell = int(self.free_cells[state_idx])
+        return cell % self.env_size[0], cell // self.env_size[0]
+
+    def xy_to_state_idx(self, x, y):
+        cell = y * self.env_size[0] + x
+        state_idx = int(np.searchsorted(self.free_cells, cell))
+        if state_idx == len(self.free_cells) or self.free_cells[state_idx] != cell:
+            raise ValueError(f"State {(x, y)} is forbidden or unreachable")
+        return state_idx
+
+    def _build_model(self):
+        width, height = self.env_size
+        forbidden = self._forbidden_cells()
+        start_cell = self.start_state[1] * width + self.start_state[0]
+        target_cell = self.target_state[1] * width + self.target_state[0]
+        reachable = reachable_cells(forbidden, width, height, start_cell)
+        # 目标状态即使不可达也保留, 保证 target_state_idx 有效
+        reachable[target_cell] = True
+        free_cells = np.flatnonzero(reachable)
+        del forbidden, reachable
+
+        xs = free_cells % width
+        ys = free_cells // width
+        states = np.arange(len(free_cells))
+        target_state_idx = int(np.searchsorted(free_cells, target_cell))
+
+        shape = (len(free_cells), self.num_actions)
+        next_state_table = np.empty(shape, dtype=np.intp, order="F")
+        reward_table = np.empty(shape, dtype=np.float64, order="F")
+        for action_idx, (dx, dy) in enumerate(self.action_space):
+            new_xs = xs + dx
+            new_ys = ys + dy
+            out_of_bounds = (
+                (new_xs < 0) | (new_xs >= width) | (new_ys < 0) | (new_ys >= height)
+            )
+            new_cells = np.where(out_of_bounds, free_cells, new_ys * width + new_xs)
+            # 可达集合对合法移动是封闭的, 不在其中的相邻格子就是禁止状态
+            new_states = np.minimum(
+                np.searchsorted(free_cells, new_cells), len(free_cells) - 1
+            )
+            to_forbidden = ~out_of_bounds & (free_cells[new_states] != new_cells)
+            to_target = (
+                ~out_of_bounds & ~to_forbidden & (new_states == target_state_idx)
+            )
+
+            next_state_table[:, action_idx] = np.where(to_forbidden, states, new_states)
+            reward_table[:, action_idx] = np.select(
+                [out_of_bounds | to_forbidden, to_target],
+                [self.reward_forbidden, self.reward_target],
+                default=self.reward_step,
+            )
+
+        self._free_cells = free_cells
+        self._next_state_table = next_state_table
+        self._reward_table = reward_table
+
+
+def state_cells(env):
+    """每个状态在完整网格中按行主序的位置"""
+    if isinstance(env, SparseGridWorld):
+        return env.free_cells
+    return np.arange(env.num_states)
+
+
+class CoarseGridWorld(GridWorld):
+    """
+    coarsen_grid_world 得到的粗网格, 粗网格上的一步对应细网格上的 factor 步。
+
+    factor x factor 个细格子合并为一个粗格子, 细格子 (x, y) 属于粗格子
+    ((x + offset[0]) // factor, (y + offset[1]) // factor); offset 使细网格的
+    目标位于它所在粗格子的中心。进入目标只在最后一步得到奖励, 所以进入目标
+    的转移使用单独的 reward_enter_target, 停留在目标上仍然是 reward_target。
+    """
+
+    reward_enter_target = model_field("reward_enter_target")
+
+    def __init__(self, *args, factor=2, offset=(0, 0), **kwargs):
+        self.factor = factor
+        self.offset = offset
+        self.reward_enter_target = None
+        super().__init__(*args, **kwargs)
+
+    def _build_model(self):
+        super()._build_model()
+        if self.reward_enter_target is None:
+            return
+        target = self.target_state_idx
+        entering = self._next_state_table == target
+        entering[target] = False
+        self._reward_table[entering] = self.reward_enter_target
+
+
+def coarsen_grid_world(env, factor=3, gamma=0.9):
+    """
+    把 env 中每 factor x factor 个格子合并为一个格子, 返回 CoarseGridWorld。
+
+    合并前超过一半的格子是禁止状态时, 合并后的格子是禁止状态; 起点和目标
+    所在的格子总是空闲的。粗网格上的一步相当于细网格上的 factor 步: 粗网格的
+    折扣因子应为 gamma ** factor, 奖励是 factor 步的折扣奖励之和, 因此粗格子的
+    状态值与细网格中该格子中心的状态值大致相同。factor 为奇数时细网格的目标
+    正好是粗格子的中心。
+    """
+    width, height = env.env_size
+    target_x, target_y = env.target_state
+    offset = ((factor // 2 - target_x) % factor, (factor // 2 - target_y) % factor)
+    coarse_width = (width - 1 + offset[0]) // factor + 1
+    coarse_height = (height - 1 + offset[1]) // factor + 1
+
+    blocked = np.zeros((coarse_height * factor, coarse_width * factor), dtype=bool)
+    inside = np.zeros_like(blocked)
+    rows = slice(offset[1], offset[1] + height)
+    columns = slice(offset[0], offset[0] + width)
+    blocked[rows, columns] = env._forbidden_cells().reshape(height, width)
+    inside[rows, columns] = True
+    shape = (coarse_height, factor, coarse_width, factor)
+    coarse_mask = blocked.reshape(shape).sum(axis=(1, 3)) * 2 > inside.reshape(
+        shape
+    ).sum(axis=(1, 3))
+    del blocked, inside
+
+    def coarse_state(state):
+        return ((state[0] + offset[0]) // factor, (state[1] + offset[1]) // factor)
+
+    start_state = coarse_state(env.start_state)
+    target_state = coarse_state(env.target_state)
+    for x, y in (start_state, target_state):
+        coarse_mask[y, x] = False
+
+    coarse = CoarseGridWorld(
+        env_size=(coarse_width, coarse_height),
+        start_state=start_state,
+        target_state=target_state,
+        forbidden_states=OccupancyGrid.from_mask(coarse_mask),
+        factor=factor,
+        offset=offset,
+    )
+    # factor 步和前 factor - 1 步的折扣和
+    steps = (1 - gamma**factor) / (1 - gamma) if gamma < 1 else factor
+    leading = (1 - gamma ** (factor - 1)) / (1 - gamma) if gamma < 1 else factor - 1
+    reward_enter_target = getattr(env, "reward_enter_target", None)
+    if reward_enter_target is None:
+        reward_enter_target = env.reward_target
+    coarse.action_space = list(env.action_space)
+    coarse.reward_step = env.reward_step * steps
+    coarse.reward_forbidden = env.reward_forbidden * steps
+    coarse.reward_target = env.reward_target * steps
+    coarse.reward_enter_target = (
+        env.reward_step * leading + gamma ** (factor - 1) * reward_enter_target
+    )
+    return coarse
+
+
+class VectorGridWorld:
+    """
+    同时推进 num_envs 个智能体的 GridWorld。
+
+    智能体状态是 env 中的状态索引, 保存在一个整数数组里; step 用一次数组
+    索引完成所有智能体的转移。到达目标的智能体在下一步之前自动回到各自的
+    起始状态。env 可以是 GridWorld 或 SparseGridWorld。
+    """
+
+    def __init__(self, env, num_envs, start_states=None, record_trajectory=False):
+        """
+        start_states: 每个智能体的起始状态索引, 默认都是 env.start_state
+        record_trajectory: 是否记录每一步所有智能体的状态 (默认关闭)
+        """
+        self.env = env
+        self.num_envs = num_envs
+        if start_states is None:
+            start_states = env.xy_to_state_idx(env.start_state[0], env.start_state[1])
+        self.start_states = np.broadcast_to(
+            np.asarray(start_states, dtype=np.intp), (num_envs,)
+        ).copy()
+        self.record_trajectory = record_trajectory
+        self.states = self.start_states.copy()
+        self.traj = [self.states.copy()] if record_trajectory else None
+
+    def reset(self, start_states=None):
+        if start_states is not None:
+            self.start_states[:] = start_states
+        self.states = self.start_states.copy()
+        if self.record_trajectory:
+            self.traj = [self.states.copy()]
+        return self.states, {}
+
+    def step(self, actions):
+        """
+        actions: 长度为 num_envs 的动作索引数组
+
+        Returns:
+            next_states: 执行动作后到达的状态 (自动重置之前)
+            rewards: 即时奖励
+            dones: 是否到达目标状态; 这些智能体会被重置到起始状态
+        """
+        # 转移表按列存储, 展平成一维后用 a * S + s 索引
+        flat_idx = np.asarray(actions) * self.env.num_states + self.states
+        next_states = self.env.next_state_table.ravel(order="F")[flat_idx]
+        rewards = self.env.reward_table.ravel(order="F")[flat_idx]
+        dones = next_states == self.env.target_state_idx
+
+        self.states = np.where(dones, self.start_states, next_states)
+        if self.record_trajectory:
+            self.traj.append(next_states)
+
+        return next_states, rewards, dones, {}
+
+
+def rollout(env, actions, start_states, max_steps, epsilon=0.0, rng=None):
+    """
+    从每个起始状态出发, 按 actions 给出的确定性策略 (每个状态一个动作索引)
+    同时运行一个 episode; epsilon > 0 时每一步以 epsilon 的概率随机选择动作。
+    到达目标或走满 max_steps 步时该 episode 结束。
+
+    Returns:
+        states: [N, T + 1] 每个 episode 经过的状态索引, T 是最长的 episode 长度
+        actions: [N, T] 执行的动作索引
+        rewards: [N, T] 即时奖励
+        lengths: [N] 每个 episode 的步数, 之后的位置没有意义
+        reached: [N] 是否到达目标
+    """
+    if max_steps < 1:
+        raise ValueError(f"max_steps must be at least 1, got {max_steps}")
+    rng = np.random.default_rng() if rng is None else rng
+    actions = np.asarray(actions, dtype=np.intp)
+    vec_env = VectorGridWorld(env, len(start_states), start_states=start_states)
+    states, _ = vec_env.reset()
+
+    num_envs = vec_env.num_envs
+    lengths = np.full(num_envs, max_steps, dtype=np.intp)
+    reached = np.zeros(num_envs, dtype=bool)
+    state_steps = [states.copy()]
+    action_steps = []
+    reward_steps = []
+    for step in range(max_steps):
+        step_actions = actions[vec_env.states]
+        if epsilon > 0:
+            explore = rng.random(num_envs) < epsilon
+            step_actions = np.where(
+                explore, rng.integers(0, env.num_actions, num_envs), step_actions
+            )
+        next_states, rewards, dones, _ = vec_env.step(step_actions)
+        state_steps.append(next_states)
+        action_steps.append(step_actions)
+        reward_steps.append(rewards)
+
+        newly_done = dones & ~reached
+        lengths[newly_done] = step + 1
+        reached |= dones
+        if reached.all():
+            break
+        # 已经结束的 episode 停在目标上, 不随自动重置回到起点
+        vec_env.states[reached] = env.target_state_idx
+
+    return (
+        np.stack(state_steps, axis=1),
+        np.stack(action_steps, axis=1).astype(np.intp),
+        np.stack(reward_steps, axis=1),
+        lengths,
+        reached,
+    )
@@ -0,0 +1,324 @@
+import json
+import os
+
+import numpy as np
+
+# 保留策略
+# all: 保留每一次迭代
+# every: 只保留迭代次数是 every 的倍数的迭代
+# last: 只保留最近的 last 次迭代 (环形缓冲区)
+RETENTIONS = ("all", "every", "last")
+
+INDEX_FILE = "index.json"
+
+# 第一块数组 (initial_capacity 条记录) 的大小上限, 大状态空间上从更少的记录开始
+INITIAL_BLOCK_BYTES = 16 * 1024**2
+
+
+class IterationHistory:
+    """
+    按迭代保存状态值、策略和动作值的历史记录。
+
+    数据保存在预先分配的连续 NumPy 数组中, 第一块最多 initial_capacity 条记录,
+    且不超过 INITIAL_BLOCK_BYTES (至少 1 条), 容量不足时翻倍:
+        state_values: [T, S]
+        policy: [T, S], 只保存每个状态的最优动作索引
+        action_values: [T, S, A], 可选
+    另外每次迭代可以附带若干标量指标 (例如残差), 保存在 metrics 中。
+
+    指定 spill_dir 时, 这些数组都是 spill_dir 下的内存映射 .npy 文件,
+    index.json 记录容量、记录数等元数据; 用 IterationHistory.open(spill_dir)
+    可以只读地重新打开, 读取单条记录时只会访问对应的行。
+
+    history[i] 按保留下来的顺序返回第 i 条记录, 格式与原来的 dict 相同:
+    iteration, state_values, policy (one-hot 的 [S, A] 数组), action_values。
+    """
+
+    def __init__(
+        self,
+        num_states,
+        num_actions,
+        keep_action_values=True,
+        retention="all",
+        every=1,
+        last=None,
+        initial_capacity=16,
+        spill_dir=None,
+    ):
+        if retention not in RETENTIONS:
+            raise ValueError(
+                f"Unknown retention: {retention}, expected one of {RETENTIONS}"
+            )
+        if retention == "last" and not last:
+            raise ValueError("retention='last' requires last > 0")
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.keep_action_values = keep_action_values
+        self.retention = retention
+        self.every = every
+        self.last = last
+        self.policy_dtype = np.int8 if num_actions <= 127 else np.int32
+        if retention == "last":
+            self.initial_capacity = last
+        else:
+            self.initial_capacity = max(
+                1, min(initial_capacity, INITIAL_BLOCK_BYTES // self.row_nbytes)
+            )
+        self.spill_dir = spill_dir
+        self.read_only = False
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.capacity = 0
+        self.metrics = {}
+        self.clear()
+
+    @property
+    def row_nbytes(self):
+        """一条记录占用的字节数"""
+        nbytes = self.num_states * (8 + np.dtype(self.policy_dtype).itemsize) + 8
+        if self.keep_action_values:
+            nbytes += self.num_states * self.num_actions * 8
+        return nbytes
+
+    @classmethod
+    def open(cls, spill_dir):
+        """只读地打开 spill_dir 中已经写入的历史记录"""
+        with open(os.path.join(spill_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        history = cls.__new__(cls)
+        history.num_states = index["num_states"]
+        history.num_actions = index["num_actions"]
+        history.keep_action_values = index["keep_action_values"]
+        history.retention = index["retention"]
+        history.every = index["every"]
+        history.last = index["last"]
+        history.initial_capacity = index["initial_capacity"]
+        history.policy_dtype = np.dtype(index["policy_dtype"])
+        history.spill_dir = spill_dir
+        history.read_only = True
+        history.capacity = index["capacity"]
+        history._start = index["start"]
+        history._count = index["count"]
+        history.iterations = history._load("iterations")
+        history.state_values = history._load("state_values")
+        history.policy = history._load("policy")
+        history.action_values = (
+            history._load("action_values") if history.keep_action_values else None
+        )
+        history.metrics = {
+            name: history._load(f"metric_{name}") for name in index["metrics"]
+        }
+        return history
+
+    def _path(self, name, capacity=None):
+        capacity = self.capacity if capacity is None else capacity
+        return os.path.join(self.spill_dir, f"{name}.{capacity}.npy")
+
+    def _load(self, name):
+        return np.load(self._path(name), mmap_mode="r")
+
+    def _array(self, name, shape, dtype, fill=0):
+        """分配一个 [capacity, ...] 的数组, spill_dir 不为 None 时使用内存映射文件"""
+        if self.spill_dir is None:
+            return np.full(shape, fill, dtype=dtype)
+        array = np.lib.format.open_memmap(
+            self._path(name), mode="w+", dtype=dtype, shape=shape
+        )
+        if fill != 0:
+            array[:] = fill
+        return array
+
+    def _arrays(self):
+        arrays = dict(
+            iterations=self.iterations,
+            state_values=self.state_values,
+            policy=self.policy,
+        )
+        if self.keep_action_values:
+            arrays["action_values"] = self.action_values
+        for name, column in self.metrics.items():
+            arrays[f"metric_{name}"] = column
+        return arrays
+
+    def _remove_files(self, capacity, names):
+        """删除某个容量下的内存映射文件"""
+        for name in names:
+            path = self._path(name, capacity)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        if self.spill_dir is not None and self.capacity:
+            self._remove_files(self.capacity, list(self._arrays()))
+        self._start = 0  # 环形缓冲区中最早一条记录的位置
+        self._count = 0
+        self._allocate(self.initial_capacity)
+        self._write_index()
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.iterations = self._array("iterations", (capacity,), np.int64)
+        self.state_values = self._array(
+            "state_values", (capacity, self.num_states), np.float64
+        )
+        self.policy = self._array(
+            "policy", (capacity, self.num_states), self.policy_dtype
+        )
+        self.action_values = (
+            self._array(
+                "action_values",
+                (capacity, self.num_states, self.num_actions),
+                np.float64,
+            )
+            if self.keep_action_values
+            else None
+        )
+        self.metrics = {}
+
+    def _grow(self):
+        """容量翻倍, 并把已有记录复制到新数组的开头"""
+        old_capacity = self.capacity
+        old_metrics = self.metrics
+        old = self._arrays()
+        self._allocate(self.capacity * 2)
+        self.iterations[: self._count] = old["iterations"]
+        self.state_values[: self._count] = old["state_values"]
+        self.policy[: self._count] = old["policy"]
+        if self.keep_action_values:
+            self.action_values[: self._count] = old["action_values"]
+        for name, column in old_metrics.items():
+            self.metrics[name] = self._array(
+                f"metric_{name}", (self.capacity,), np.float64, np.nan
+            )
+            self.metrics[name][: self._count] = column
+        if self.spill_dir is not None:
+            self._remove_files(old_capacity, list(old))
+
+    def _write_index(self):
+        if self.spill_dir is None:
+            return
+        index = dict(
+            num_states=self.num_states,
+            num_actions=self.num_actions,
+            keep_action_values=self.keep_action_values,
+            retention=self.retention,
+            every=self.every,
+            last=self.last,
+            initial_capacity=self.initial_capacity,
+            policy_dtype=np.dtype(self.policy_dtype).name,
+            capacity=self.capacity,
+            start=self._start,
+            count=self._count,
+            metrics=list(self.metrics),
+        )
+        # 先写临时文件再替换, 读者不会看到写了一半的索引
+        path = os.path.join(self.spill_dir, INDEX_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+
+    def append(self, iteration, state_values, policy, action_values, **metrics):
+        if self.read_only:
+            raise ValueError("history opened with IterationHistory.open is read-only")
+        if self.retention == "every" and iteration % self.every != 0:
+            return
+
+        if self.retention == "last" and self._count == self.capacity:
+            # 覆盖最早的一条记录
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+        else:
+            if self._count == self.capacity:
+                self._grow()
+            slot = (self._start + self._count) % self.capacity
+            self._count += 1
+
+        self.iterations[slot] = iteration
+        self.state_values[slot] = state_values
+        self.policy[slot] = np.argmax(np.asarray(policy), axis=1)
+        if self.keep_action_values:
+            self.action_values[slot] = action_values
+        for name, value in metrics.items():
+            if name not in self.metrics:
+                self.metrics[name] = self._array(
+                    f"metric_{name}", (self.capacity,), np.float64, np.nan
+                )
+            self.metrics[name][slot] = value
+        self._write_index()
+
+    def _slot(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("history index out of range")
+        return (self._start + index) % self.capacity
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        slot = self._slot(index)
+        policy = np.zeros((self.num_states, self.num_actions), dtype=np.int8)
+        policy[np.arange(self.num_states), self.policy[slot]] = 1
+        item = dict(
+            iteration=int(self.iterations[slot]),
+            state_values=self.state_values[slot],
+            policy=policy,
+            action_values=(
+                self.action_values[slot] if self.keep_action_values else None
+            ),
+        )
+        for name, column in self.metrics.items():
+            item[name] = float(column[slot])
+        return item
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def export(self):
+        """按保留顺序导出所有记录, 返回一个数组字典, 可以传给 load 恢复"""
+        slots = (self._start + np.arange(self._count)) % self.capacity
+        arrays = dict(
+            iterations=self.iterations[slots],
+            state_values=self.state_values[slots],
+            policy=self.policy[slots],
+        )
+        if self.keep_action_values:
+            arrays["action_values"] = self.action_values[slots]
+        for name, column in self.metrics.items():
+            arrays[f"metric_{name}"] = column[slots]
+        return arrays
+
+    def load(self, arrays):
+        """用 export 导出的数组替换当前的全部记录"""
+        count = len(arrays["iterations"])
+        capacity = self.initial_capacity
+        while capacity < count:
+            capacity *= 2
+        if self.spill_dir is not None and self.capacity:
+            self._remove_files(self.capacity, list(self._arrays()))
+        self._start = 0
+        self._count = count
+        self._allocate(capacity)
+        self.iterations[:count] = arrays["iterations"]
+        self.state_values[:count] = arrays["state_values"]
+        self.policy[:count] = arrays["policy"]
+        if self.keep_action_values and "action_values" in arrays:
+            self.action_values[:count] = arrays["action_values"]
+        for key, column in arrays.items():
+            if key.startswith("metric_"):
+                name = key[len("metric_") :]
+                self.metrics[name] = self._array(key, (capacity,), np.float64, np.nan)
+                self.metrics[name][:count] = column
+        self._write_index()
+
+    def metric(self, name):
+        """按保留顺序返回某个标量指标的所有值"""
+        slots = (self._start + np.arange(self._count)) % self.capacity
+        return self.metrics[name][slots]
+
+    @property
+    def nbytes(self):
+        """已分配的历史记录占用的字节数 (内存映射时是文件大小)"""
+        return sum(array.nbytes for array in self._arrays().values())
@@ -1,35 +1,135 @@
-import copy
-import random
 from abc import abstractmethod
 
+import numpy as np
+
+from history import IterationHistory
+from instrumentation import SolverStats, timed
+
+BACKENDS = ("numpy", "python")
+
+
+def greedy_actions(action_values):
+    """
+    返回每个状态 action value 最大的动作索引。
+
+    逐列比较而不是 np.argmax: 对按列存储的 [S, A] 数组更快, 并且与
+    max(enumerate(...)) 的语义一致 (并列时取第一个动作, NaN 不会胜出)。
+    """
+    best_actions = np.zeros(action_values.shape[0], dtype=np.intp)
+    best_values = action_values[:, 0]
+    for action in range(1, action_values.shape[1]):
+        better = action_values[:, action] > best_values
+        best_actions[better] = action
+        best_values = np.where(better, action_values[:, action], best_values)
+    return best_actions
+
 
 class Iteration:
-    def __init__(self, env, theta=0.001, gamma=0.9, max_iterations=1000):
+    def __init__(
+        self,
+        env,
+        theta=0.001,
+        gamma=0.9,
+        max_iterations=1000,
+        backend="numpy",
+        seed=None,
+        history=None,
+        instrument=False,
+    ):
+        """
+        backend:
+            "numpy": 状态值、动作值和策略保存为 NumPy 数组, 整个 sweep 用数组运算完成
+            "python": 原始的逐状态、逐动作 Python 循环实现
+        seed: 随机数种子, 用于初始策略和需要采样的算法; None 表示不固定
+        history: 保存迭代历史的 IterationHistory, None 表示保留全部迭代
+        instrument: 是否统计各阶段的耗时和 backup 次数, 见 statistics()
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}, expected one of {BACKENDS}")
         self.env = env
         self.theta = theta
         self.gamma = gamma
         self.max_iterations = max_iterations
-        self.state_values = [0] * env.num_states
-        self.action_values = [[0] * env.num_actions for _ in range(env.num_states)]
-        self.policy = [
-            [random.randint(0, env.num_actions - 1) for _ in range(env.num_actions)]
-            for _ in range(env.num_states)
-        ]
-        self.iteration_history = []  # 保存每次迭代的状态值和策略
+        self.backend = backend
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        policy = self.rng.integers(
+            0, env.num_actions, size=(env.num_states, env.num_actions)
+        )
+        if backend == "numpy":
+            self.state_values = np.zeros(env.num_states)
+            self.action_values = np.zeros((env.num_states, env.num_actions))
+            self.policy = policy
+        else:
+            self.state_values = [0] * env.num_states
+            self.action_values = [[0] * env.num_actions for _ in range(env.num_states)]
+            self.policy = policy.tolist()
+        # 保存每次迭代的状态值和策略
+        if history is None:
+            history = IterationHistory(env.num_states, env.num_actions)
+        self.iteration_history = history
+        self.stats = SolverStats(enabled=instrument)
+
+    def statistics(self):
+        """计数器、各阶段耗时和迭代历史占用的字节数"""
+        result = self.stats.to_dict()
+        result["history_nbytes"] = self.iteration_history.nbytes
+        return result
 
+    @timed("history")
     def add_iteration_history(
-        self, iteration: int, state_values: list, policy: list, action_values: list
+        self,
+        iteration: int,
+        state_values: list,
+        policy: list,
+        action_values: list,
+        **metrics,
     ):
         self.iteration_history.append(
-            dict(
-                iteration=iteration,
-                state_values=copy.deepcopy(state_values),
-                policy=copy.deepcopy(policy),
-                action_values=copy.deepcopy(action_values),
-            )
+            iteration, state_values, policy, action_values, **metrics
         )
 
+    @timed("q_values")
+    def update_action_values(self):
+        """
+        计算每个 (s, a) 的 action value: q(s, a) = r(s, a) + gamma * V(s')
+        """
+        self.stats.add(sweeps=1, backups=self.env.num_states)
+        next_state_table = self.env.next_state_table
+        reward_table = self.env.reward_table
+        if self.backend == "numpy":
+            self.action_values = reward_table + self.gamma * self.state_values[
+                next_state_table
+            ]
+            return
+
+        for state in range(self.env.num_states):
+            for action in range(self.env.num_actions):
+                next_state = next_state_table[state, action]
+                reward = reward_table[state, action]
+                q_value = reward + self.gamma * self.state_values[next_state]
+                self.action_values[state][action] = q_value
+
+    @timed("value_update")
+    def update_state_values(self):
+        """
+        V(s) = max_a q(s, a)
+        """
+        if self.backend == "numpy":
+            self.state_values = self.action_values.max(axis=1)
+        else:
+            self.state_values = [
+                max(action_values) for action_values in self.action_values
+            ]
+
+    @timed("policy_update")
     def policy_update(self):
+        if self.backend == "numpy":
+            best_actions = greedy_actions(self.action_values)
+            self.policy = np.zeros(self.action_values.shape, dtype=np.int8)
+            self.policy[np.arange(self.env.num_states), best_actions] = 1
+            return
+
         best_actions = [
             max(enumerate(action_values), key=lambda x: x[1])[0]
             for action_values in self.action_values
@@ -39,17 +139,23 @@ class Iteration:
                 1 if a == best_action else 0 for a in range(self.env.num_actions)
             ]
 
+    @timed("convergence")
     def check_state_values_convergence(
         self, old_state_values: list, new_state_values: list
     ):
         """
         Check if the state values are converged.
         """
+        if self.backend == "numpy":
+            return not np.any(
+                np.abs(np.subtract(old_state_values, new_state_values)) > self.theta
+            )
         for i in range(len(old_state_values)):
             if abs(old_state_values[i] - new_state_values[i]) > self.theta:
                 return False
         return True
 
+    @timed("convergence")
     def check_policy_convergence(self, old_policy: list, new_policy: list):
         """
         Check if the policy is converged.
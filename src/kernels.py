@@ -0,0 +1,165 @@
+"""
+可选的 JIT 编译内核。
+
+安装了 numba 时, 用 @jit 标记的函数编译为 nopython 机器码, 编译结果缓存在
+__pycache__ 中, 进程重启后不需要重新编译; 没有 numba 时原样作为 Python 函数运行。
+内核只使用标量运算和一维数组/列表, 同一份代码在两种方式下的结果完全相同。
+
+算法通过 kernels 参数选择:
+    "numba": 使用编译后的内核, 没有安装 numba 时报错
+    "python": 以普通 Python 函数运行同一份内核代码
+    "auto": 有 numba 时为 "numba", 否则为 "python"
+"""
+
+import time
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+HAVE_NUMBA = numba is not None
+
+KERNEL_MODES = ("auto", "numba", "python")
+
+# Park-Miller 最小标准随机数生成器的参数: state = state * 48271 % (2^31 - 1)。
+# 乘积小于 2^47, 在 Python 整数和 numba 的 int64 中结果相同
+LCG_MULTIPLIER = 48271
+LCG_MODULUS = 2147483647
+
+
+def jit(function):
+    """numba 可用时编译为 nopython 函数, 否则原样返回"""
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+def resolve_kernels(kernels):
+    """把 kernels 参数解析为 "numba" 或 "python", None 保持不变"""
+    if kernels is None:
+        return None
+    if kernels not in KERNEL_MODES:
+        raise ValueError(f"Unknown kernels: {kernels}, expected one of {KERNEL_MODES}")
+    if kernels == "auto":
+        return "numba" if HAVE_NUMBA else "python"
+    if kernels == "numba" and not HAVE_NUMBA:
+        raise ValueError("kernels='numba' requires numba to be installed")
+    return kernels
+
+
+def kernel(function, mode):
+    """返回 mode 下要调用的函数: numba 时是编译后的函数, python 时是原始函数"""
+    if mode == "python":
+        return getattr(function, "py_func", function)
+    return function
+
+
+def capabilities():
+    """当前环境中可用的内核后端"""
+    return {
+        "numba": numba.__version__ if HAVE_NUMBA else None,
+        "modes": ["numba", "python"] if HAVE_NUMBA else ["python"],
+    }
+
+
+@jit
+def gauss_seidel_sweep(order, indptr, move_rewards, move_next, self_values, values, gamma):
+    """
+    按 order 原地更新 values, 与 GaussSeidelValueIteration.sweep 相同:
+        V(s) = max(self_values[s], max_k move_rewards[k] + gamma * V(move_next[k]))
+    其中 k 遍历 indptr[s] : indptr[s + 1] (离开 s 的转移, CSR 格式)。
+    """
+    for i in range(order.shape[0]):
+        state = order[i]
+        best = self_values[state]
+        for k in range(indptr[state], indptr[state + 1]):
+            value = move_rewards[k] + gamma * values[move_next[k]]
+            if value > best:
+                best = value
+        values[state] = best
+
+
+@jit
+def sample_returns(
+    next_states,
+    rewards,
+    num_states,
+    target_state,
+    greedy_actions,
+    state,
+    action,
+    seeds,
+    gamma,
+    epsilon,
+    max_length,
+):
+    """
+    从 (state, action) 出发采样 len(seeds) 个 epsilon-greedy episode,
+    返回折扣回报的平均值。
+
+    next_states / rewards 是按列展平的转移表 (下标 action * num_states + state);
+    每个 episode 用 seeds 中的一个种子初始化 Park-Miller 生成器,
+    超过 max_length 步的 episode 被截断。
+    """
+    num_actions = len(next_states) // num_states
+    total = 0.0
+    for i in range(len(seeds)):
+        rng_state = seeds[i]
+        current_state = state
+        current_action = action
+        return_ = 0.0
+        discount = 1.0
+        for _ in range(max_length):
+            index = current_action * num_states + current_state
+            next_state = next_states[index]
+            return_ += discount * rewards[index]
+            discount *= gamma
+            if next_state == target_state:
+                break
+            current_state = next_state
+            rng_state = rng_state * LCG_MULTIPLIER % LCG_MODULUS
+            if rng_state / LCG_MODULUS > epsilon:
+                current_action = greedy_actions[current_state]
+            else:
+                rng_state = rng_state * LCG_MULTIPLIER % LCG_MODULUS
+                current_action = rng_state % num_actions
+        total += return_
+    return total / len(seeds)
+
+
+def warm_up():
+    """
+    用与实际调用相同类型的小输入调用每个内核, 触发编译 (或读取编译缓存),
+    返回耗时 (秒)。没有 numba 时什么也不做。
+    """
+    start_time = time.perf_counter()
+    if not HAVE_NUMBA:
+        return 0.0
+    order = np.arange(2, dtype=np.intp)
+    indptr = np.array([0, 1, 1], dtype=np.intp)
+    gauss_seidel_sweep(
+        order,
+        indptr,
+        np.zeros(1),
+        np.array([1], dtype=np.intp),
+        np.full(2, -np.inf),
+        np.zeros(2),
+        0.9,
+    )
+    sample_returns(
+        np.array([1, 1], dtype=np.intp),
+        np.zeros(2),
+        2,
+        1,
+        np.zeros(2, dtype=np.intp),
+        0,
+        0,
+        np.ones(1, dtype=np.int64),
+        0.9,
+        0.1,
+        10,
+    )
+    return time.perf_counter() - start_time
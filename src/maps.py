@@ -0,0 +1,155 @@
+"""
+从文件读入地图, 创建 GridWorld。
+
+支持的格式 (按文件扩展名区分):
+    .txt / .map: ASCII 地图, 每行一行格子。"#" "@" "O" "T" "W" 是禁止状态,
+        其他字符是空闲格子; "S" 和 "G" 分别标记起点和目标。以 "type" 开头的
+        MovingAI 格式 (type / height / width / map 文件头) 中 S、G、T 等按该
+        格式的含义处理, 不作为起点和目标的标记。
+    .npy: [height, width] 数组, 非零表示禁止; 以内存映射方式读取, 按行分块压缩。
+    .png: 黑白掩码, 灰度小于 0.5 的像素是禁止状态。
+
+地图在内存中保存为 OccupancyGrid (每个格子 1 bit)。
+"""
+
+import io
+import os
+
+import matplotlib.image
+import numpy as np
+
+from grid_world import GridWorld, SparseGridWorld
+from occupancy import OccupancyGrid
+
+MAP_SUFFIXES = (".txt", ".map", ".npy", ".png")
+
+# ASCII 地图中的禁止状态
+BLOCKED_CHARS = "#@OTW"
+# MovingAI 格式中只有这些字符可以通行
+MOVINGAI_FREE_CHARS = ".GS"
+
+
+def read_ascii(lines):
+    """
+    lines: 可迭代的文本行
+
+    Returns:
+        occupancy: OccupancyGrid
+        start_state / target_state: "S" / "G" 标记的 (x, y), 没有标记时为 None
+    """
+    lines = [line.rstrip("\r\n") for line in lines]
+    movingai = bool(lines) and lines[0].startswith("type")
+    if movingai:
+        lines = lines[lines.index("map") + 1 :]
+    lines = [line for line in lines if line]
+    if not lines:
+        raise ValueError("Empty map")
+    width = max(len(line) for line in lines)
+
+    start_state = target_state = None
+    mask = np.zeros((len(lines), width), dtype=bool)
+    for y, line in enumerate(lines):
+        # 比其他行短的行用禁止状态补齐
+        mask[y, len(line) :] = True
+        row = np.frombuffer(line.encode("ascii"), dtype=np.uint8)
+        if movingai:
+            free = np.isin(row, np.frombuffer(MOVINGAI_FREE_CHARS.encode(), np.uint8))
+            mask[y, : len(line)] = ~free
+            continue
+        mask[y, : len(line)] = np.isin(
+            row, np.frombuffer(BLOCKED_CHARS.encode(), np.uint8)
+        )
+        if "S" in line:
+            start_state = (line.index("S"), y)
+        if "G" in line:
+            target_state = (line.index("G"), y)
+    return OccupancyGrid.from_mask(mask), start_state, target_state
+
+
+def read_npy(source):
+    """source 是路径时以内存映射方式读取, 也可以是文件对象"""
+    if isinstance(source, (str, os.PathLike)):
+        mask = np.load(source, mmap_mode="r", allow_pickle=False)
+    else:
+        mask = np.load(source, allow_pickle=False)
+    return OccupancyGrid.from_mask(mask)
+
+
+def read_png(source):
+    image = matplotlib.image.imread(source, format="png")
+    if image.ndim == 3:
+        # 忽略 alpha 通道, RGB 取平均作为灰度
+        image = image[..., :3].mean(axis=2)
+    if image.dtype == np.uint8:
+        image = image / 255
+    return OccupancyGrid.from_mask(image < 0.5)
+
+
+def read_map(source, name=None):
+    """
+    按 name (默认为 source 本身) 的扩展名读取地图。
+
+    source: 路径或二进制文件对象
+
+    Returns:
+        occupancy, start_state, target_state (只有 ASCII 地图可能标记起点和目标)
+    """
+    suffix = os.path.splitext(str(name if name is not None else source))[1].lower()
+    if suffix in (".txt", ".map"):
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, encoding="ascii") as f:
+                return read_ascii(f)
+        return read_ascii(io.TextIOWrapper(source, encoding="ascii"))
+    if suffix == ".npy":
+        return read_npy(source), None, None
+    if suffix == ".png":
+        return read_png(source), None, None
+    raise ValueError(f"Unknown map format: {suffix!r}, expected one of {MAP_SUFFIXES}")
+
+
+def load_map(source, name=None, start_state=None, target_state=None, sparse=False):
+    """
+    读取地图并创建 GridWorld (sparse 为 True 时创建 SparseGridWorld)。
+
+    起点和目标依次取参数、地图中的标记, 默认分别是左上角和右下角;
+    它们必须在网格内并且不是禁止状态。
+    """
+    occupancy, marked_start, marked_target = read_map(source, name)
+    width, height = occupancy.env_size
+    if start_state is None:
+        start_state = marked_start or (0, 0)
+    if target_state is None:
+        target_state = marked_target or (width - 1, height - 1)
+    start_state, target_state = tuple(start_state), tuple(target_state)
+    for label, (x, y) in (("start", start_state), ("target", target_state)):
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError(f"{label} state {(x, y)} is outside the {width}x{height} map")
+        if occupancy.is_blocked(x, y):
+            raise ValueError(f"{label} state {(x, y)} is forbidden")
+
+    env_class = SparseGridWorld if sparse else GridWorld
+    return env_class(
+        env_size=(width, height),
+        start_state=start_state,
+        target_state=target_state,
+        forbidden_states=occupancy,
+    )
+
+
+def list_maps(directory):
+    """directory 中的地图文件名 (即地图 id), 目录不存在时为空列表"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in MAP_SUFFIXES
+        and os.path.isfile(os.path.join(directory, name))
+    )
+
+
+def map_path(directory, map_id):
+    """地图 id 对应的路径; 只接受 list_maps 列出的 id, 避免访问目录之外的文件"""
+    if map_id not in list_maps(directory):
+        raise ValueError(f"Unknown map: {map_id}")
+    return os.path.join(directory, map_id)
@@ -1,17 +1,264 @@
 import copy
-import random
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
 from tqdm import tqdm
 
 from grid_world import GridWorld
+from instrumentation import timed
+from iteration import greedy_actions as greedy_action_indices
+from kernels import LCG_MODULUS, kernel, resolve_kernels, sample_returns
 from value_iteration import PolicyIteration
 
 
+def batched_returns(
+    next_state_table,
+    reward_table,
+    target_state_idx,
+    greedy_actions,
+    start_states,
+    start_actions,
+    gamma,
+    epsilon,
+    max_episode_length,
+    rng,
+):
+    """
+    从每个 (start_states[i], start_actions[i]) 出发同时采样一个 epsilon-greedy
+    episode, 返回每个 episode 的折扣回报。
+
+    所有 episode 作为数组一起推进, 每个时间步只处理还没有到达目标的 episode;
+    超过 max_episode_length 步的 episode 被截断。
+    """
+    num_actions = next_state_table.shape[1]
+    returns = np.zeros(len(start_states))
+    active = np.arange(len(start_states))
+    states = np.asarray(start_states)
+    actions = np.asarray(start_actions)
+    discount = 1.0
+    for _ in range(max_episode_length):
+        next_states = next_state_table[states, actions]
+        returns[active] += discount * reward_table[states, actions]
+        discount *= gamma
+
+        # 到达目标的 episode 结束
+        running = next_states != target_state_idx
+        active = active[running]
+        if active.size == 0:
+            break
+        states = next_states[running]
+
+        # epsilon-greedy 选择下一个动作
+        explore = rng.random(active.size) <= epsilon
+        actions = np.where(
+            explore,
+            rng.integers(0, num_actions, size=active.size),
+            greedy_actions[states],
+        )
+    return returns
+
+
+def batched_trajectories(
+    next_state_table,
+    reward_table,
+    target_state_idx,
+    greedy_actions,
+    start_states,
+    start_actions,
+    gamma,
+    epsilon,
+    max_episode_length,
+    rng,
+):
+    """
+    与 batched_returns 相同地同时采样多个 episode, 但保留整条轨迹。
+
+    Returns:
+        pairs (np.ndarray): [T, N], 第 i 个 episode 第 t 步的 s * num_actions + a,
+            episode 结束之后为 -1
+        returns (np.ndarray): [T, N], 第 t 步之后的折扣回报
+    """
+    num_actions = next_state_table.shape[1]
+    num_episodes = len(start_states)
+    active = np.arange(num_episodes)
+    states = np.asarray(start_states)
+    actions = np.asarray(start_actions)
+    pair_steps = []
+    reward_steps = []
+    for _ in range(max_episode_length):
+        pairs = np.full(num_episodes, -1)
+        pairs[active] = states * num_actions + actions
+        rewards = np.zeros(num_episodes)
+        rewards[active] = reward_table[states, actions]
+        pair_steps.append(pairs)
+        reward_steps.append(rewards)
+        next_states = next_state_table[states, actions]
+
+        # 到达目标的 episode 结束
+        running = next_states != target_state_idx
+        active = active[running]
+        if active.size == 0:
+            break
+        states = next_states[running]
+
+        # epsilon-greedy 选择下一个动作
+        explore = rng.random(active.size) <= epsilon
+        actions = np.where(
+            explore,
+            rng.integers(0, num_actions, size=active.size),
+            greedy_actions[states],
+        )
+
+    # 结束之后的奖励为 0, 从最后一步向前累加即可
+    returns = np.empty((len(reward_steps), num_episodes))
+    return_ = np.zeros(num_episodes)
+    for t in range(len(reward_steps) - 1, -1, -1):
+        return_ = return_ * gamma + reward_steps[t]
+        returns[t] = return_
+    return np.array(pair_steps), returns
+
+
+# 进程池中每个 worker 的只读数据, 由 _init_worker 在 worker 启动时设置一次
+_worker = {}
+
+
+def _worker_state(
+    next_state_table,
+    reward_table,
+    target_state_idx,
+    policy_shm,
+    gamma,
+    epsilon,
+    num_samples,
+    max_episode_length,
+):
+    """_estimate_pairs 使用的只读数据, 贪心策略是 policy_shm 上的数组"""
+    return dict(
+        next_state_table=next_state_table,
+        reward_table=reward_table,
+        target_state_idx=target_state_idx,
+        policy_shm=policy_shm,
+        greedy_actions=np.ndarray(
+            (next_state_table.shape[0],), dtype=np.intp, buffer=policy_shm.buf
+        ),
+        gamma=gamma,
+        epsilon=epsilon,
+        num_samples=num_samples,
+        max_episode_length=max_episode_length,
+    )
+
+
+def _init_worker(
+    next_state_table, reward_table, target_state_idx, policy_shm_name, *args
+):
+    """
+    进程池的 initializer: 转移表在每个 worker 启动时只传输一次,
+    贪心策略通过共享内存读取, 每次迭代由主进程原地更新。
+    args 是 _worker_state 在 policy_shm 之后的参数
+    """
+    policy_shm = shared_memory.SharedMemory(name=policy_shm_name)
+    _worker.update(
+        _worker_state(
+            next_state_table, reward_table, target_state_idx, policy_shm, *args
+        )
+    )
+
+
+def _release_workers(pool, policy_shm, worker):
+    """关闭进程池并释放共享内存; 由 MonteCarloGreedy.close 或对象回收时调用"""
+    if pool is not None:
+        pool.shutdown()
+    if worker is not None:
+        # 先释放共享内存上的数组, 否则 close 会因为还有引用而失败
+        worker.clear()
+    policy_shm.close()
+    policy_shm.unlink()
+
+
+def _estimate_pairs(pairs, iteration, entropy, worker=None):
+    """
+    估计一组 (s, a) 的 q 值, pairs 中的元素是 s * num_actions + a。
+
+    每个 (s, a) 使用由 (entropy, iteration, pair) 派生的独立随机数流,
+    因此结果与 worker 数量以及任务的划分方式无关。
+    worker 为 None 时使用进程池 worker 中由 _init_worker 设置的数据。
+    """
+    worker = _worker if worker is None else worker
+    num_actions = worker["next_state_table"].shape[1]
+    num_samples = worker["num_samples"]
+    q_values = np.empty(len(pairs))
+    for i, pair in enumerate(pairs):
+        rng = np.random.default_rng(
+            np.random.SeedSequence(entropy, spawn_key=(iteration, int(pair)))
+        )
+        returns = batched_returns(
+            worker["next_state_table"],
+            worker["reward_table"],
+            worker["target_state_idx"],
+            worker["greedy_actions"],
+            np.full(num_samples, pair // num_actions),
+            np.full(num_samples, pair % num_actions),
+            worker["gamma"],
+            worker["epsilon"],
+            worker["max_episode_length"],
+            rng,
+        )
+        q_values[i] = returns.mean()
+    return q_values
+
+
+# q 值的估计方式
+# start: 每个 episode 只用于更新起点的 (s, a)
+# first: 每个 episode 中的每个 (s, a) 用第一次出现之后的回报更新
+# every: 每个 episode 中的每个 (s, a) 每次出现都用之后的回报更新
+VISIT_MODES = ("start", "first", "every")
+
+
 class MonteCarloGreedy(PolicyIteration):
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        batched=False,
+        num_workers=None,
+        visit="start",
+        kernels="auto",
+        **kwargs,
+    ):
+        """
+        batched: 为 True 时, 每次迭代把所有 (s, a) 的所有 episode 作为数组一起采样
+        num_workers: 不为 None 时, 把 (s, a) 分给 num_workers 个进程并行估计;
+            同一个 seed 下的结果与 num_workers 无关。进程池和共享内存由 close()
+            释放, 没有调用 close 时在对象被回收或进程退出时释放
+        visit: q 值的估计方式, 见 VISIT_MODES; first/every 复用整条轨迹, 总是
+            批量采样 (与 batched 无关), 不使用 kernels, 不支持 num_workers
+        kernels: 逐个 (s, a) 采样使用的 kernels.sample_returns 后端
+            (见 kernels.KERNEL_MODES), 与 GaussSeidelValueIteration 一样默认 "auto";
+            每个 episode 的随机数由 self.rng 派生的种子决定, 同一个 seed 下
+            "numba" 和 "python" 的结果相同。episode 长度限制为
+            max_episode_length。None 时使用原来的 sample_episode
+        """
+        if visit not in VISIT_MODES:
+            raise ValueError(f"Unknown visit: {visit}, expected one of {VISIT_MODES}")
+        if visit != "start" and num_workers is not None:
+            raise ValueError(f"visit={visit!r} does not support num_workers")
         super().__init__(*args, **kwargs)
+        self.visit = visit
         self.epsilon = 0.1
         self.max_iterations = 1000
+        self.num_samples = 100  # 每个 (s, a) 采样的 episode 数
+        self.batched = batched
+        self.batch_size = 1 << 16  # 批量采样时一次同时推进的 episode 数上限
+        self.max_episode_length = 1000  # 批量、内核和 first/every-visit 采样的最大长度
+        self.num_workers = num_workers
+        self.kernels = resolve_kernels(kernels)
+        # 并行估计时派生每个 (s, a) 随机数流的熵, 由 seed 决定
+        self.entropy = int(self.rng.integers(2**63))
+        self._pool = None
+        self._policy_shm = None
+        self._worker = None  # num_workers 为 1 时当前进程中的 worker 数据
+        self._finalizer = None
 
     def step_iteration(self):
         """
@@ -22,25 +269,17 @@ class MonteCarloGreedy(PolicyIteration):
         """
         # 如果是第一次迭代，清空历史记录
         if self.current_iteration_num == 0:
-            self.iteration_history = []
+            self.iteration_history.clear()
 
         # 检查是否超过最大迭代次数
         if self.current_iteration_num >= self.max_iterations:
+            self.close()
             return True
 
         old_state_values = copy.deepcopy(self.state_values)
 
         # 估计值
-        for state in range(self.env.num_states):
-            for action in range(self.env.num_actions):
-                # 采样从 (s, a) 出发的多个 episode
-                q_value = self.sample_episode(state, action, num_samples=100)
-                self.action_values[state][action] = q_value
-
-            self.state_values[state] = max(self.action_values[state])
-
-            # policy update
-            self.policy_update()
+        self.estimation()
 
         # 增加迭代次数
         self.current_iteration_num += 1
@@ -55,68 +294,329 @@ class MonteCarloGreedy(PolicyIteration):
         converged = self.check_state_values_convergence(
             old_state_values, self.state_values
         )
+        # 收敛或者达到最大迭代次数后不会再有下一次迭代, 释放进程池和共享内存;
+        # 之后继续调用时会重新创建
+        if converged or self.current_iteration_num >= self.max_iterations:
+            self.close()
         return converged
 
     def iteration(self):
         # 重置迭代次数
         self.current_iteration_num = 0
-        self.iteration_history = []
+        self.iteration_history.clear()
 
         # k 次迭代
-        for iter_num in tqdm(range(self.max_iterations), desc="Iterations"):
-            old_state_values = copy.deepcopy(self.state_values)
+        try:
+            for iter_num in tqdm(range(self.max_iterations), desc="Iterations"):
+                old_state_values = copy.deepcopy(self.state_values)
+
+                # 估计值
+                self.estimation(verbose=True)
+
+                # 增加迭代次数
+                self.current_iteration_num += 1
+
+                self.add_iteration_history(
+                    self.current_iteration_num,
+                    self.state_values,
+                    self.policy,
+                    self.action_values,
+                )
+                if self.check_state_values_convergence(
+                    old_state_values, self.state_values
+                ):
+                    break
+        finally:
+            self.close()
+
+    @timed("estimation")
+    def estimation(self, verbose=False):
+        """
+        估计所有 (s, a) 的 q 值, 并更新状态值和策略
+        """
+        if self.visit != "start":
+            self.visit_estimation()
+            return
+        if self.num_workers is not None:
+            self.parallel_estimation()
+            return
+        if self.batched:
+            self.batched_estimation()
+            return
+        if self.kernels is not None:
+            self.kernel_estimation(verbose)
+            return
 
-            # 估计值
-            for state in range(self.env.num_states):
+        for state in range(self.env.num_states):
+            if verbose:
                 print(f"Estimating state {state} of {self.env.num_states}")
-                for action in range(self.env.num_actions):
-                    # 采样从 (s, a) 出发的多个 episode
-                    q_value = self.sample_episode(state, action, num_samples=100)
-                    self.action_values[state][action] = q_value
+            for action in range(self.env.num_actions):
+                # 采样从 (s, a) 出发的多个 episode
+                q_value = self.sample_episode(
+                    state, action, num_samples=self.num_samples
+                )
+                self.action_values[state][action] = q_value
+
+            self.state_values[state] = max(self.action_values[state])
+
+            # policy update
+            self.policy_update()
 
-                self.state_values[state] = max(self.action_values[state])
+    def kernel_estimation(self, verbose=False):
+        """
+        与逐个 (s, a) 采样的 estimation 相同: 按状态顺序估计 q 值, 每估计完一个
+        状态就更新策略, 后面的状态使用更新后的策略采样。episode 由编译后的
+        (或 Python 的) sample_returns 采样。
+        """
+        num_states, num_actions = self.env.num_states, self.env.num_actions
+        next_states = self.env.next_state_table.ravel(order="F")
+        rewards = self.env.reward_table.ravel(order="F")
+        greedy = np.argmax(np.asarray(self.policy), axis=1)
+        action_values = np.array(self.action_values, dtype=np.float64)
+        python = self.kernels == "python"
+        if python:
+            # Python 内核逐个元素访问, 列表比 NumPy 数组快得多
+            next_states, rewards, greedy = (
+                next_states.tolist(),
+                rewards.tolist(),
+                greedy.tolist(),
+            )
+        sample = kernel(sample_returns, self.kernels)
+
+        for state in range(num_states):
+            if verbose:
+                print(f"Estimating state {state} of {num_states}")
+            for action in range(num_actions):
+                seeds = self.rng.integers(1, LCG_MODULUS, size=self.num_samples)
+                action_values[state, action] = sample(
+                    next_states,
+                    rewards,
+                    num_states,
+                    self.env.target_state_idx,
+                    greedy,
+                    state,
+                    action,
+                    seeds.tolist() if python else seeds,
+                    self.gamma,
+                    self.epsilon,
+                    self.max_episode_length,
+                )
+            self.stats.add(episodes=num_actions * self.num_samples)
+
+            # 与 estimation 中每个状态之后调用 policy_update 等价: 第一个状态之后
+            # 策略变为所有状态当前 q 值的贪心策略, 之后只有刚估计的状态改变
+            if state == 0:
+                greedy = greedy_action_indices(action_values)
+                if python:
+                    greedy = greedy.tolist()
+            else:
+                greedy[state] = int(np.argmax(action_values[state]))
 
-                # policy update
-                self.policy_update()
+        self.set_action_values(action_values)
+        self.update_state_values()
+        self.policy_update()
 
-            # 增加迭代次数
-            self.current_iteration_num += 1
+    def set_action_values(self, action_values):
+        if self.backend == "numpy":
+            self.action_values = action_values
+        else:
+            self.action_values = action_values.tolist()
 
-            self.add_iteration_history(
-                self.current_iteration_num,
-                self.state_values,
-                self.policy,
-                self.action_values,
+    def parallel_estimation(self):
+        """
+        在进程池中估计所有 (s, a) 的 q 值, 然后更新状态值和策略。
+
+        num_workers 为 1 时在当前进程中运行, 结果与多进程相同。
+        """
+        num_pairs = self.env.num_states * self.env.num_actions
+        if self._policy_shm is None:
+            self._start_workers()
+        greedy_actions = np.ndarray(
+            (self.env.num_states,), dtype=np.intp, buffer=self._policy_shm.buf
+        )
+        greedy_actions[:] = np.argmax(np.asarray(self.policy), axis=1)
+
+        # 每个 worker 分到若干块, 以平衡 episode 长度不同带来的负载差异
+        num_chunks = min(num_pairs, self.num_workers * 4)
+        chunks = np.array_split(np.arange(num_pairs), num_chunks)
+        if self._pool is None:
+            results = [
+                _estimate_pairs(
+                    chunk, self.current_iteration_num, self.entropy, self._worker
+                )
+                for chunk in chunks
+            ]
+        else:
+            results = self._pool.map(
+                _estimate_pairs,
+                chunks,
+                [self.current_iteration_num] * num_chunks,
+                [self.entropy] * num_chunks,
             )
-            if self.check_state_values_convergence(old_state_values, self.state_values):
-                break
+        action_values = np.concatenate(list(results))
+        self.stats.add(episodes=num_pairs * self.num_samples)
+
+        self.set_action_values(
+            action_values.reshape(self.env.num_states, self.env.num_actions)
+        )
+        self.update_state_values()
+        self.policy_update()
+
+    def _start_workers(self):
+        self._policy_shm = shared_memory.SharedMemory(
+            create=True, size=self.env.num_states * np.dtype(np.intp).itemsize
+        )
+        initargs = (
+            self.env.next_state_table,
+            self.env.reward_table,
+            self.env.target_state_idx,
+            self._policy_shm.name,
+            self.gamma,
+            self.epsilon,
+            self.num_samples,
+            self.max_episode_length,
+        )
+        if self.num_workers > 1:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                initializer=_init_worker,
+                initargs=initargs,
+            )
+        else:
+            # 在当前进程中运行, worker 数据属于这个对象, 不使用模块级的 _worker
+            self._worker = _worker_state(*initargs[:3], self._policy_shm, *initargs[4:])
+        # 没有调用 close 就丢弃对象 (或者进程退出) 时也会释放
+        self._finalizer = weakref.finalize(
+            self, _release_workers, self._pool, self._policy_shm, self._worker
+        )
+
+    def close(self):
+        """关闭进程池并释放共享内存"""
+        if self._finalizer is not None:
+            self._finalizer()
+        self._pool = None
+        self._policy_shm = None
+        self._worker = None
+        self._finalizer = None
+
+    def batched_estimation(self):
+        """
+        用同一个 (迭代开始时的) 策略, 批量估计所有 (s, a) 的 q 值,
+        然后更新状态值和策略
+        """
+        num_states, num_actions = self.env.num_states, self.env.num_actions
+        greedy_actions = np.argmax(np.asarray(self.policy), axis=1)
+
+        # 第 i 个 episode 的起点是第 i // num_samples 个 (s, a)
+        pairs_per_batch = max(1, self.batch_size // self.num_samples)
+        action_values = np.empty(num_states * num_actions)
+        for begin in range(0, num_states * num_actions, pairs_per_batch):
+            pairs = np.arange(begin, min(begin + pairs_per_batch, len(action_values)))
+            starts = np.repeat(pairs, self.num_samples)
+            returns = batched_returns(
+                self.env.next_state_table,
+                self.env.reward_table,
+                self.env.target_state_idx,
+                greedy_actions,
+                starts // num_actions,
+                starts % num_actions,
+                self.gamma,
+                self.epsilon,
+                self.max_episode_length,
+                self.rng,
+            )
+            action_values[pairs] = returns.reshape(-1, self.num_samples).mean(axis=1)
+            self.stats.add(episodes=len(starts))
+
+        self.set_action_values(action_values.reshape(num_states, num_actions))
+        self.update_state_values()
+        self.policy_update()
+
+    def visit_estimation(self):
+        """
+        first-visit / every-visit 估计: 每条轨迹经过的所有 (s, a) 都累加回报和次数。
+
+        所有 episode 用 batched_trajectories 一起采样: 第一轮从每个 (s, a) 各出发
+        一个 episode, 之后每轮从累计次数还少于 num_samples 的 (s, a) 出发补足
+        差额, 直到每个 (s, a) 都有 num_samples 次。经常被其他轨迹经过的 (s, a)
+        不需要自己的 episode, 所以 episode 数少于 start 模式。轨迹按 [T, N]
+        保存, 每轮最多 batch_size // 64 个 episode。
+        """
+        num_states, num_actions = self.env.num_states, self.env.num_actions
+        num_pairs = num_states * num_actions
+        greedy_actions = np.argmax(np.asarray(self.policy), axis=1)
+        returns_sum = np.zeros(num_pairs)
+        counts = np.zeros(num_pairs, dtype=np.int64)
+        episodes_per_round = max(1, self.batch_size // 64)
+
+        pending = np.arange(num_pairs)
+        first_round = True
+        while pending.size:
+            if first_round:
+                starts = pending
+            else:
+                starts = np.repeat(pending, self.num_samples - counts[pending])
+            first_round = False
+            starts = starts[:episodes_per_round]
+            pairs, returns = batched_trajectories(
+                self.env.next_state_table,
+                self.env.reward_table,
+                self.env.target_state_idx,
+                greedy_actions,
+                starts // num_actions,
+                starts % num_actions,
+                self.gamma,
+                self.epsilon,
+                self.max_episode_length,
+                self.rng,
+            )
+            self.stats.add(episodes=len(starts))
+            steps, episodes = np.nonzero(pairs >= 0)
+            if self.visit == "first":
+                # 按时间顺序排列, np.unique 返回每个 episode 中每个 (s, a)
+                # 第一次出现的位置
+                keys = episodes * num_pairs + pairs[steps, episodes]
+                _, first_idx = np.unique(keys, return_index=True)
+                steps, episodes = steps[first_idx], episodes[first_idx]
+            visited = pairs[steps, episodes]
+            returns_sum += np.bincount(
+                visited, weights=returns[steps, episodes], minlength=num_pairs
+            )
+            counts += np.bincount(visited, minlength=num_pairs)
+            pending = np.flatnonzero(counts < self.num_samples)
+
+        action_values = returns_sum / counts
+        self.set_action_values(action_values.reshape(num_states, num_actions))
+        self.update_state_values()
+        self.policy_update()
 
     def sample_episode(self, state, action, num_samples):
         """
         采样从 (s, a) 出发的多个 episode, 返回 q(s, a) 的估计值
         """
         q_value = 0.0
+        next_state_table = self.env.next_state_table
+        reward_table = self.env.reward_table
 
         # 采样 num_samples 次
+        self.stats.add(episodes=num_samples)
         for _ in range(num_samples):
-            print(f"Sampling episode {_} of {num_samples}")
             current_state = state
             current_action = action
             trajectory = []
             while True:
-                next_state, reward = self.env.get_next_state_and_reward(
-                    current_state, current_action
-                )
+                next_state = next_state_table[current_state, current_action]
+                reward = reward_table[current_state, current_action]
                 trajectory.append((current_state, reward))
                 if next_state == self.env.target_state_idx:
                     break
 
                 current_state = next_state
 
-                if np.random.rand() > self.epsilon:
+                if self.rng.random() > self.epsilon:
                     current_action = np.argmax(self.policy[next_state])
                 else:
-                    current_action = random.randint(0, self.env.num_actions - 1)
+                    current_action = self.rng.integers(self.env.num_actions)
 
             # 计算轨迹的回报
             return_ = 0.0
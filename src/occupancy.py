@@ -0,0 +1,90 @@
+import numpy as np
+
+# from_mask 每次压缩的格子数上限, 内存映射的输入一次只读入这么多
+PACK_CHUNK_CELLS = 1 << 22
+
+
+class OccupancyGrid:
+    """
+    按位压缩的占用网格: 每个格子 1 bit, 1 表示禁止状态。
+
+    bits 是 [height, ceil(width / 8)] 的 uint8 数组, 第 y 行第 x 列的格子是
+    bits[y, x >> 3] 的第 (x & 7) 位 (低位在前)。(x, y) in grid 是 O(1) 的查找,
+    遍历时按行主序产生禁止状态的 (x, y), 因此可以直接作为 GridWorld 的
+    forbidden_states 使用。
+    """
+
+    def __init__(self, bits, width, height):
+        bits = np.asarray(bits, dtype=np.uint8)
+        if bits.shape != (height, (width + 7) // 8):
+            raise ValueError(
+                f"bits shape {bits.shape} does not match a {width}x{height} grid"
+            )
+        self.bits = bits
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def from_mask(cls, mask):
+        """
+        mask: [height, width] 数组, 非零表示禁止。可以是内存映射的数组,
+        按行分块压缩, 不会把整个数组读入内存。
+        """
+        if np.ndim(mask) != 2:
+            raise ValueError(f"Occupancy mask must be 2-D, got shape {np.shape(mask)}")
+        height, width = mask.shape
+        bits = np.empty((height, (width + 7) // 8), dtype=np.uint8)
+        rows = max(1, PACK_CHUNK_CELLS // max(width, 1))
+        for start in range(0, height, rows):
+            chunk = np.asarray(mask[start : start + rows]) != 0
+            bits[start : start + rows] = np.packbits(chunk, axis=1, bitorder="little")
+        return cls(bits, width, height)
+
+    @classmethod
+    def from_states(cls, states, env_size):
+        """由 (x, y) 列表创建, 网格外的坐标被忽略"""
+        width, height = env_size
+        mask = np.zeros((height, width), dtype=bool)
+        states = np.asarray(list(states), dtype=np.intp).reshape(-1, 2)
+        xs, ys = states[:, 0], states[:, 1]
+        inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        mask[ys[inside], xs[inside]] = True
+        return cls.from_mask(mask)
+
+    @property
+    def env_size(self):
+        return (self.width, self.height)
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def is_blocked(self, x, y):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return False
+        return bool(self.bits[y, x >> 3] >> (x & 7) & 1)
+
+    def __contains__(self, state):
+        x, y = state
+        return self.is_blocked(x, y)
+
+    def mask(self):
+        """[height, width] 布尔数组"""
+        return np.unpackbits(
+            self.bits, axis=1, count=self.width, bitorder="little"
+        ).view(bool)
+
+    def cells(self):
+        """禁止状态在完整网格中按行主序的位置"""
+        return np.flatnonzero(self.mask())
+
+    def __iter__(self):
+        for cell in self.cells().tolist():
+            yield (cell % self.width, cell // self.width)
+
+    def __len__(self):
+        # 每行末尾补齐的位都是 0, 不影响计数
+        return int(np.unpackbits(self.bits).sum())
+
+    def __repr__(self):
+        return f"OccupancyGrid({self.width}x{self.height}, {len(self)} blocked)"
@@ -0,0 +1,387 @@
+"""
+在多个进程中批量运行 地图 x 算法 x 超参数 的组合, 每次运行写一行结果。
+
+用法:
+    cd src
+    python sweep.py sweep.json -o results.csv -j 4
+
+sweep.json 示例:
+    {
+        "maps": [
+            {"env_size": [5, 5], "forbidden_states": [[2, 1], [3, 3], [1, 3]]},
+            {"env_size": [50, 50], "target_state": [49, 49],
+             "density": 0.2, "seed": 0, "count": 10}
+        ],
+        "algorithms": [
+            "ValueIteration",
+            {"name": "TruncatedPolicyIteration", "truncation": "adaptive"}
+        ],
+        "params": {"gamma": [0.9, 0.99], "theta": [0.001]}
+    }
+
+maps、algorithms 和 params 中每个参数的取值列表做笛卡尔积; 也可以用
+"runs": [{"map": {...}, "algorithm": ..., "params": {...}}, ...] 显式列出
+每一次运行, 两种写法可以同时使用。
+
+地图:
+    env_size / start_state / target_state / forbidden_states 与 GridWorld 相同;
+    density 和 seed 表示按 seed 随机生成禁止状态, 每个格子以 density 的概率
+    被禁止 (起点和目标除外); count 把一项展开成 seed, seed + 1, ... 共 count
+    张地图; sparse 为 True 时使用 SparseGridWorld。file 表示从文件读入地图
+    (见 maps.py), 此时只使用 start_state / target_state / sparse。
+算法:
+    value_iteration.py 和 monte_carlo_iteration.py 中的算法类名, 或者带 name
+    的字典, 其余的键作为构造参数 (例如 order、truncation、evaluation)。
+参数:
+    Iteration 构造函数接受的参数 (gamma, theta, max_iterations, seed, backend)
+    直接传入; 其他参数在构造之后设置为算法的属性 (例如 truncated_iterations、
+    num_samples), 算法没有该属性时这次运行失败。
+
+每次运行有一个由地图、算法和参数决定的 run_id。输出文件已经存在时, 其中
+status 为 done (以及 failed, 除非指定 --retry-failed) 的运行会被跳过, 所以
+中断后用同样的命令重新运行即可继续。每次运行在一个新的子进程中执行,
+peak_rss_mb 是该进程的峰值常驻内存, baseline_rss_mb 是开始求解前的值。
+env_size 取自构造出的环境, map_file 是从文件读入时的地图文件名。
+"""
+
+import argparse
+import csv
+import hashlib
+import inspect
+import itertools
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from grid_world import GridWorld, SparseGridWorld
+from history import IterationHistory
+from maps import load_map
+from occupancy import OccupancyGrid
+from monte_carlo_iteration import MonteCarloGreedy
+from value_iteration import (
+    GaussSeidelValueIteration,
+    MultigridValueIteration,
+    PolicyIteration,
+    PrioritizedSweeping,
+    TruncatedPolicyIteration,
+    ValueIteration,
+)
+
+ALGORITHMS = {
+    cls.__name__: cls
+    for cls in (
+        ValueIteration,
+        PolicyIteration,
+        TruncatedPolicyIteration,
+        GaussSeidelValueIteration,
+        PrioritizedSweeping,
+        MultigridValueIteration,
+        MonteCarloGreedy,
+    )
+}
+
+# 单独成列的参数, 其余参数和算法的构造参数一起记在 options 列中
+PARAM_COLUMNS = ("gamma", "theta", "max_iterations", "seed")
+
+COLUMNS = (
+    "run_id",
+    "algorithm",
+    "options",
+    *PARAM_COLUMNS,
+    "env_size",
+    "map",
+    "map_file",
+    "num_states",
+    "status",
+    "iterations",
+    "wall_time",
+    "peak_rss_mb",
+    "baseline_rss_mb",
+    "start_value",
+    "error",
+)
+
+
+def canonical(value):
+    """固定键顺序的紧凑 JSON, 用于 run_id 和 CSV 中的字典列"""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def expand_maps(maps):
+    """把带 count 的地图展开成 count 张 seed 依次加一的地图"""
+    expanded = []
+    for spec in maps:
+        spec = dict(spec)
+        count = spec.pop("count", 1)
+        if count == 1:
+            expanded.append(spec)
+            continue
+        seed = spec.get("seed", 0)
+        for offset in range(count):
+            expanded.append(dict(spec, seed=seed + offset))
+    return expanded
+
+
+def expand_runs(spec):
+    """按 sweep 配置列出所有运行, 返回 [{map, algorithm, options, params}]"""
+    runs = []
+    maps = expand_maps(spec.get("maps", []))
+    algorithms = spec.get("algorithms", [])
+    params = spec.get("params", {})
+    names = list(params)
+    for map_spec, algorithm, values in itertools.product(
+        maps, algorithms, itertools.product(*(params[name] for name in names))
+    ):
+        runs.append(
+            dict(map=map_spec, algorithm=algorithm, params=dict(zip(names, values)))
+        )
+    for run in spec.get("runs", []):
+        for map_spec in expand_maps([run["map"]]):
+            runs.append(
+                dict(
+                    map=map_spec,
+                    algorithm=run["algorithm"],
+                    params=run.get("params", {}),
+                )
+            )
+
+    for run in runs:
+        algorithm = run["algorithm"]
+        if isinstance(algorithm, str):
+            algorithm = {"name": algorithm}
+        options = {k: v for k, v in algorithm.items() if k != "name"}
+        run["algorithm"] = algorithm["name"]
+        run["options"] = options
+        if run["algorithm"] not in ALGORITHMS:
+            raise ValueError(
+                f"Unknown algorithm: {run['algorithm']}, expected one of {list(ALGORITHMS)}"
+            )
+        run["run_id"] = hashlib.sha256(
+            canonical(
+                [run["map"], run["algorithm"], run["options"], run["params"]]
+            ).encode("utf-8")
+        ).hexdigest()[:16]
+    return runs
+
+
+def make_env(map_spec):
+    if "file" in map_spec:
+        return load_map(
+            map_spec["file"],
+            start_state=map_spec.get("start_state"),
+            target_state=map_spec.get("target_state"),
+            sparse=map_spec.get("sparse", False),
+        )
+    env_size = tuple(map_spec.get("env_size", (5, 5)))
+    width, height = env_size
+    start_state = tuple(map_spec.get("start_state", (0, 0)))
+    target_state = tuple(map_spec.get("target_state", (width - 1, height - 1)))
+    forbidden_states = [tuple(s) for s in map_spec.get("forbidden_states", [])]
+    forbidden_mask = None
+    if "density" in map_spec:
+        rng = np.random.default_rng(map_spec.get("seed", 0))
+        forbidden_mask = rng.random((height, width)) < map_spec["density"]
+        for x, y in (start_state, target_state):
+            forbidden_mask[y, x] = False
+
+    if map_spec.get("sparse", False):
+        return SparseGridWorld(
+            env_size=env_size,
+            start_state=start_state,
+            target_state=target_state,
+            forbidden_states=forbidden_states,
+            forbidden_mask=forbidden_mask,
+        )
+    if forbidden_mask is not None:
+        forbidden_mask |= OccupancyGrid.from_states(forbidden_states, env_size).mask()
+        forbidden_states = OccupancyGrid.from_mask(forbidden_mask)
+    return GridWorld(
+        env_size=env_size,
+        start_state=start_state,
+        target_state=target_state,
+        forbidden_states=forbidden_states,
+    )
+
+
+def constructor_parameters(cls):
+    """cls 及其父类的 __init__ 接受的关键字参数名"""
+    names = set()
+    for klass in cls.__mro__:
+        if "__init__" in vars(klass):
+            names.update(inspect.signature(klass.__init__).parameters)
+    return names
+
+
+def make_algorithm(env, name, options, params):
+    cls = ALGORITHMS[name]
+    accepted = constructor_parameters(cls)
+    kwargs = dict(options)
+    kwargs.update((key, value) for key, value in params.items() if key in accepted)
+    # 只需要最终结果, 历史记录只保留最后一次迭代, 避免它主导内存峰值
+    kwargs.setdefault(
+        "history",
+        IterationHistory(
+            env.num_states,
+            env.num_actions,
+            keep_action_values=False,
+            retention="last",
+            last=1,
+        ),
+    )
+    algorithm = cls(env, **kwargs)
+    # 子类可能在构造函数中覆盖参数 (例如 MonteCarloGreedy.max_iterations),
+    # 所以构造之后再设置一次
+    for key, value in params.items():
+        if hasattr(algorithm, key):
+            setattr(algorithm, key, value)
+        elif key not in accepted:
+            raise ValueError(f"{name} has no parameter or attribute {key!r}")
+    return algorithm
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位是 KiB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def execute(run):
+    """在子进程中执行一次运行, 返回一行结果"""
+    row = dict(
+        run_id=run["run_id"],
+        algorithm=run["algorithm"],
+        options=canonical(run["options"]),
+        map=canonical(run["map"]),
+        map_file=os.path.basename(run["map"].get("file", "")),
+    )
+    for name in PARAM_COLUMNS:
+        row[name] = run["params"].get(name, "")
+    extra = {k: v for k, v in run["params"].items() if k not in PARAM_COLUMNS}
+    if extra:
+        row["options"] = canonical(dict(run["options"], **extra))
+
+    row["baseline_rss_mb"] = round(peak_rss_mb(), 1)
+    try:
+        env = make_env(run["map"])
+        # 从文件读入的地图只有构造之后才知道大小
+        row["env_size"] = "x".join(str(n) for n in env.env_size)
+        algorithm = make_algorithm(
+            env, run["algorithm"], run["options"], run["params"]
+        )
+        row["num_states"] = env.num_states
+        start_time = time.perf_counter()
+        try:
+            algorithm.iteration()
+        finally:
+            if hasattr(algorithm, "close"):
+                algorithm.close()
+        row["wall_time"] = time.perf_counter() - start_time
+        row["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        row["iterations"] = algorithm.current_iteration_num
+        start_state_idx = env.xy_to_state_idx(*env.start_state)
+        row["start_value"] = float(algorithm.state_values[start_state_idx])
+        row["status"] = "done"
+    except Exception as error:
+        row["status"] = "failed"
+        row["error"] = f"{type(error).__name__}: {error}"
+    return row
+
+
+def _init_worker():
+    # 算法自己的进度输出在多个进程中混在一起没有意义, 错误记录在结果中
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+
+
+def read_results(path):
+    """读取已有的结果, 返回 {run_id: status}; 同一个 run_id 以最后一行为准"""
+    if not os.path.exists(path):
+        return {}
+    # 中断时可能留下写了一半的最后一行, 截掉它
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+    statuses = {}
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is not None and tuple(reader.fieldnames) != COLUMNS:
+            raise ValueError(f"{path} has columns {reader.fieldnames}, expected {COLUMNS}")
+        for row in reader:
+            statuses[row["run_id"]] = row["status"]
+    return statuses
+
+
+def run_sweep(runs, output, num_workers=None, retry_failed=False):
+    """执行 runs 中还没有结果的运行, 每完成一个就追加一行到 output"""
+    statuses = read_results(output)
+    skip = {"done"} if retry_failed else {"done", "failed"}
+    pending = [run for run in runs if statuses.get(run["run_id"]) not in skip]
+    print(
+        f"{len(runs)} runs, {len(runs) - len(pending)} already finished, "
+        f"{len(pending)} to run",
+        file=sys.stderr,
+    )
+    if not pending:
+        return
+
+    new_file = not os.path.exists(output) or os.path.getsize(output) == 0
+    with open(output, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        if new_file:
+            writer.writeheader()
+        # 每个任务使用新的进程, 峰值内存只属于这一次运行
+        with ProcessPoolExecutor(
+            max_workers=num_workers, max_tasks_per_child=1, initializer=_init_worker
+        ) as executor:
+            futures = [executor.submit(execute, run) for run in pending]
+            try:
+                for done, future in enumerate(as_completed(futures), 1):
+                    row = future.result()
+                    writer.writerow(row)
+                    f.flush()
+                    print(
+                        f"[{done}/{len(pending)}] {row['run_id']} {row['algorithm']} "
+                        f"{row['env_size']} {row['status']}",
+                        file=sys.stderr,
+                    )
+            except KeyboardInterrupt:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量运行地图、算法和超参数的组合")
+    parser.add_argument("spec", help="sweep 配置 (JSON)")
+    parser.add_argument("-o", "--output", default="sweep_results.csv", help="结果 CSV")
+    parser.add_argument(
+        "-j", "--workers", type=int, default=None, help="进程数, 默认为 CPU 核数"
+    )
+    parser.add_argument(
+        "--retry-failed", action="store_true", help="重新运行之前失败的组合"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="只列出将要执行的运行"
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.spec) as f:
+        runs = expand_runs(json.load(f))
+    if args.dry_run:
+        for run in runs:
+            print(
+                run["run_id"],
+                run["algorithm"],
+                canonical(run["options"]),
+                canonical(run["params"]),
+                canonical(run["map"]),
+            )
+        return
+    run_sweep(runs, args.output, args.workers, args.retry_failed)
+
+
+if __name__ == "__main__":
+    main()
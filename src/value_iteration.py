@@ -1,6 +1,129 @@
 import copy
+import heapq
 import random
-from iteration import Iteration
+import time
+
+import numpy as np
+
+from grid_world import coarsen_grid_world, state_cells
+from history import IterationHistory
+from instrumentation import timed
+from iteration import Iteration, greedy_actions
+from kernels import gauss_seidel_sweep, resolve_kernels
+
+# 策略评估方式
+# iterative: 原地迭代直到变化小于 theta
+# direct: 直接求解线性方程组 (I - gamma * P_pi) V = r_pi, 适合中小规模的网格
+# krylov: 用 BiCGSTAB 迭代求解同一个方程组, 只需要矩阵-向量乘, 适合大规模网格
+EVALUATION_METHODS = ("iterative", "direct", "krylov")
+
+# Gauss-Seidel 值迭代中一次 sweep 访问状态的顺序
+# row_major: 状态索引从小到大
+# reverse: 状态索引从大到小
+# alternating: 奇数次 sweep 从小到大, 偶数次 sweep 从大到小
+# bfs: 在反向转移图上从目标状态出发的广度优先顺序, 离目标越近越先更新
+SWEEP_ORDERS = ("row_major", "reverse", "alternating", "bfs")
+
+# 截断策略迭代中每次策略评估的迭代次数
+# fixed: 固定为 truncated_iterations
+# adaptive: 根据上一次外层迭代的残差和策略变化的状态数决定
+TRUNCATION_MODES = ("fixed", "adaptive")
+
+
+def bicgstab(matvec, b, x0, tol, maxiter):
+    """
+    BiCGSTAB 求解 A x = b, A 只通过 matvec(x) = A @ x 给出。
+
+    当残差的无穷范数不超过 tol、达到 maxiter 次迭代或者出现无法继续的
+    breakdown (除数为 0) 时停止。
+
+    Returns:
+        x (np.ndarray): 近似解
+        num_iterations (int): 实际迭代次数
+        residual (float): 返回的 x 的真实残差 max |b - A x|, 比迭代中递推的残差
+            多做一次 matvec
+    """
+    x = np.array(x0, dtype=np.float64)
+    r = b - matvec(x)
+    if np.max(np.abs(r)) <= tol:
+        return x, 0, float(np.max(np.abs(r)))
+    r_hat = r.copy()
+    rho = alpha = omega = 1.0
+    v = np.zeros_like(b)
+    p = np.zeros_like(b)
+    num_iterations = 0
+    for k in range(1, maxiter + 1):
+        num_iterations = k
+        rho_new = r_hat @ r
+        if rho_new == 0.0:
+            # 出现 breakdown, 以当前残差重新开始
+            r_hat = r.copy()
+            rho_new = r_hat @ r
+            p = np.zeros_like(b)
+            v = np.zeros_like(b)
+            rho = alpha = omega = 1.0
+        beta = (rho_new / rho) * (alpha / omega)
+        rho = rho_new
+        p = r + beta * (p - omega * v)
+        v = matvec(p)
+        denominator = r_hat @ v
+        if denominator == 0.0:
+            break
+        alpha = rho / denominator
+        s = r - alpha * v
+        if np.max(np.abs(s)) <= tol:
+            x += alpha * p
+            break
+        t = matvec(s)
+        tt = t @ t
+        omega = (t @ s) / tt if tt > 0.0 else 0.0
+        x += alpha * p + omega * s
+        r = s - omega * t
+        if np.max(np.abs(r)) <= tol or omega == 0.0:
+            break
+    return x, num_iterations, float(np.max(np.abs(b - matvec(x))))
+
+
+def predecessor_index(next_state_table):
+    """
+    反向转移图, CSR 格式: 能一步到达状态 s 的状态是
+    indices[indptr[s] : indptr[s + 1]] (同一个前驱可能出现多次)。
+    """
+    num_states, num_actions = next_state_table.shape
+    successors = np.ravel(next_state_table, order="F")
+    sources = np.tile(np.arange(num_states), num_actions)
+    indptr = np.zeros(num_states + 1, dtype=np.intp)
+    np.cumsum(np.bincount(successors, minlength=num_states), out=indptr[1:])
+    indices = sources[np.argsort(successors, kind="stable")]
+    return indptr, indices
+
+
+def gather_predecessors(indptr, indices, states):
+    """返回 states 中所有状态的前驱, 拼接成一个数组"""
+    starts = indptr[states]
+    lengths = indptr[states + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[np.arange(lengths.sum()) + offsets]
+
+
+def bfs_order(next_state_table, target_state_idx):
+    """
+    按在反向转移图上到目标状态的距离从近到远排列所有状态,
+    到达不了目标的状态按索引排在最后。
+    """
+    num_states = next_state_table.shape[0]
+    indptr, indices = predecessor_index(next_state_table)
+    visited = np.zeros(num_states, dtype=bool)
+    visited[target_state_idx] = True
+    frontier = np.array([target_state_idx], dtype=np.intp)
+    layers = [frontier]
+    while frontier.size:
+        predecessors = np.unique(gather_predecessors(indptr, indices, frontier))
+        frontier = predecessors[~visited[predecessors]]
+        visited[frontier] = True
+        layers.append(frontier)
+    layers.append(np.flatnonzero(~visited))
+    return np.concatenate(layers)
 
 
 class ValueIteration(Iteration):
@@ -17,27 +140,24 @@ class ValueIteration(Iteration):
         """
         # 如果是第一次迭代，清空历史记录
         if self.current_iteration_num == 0:
-            self.iteration_history = []
+            self.iteration_history.clear()
 
         # 检查是否超过最大迭代次数
         if self.current_iteration_num >= self.max_iterations:
             return True
 
         # 计算每个 (s, a) 的 action value
-        for state in range(self.env.num_states):
-            for action in range(self.env.num_actions):
-                next_state, reward = self.env.get_next_state_and_reward(state, action)
-                # qk(s, a) = r(s, a) + gamma * V(s')
-                q_value = reward + self.gamma * self.state_values[next_state]
-                self.action_values[state][action] = q_value
+        # qk(s, a) = r(s, a) + gamma * V(s')
+        self.update_action_values()
 
-        old_state_values = copy.deepcopy(self.state_values)
+        # update_state_values 会重新绑定 state_values, 无需复制
+        old_state_values = self.state_values
 
         # policy update
         self.policy_update()
 
         # value update
-        self.state_values = [max(action_values) for action_values in self.action_values]
+        self.update_state_values()
 
         # 增加迭代次数
         self.current_iteration_num += 1
@@ -65,26 +185,18 @@ class ValueIteration(Iteration):
         # 重置迭代次数
         self.current_iteration_num = 0
         # 清空历史记录
-        self.iteration_history = []
+        self.iteration_history.clear()
 
         for iter_num in range(self.max_iterations):
-            for state in range(self.env.num_states):
-                for action in range(self.env.num_actions):
-                    next_state, reward = self.env.get_next_state_and_reward(
-                        state, action
-                    )
-                    # qk(s, a) = r(s, a) + gamma * V(s')
-                    q_value = reward + self.gamma * self.state_values[next_state]
-                    self.action_values[state][action] = q_value
-            old_state_values = copy.deepcopy(self.state_values)
+            # qk(s, a) = r(s, a) + gamma * V(s')
+            self.update_action_values()
+            old_state_values = self.state_values
 
             # policy update
             self.policy_update()
 
             # value update
-            self.state_values = [
-                max(action_values) for action_values in self.action_values
-            ]
+            self.update_state_values()
 
             # 增加迭代次数
             self.current_iteration_num += 1
@@ -102,9 +214,25 @@ class ValueIteration(Iteration):
 
 
 class PolicyIteration(Iteration):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, evaluation="iterative", **kwargs):
         super().__init__(*args, **kwargs)
+        if evaluation not in EVALUATION_METHODS:
+            raise ValueError(
+                f"Unknown evaluation: {evaluation}, expected one of {EVALUATION_METHODS}"
+            )
+        self.evaluation = evaluation
         self.current_iteration_num = 0  # 当前迭代次数
+        self.evaluation_times = []  # 每次外层迭代中策略评估的耗时 (秒)
+        self.krylov_max_iterations = 1000
+        self.backups = 0  # 累计的状态 backup 次数, 每次 sweep 计 num_states 次
+        self.inner_sweeps = 0  # 最近一次策略评估的 sweep 次数
+        self.residual = np.inf  # 最近一次策略评估最后一次 sweep 中状态值的最大变化
+        self.policy_changes = self.env.num_states  # 最近一次策略改进中最优动作改变的状态数
+
+    @property
+    def evaluation_budget(self):
+        """单次策略评估的迭代次数上限, None 表示直到收敛"""
+        return None
 
     def step_iteration(self):
         """
@@ -115,7 +243,8 @@ class PolicyIteration(Iteration):
         """
         # 如果是第一次迭代，清空历史记录
         if self.current_iteration_num == 0:
-            self.iteration_history = []
+            self.iteration_history.clear()
+            self.reset_statistics()
 
         # 检查是否超过最大迭代次数
         if self.current_iteration_num >= self.max_iterations:
@@ -138,6 +267,8 @@ class PolicyIteration(Iteration):
             self.state_values,
             self.policy,
             self.action_values,
+            inner_sweeps=self.inner_sweeps,
+            backups=self.backups,
         )
 
         # 检查策略是否改变
@@ -147,7 +278,8 @@ class PolicyIteration(Iteration):
     def iteration(self):
         # 重置迭代次数
         self.current_iteration_num = 0
-        self.iteration_history = []
+        self.iteration_history.clear()
+        self.reset_statistics()
 
         for iter_num in range(self.max_iterations):
             old_state_values = copy.deepcopy(self.state_values)
@@ -167,71 +299,907 @@ class PolicyIteration(Iteration):
                 self.state_values,
                 self.policy,
                 self.action_values,
+                inner_sweeps=self.inner_sweeps,
+                backups=self.backups,
             )
 
             # 检查策略是否改变
             if self.check_policy_convergence(old_state_values, self.state_values):
                 break
 
+    def reset_statistics(self):
+        self.evaluation_times = []
+        self.backups = 0
+        self.inner_sweeps = 0
+        self.residual = np.inf
+        self.policy_changes = self.env.num_states
+
+    @timed("policy_evaluation")
     def policy_evaluation(self):
-        while True:
-            state_values_ = copy.deepcopy(self.state_values)
+        start_time = time.perf_counter()
+        if self.evaluation == "direct":
+            self.direct_policy_evaluation()
+        elif self.evaluation == "krylov":
+            self.krylov_policy_evaluation()
+        else:
+            self.iterative_policy_evaluation()
+        self.evaluation_times.append(time.perf_counter() - start_time)
+        self.backups += self.inner_sweeps * self.env.num_states
+        self.stats.add(
+            sweeps=self.inner_sweeps, backups=self.inner_sweeps * self.env.num_states
+        )
 
-            for state in range(self.env.num_states):
-                # 根据策略的概率分布计算状态值
-                # V(s) = sum_a π(a|s) * sum_{s',r} p(s',r|s,a) * [r + gamma * V(s')]
-                # 在当前确定性环境中，简化为：
-                # V(s) = sum_a π(a|s) * [r(s,a) + gamma * V(s')]
-                value = 0.0
-                for action in range(self.env.num_actions):
-                    next_state, reward = self.env.get_next_state_and_reward(
-                        state, action
-                    )
-                    action_prob = self.policy[state][action]
-                    value += action_prob * (
-                        reward + self.gamma * self.state_values[next_state]
-                    )
-                self.state_values[state] = value
-
-            if self.check_state_values_convergence(state_values_, self.state_values):
-                break
+    def iterative_policy_evaluation(self):
+        """
+        反复计算 V(s) = sum_a π(a|s) * [r(s,a) + gamma * V(s')], 直到一次 sweep 中
+        状态值的变化不超过 theta 或者用完 evaluation_budget。π 是 policy_weights()。
+
+        numpy 后端每次 sweep 是一次基于转移表的 P_pi @ V (同步更新);
+        python 后端逐个状态原地更新。
+        """
+        next_state_table = self.env.next_state_table
+        weights = self.policy_weights()
+        rewards = (weights * self.env.reward_table).sum(axis=1)
+        num_sweeps = 0
+        residual = None
+        budget = self.evaluation_budget
+        if self.backend == "numpy":
+            values = np.asarray(self.state_values, dtype=np.float64)
+            while budget is None or num_sweeps < budget:
+                num_sweeps += 1
+                new_values = rewards + self.gamma * (
+                    weights * values[next_state_table]
+                ).sum(axis=1)
+                residual = float(np.max(np.abs(new_values - values)))
+                values = new_values
+                if residual <= self.theta:
+                    break
+            self.state_values = values
+        else:
+            next_states = next_state_table.tolist()
+            weights = weights.tolist()
+            rewards = rewards.tolist()
+            while budget is None or num_sweeps < budget:
+                num_sweeps += 1
+                residual = 0.0
+                for state in range(self.env.num_states):
+                    # 在当前确定性环境中:
+                    # V(s) = sum_a π(a|s) * [r(s,a) + gamma * V(s')]
+                    value = rewards[state]
+                    for action_prob, next_state in zip(
+                        weights[state], next_states[state]
+                    ):
+                        value += action_prob * self.gamma * self.state_values[next_state]
+                    residual = max(residual, abs(value - self.state_values[state]))
+                    self.state_values[state] = value
+                if residual <= self.theta:
+                    break
+        self.inner_sweeps = num_sweeps
+        if residual is not None:
+            self.residual = residual
+
+    def policy_weights(self):
+        """
+        返回按行归一化的策略 π(a|s), 形状为 [S, A]。
+
+        初始策略是随机整数而不是概率分布, 直接代入线性方程组会使
+        (I - gamma * P_pi) 失去对角占优, 因此先归一化; 全零的行视为均匀分布。
+        """
+        weights = np.asarray(self.policy, dtype=np.float64)
+        row_sums = weights.sum(axis=1, keepdims=True)
+        uniform = np.full_like(weights, 1.0 / self.env.num_actions)
+        return np.divide(weights, row_sums, out=uniform, where=row_sums > 0)
+
+    def set_state_values(self, values):
+        if self.backend == "numpy":
+            self.state_values = values
+        else:
+            self.state_values = values.tolist()
+
+    def direct_policy_evaluation(self):
+        """
+        求解 (I - gamma * P_pi) V = r_pi, 需要 O(S^2) 的内存
+        """
+        num_states = self.env.num_states
+        next_state_table = self.env.next_state_table
+        weights = self.policy_weights()
+        rewards = (weights * self.env.reward_table).sum(axis=1)
+
+        transition = np.zeros((num_states, num_states))
+        rows = np.repeat(np.arange(num_states), self.env.num_actions)
+        np.add.at(
+            transition,
+            (rows, np.ravel(next_state_table, order="C")),
+            np.ravel(weights, order="C"),
+        )
+        values = np.linalg.solve(np.eye(num_states) - self.gamma * transition, rewards)
+        self.set_state_values(values)
+        self.inner_sweeps = 0
+        self.residual = 0.0
+
+    def krylov_policy_evaluation(self):
+        """
+        用 BiCGSTAB 求解 (I - gamma * P_pi) V = r_pi, 以当前状态值作为初值。
+
+        P_pi @ V 直接通过转移表计算, 不构造矩阵。残差不超过 theta * (1 - gamma)
+        时, 状态值的误差不超过 theta。需要完整评估 (evaluation_budget 为 None)
+        而 BiCGSTAB 没有达到这个残差时, 从它的结果出发改用 iterative_policy_evaluation;
+        residual 是最终状态值的真实残差。
+        """
+        next_state_table = self.env.next_state_table
+        weights = self.policy_weights()
+        rewards = (weights * self.env.reward_table).sum(axis=1)
+
+        def matvec(values):
+            return values - self.gamma * (weights * values[next_state_table]).sum(
+                axis=1
+            )
 
+        budget = self.evaluation_budget
+        if budget == 0:
+            self.inner_sweeps = 0
+            return
+        maxiter = self.krylov_max_iterations if budget is None else budget
+        tol = self.theta * (1 - self.gamma)
+        old_state_values = self.state_values
+        values, num_iterations, residual = bicgstab(
+            matvec, rewards, x0=self.state_values, tol=tol, maxiter=maxiter
+        )
+        # 每次 BiCGSTAB 迭代做两次矩阵-向量乘, 相当于两次 sweep;
+        # 另外计算初始和最终的残差各一次
+        num_sweeps = 2 * num_iterations + 2
+        if budget is None and not residual <= tol:
+            # 没有收敛 (达到迭代上限或者 breakdown) 时改用迭代法完成这次评估
+            if np.all(np.isfinite(values)):
+                self.set_state_values(values)
+            else:
+                self.state_values = old_state_values
+            self.iterative_policy_evaluation()
+            self.inner_sweeps += num_sweeps
+            return
+        self.set_state_values(values)
+        self.inner_sweeps = num_sweeps
+        self.residual = residual
+
+    @timed("policy_improvement")
     def policy_improvement(self):
+        old_actions = greedy_actions(np.asarray(self.policy, dtype=np.float64))
+
         # 计算所有状态-动作对的Q值
-        for state in range(self.env.num_states):
-            for action in range(self.env.num_actions):
-                next_state, reward = self.env.get_next_state_and_reward(state, action)
-                q_value = reward + self.gamma * self.state_values[next_state]
-                self.action_values[state][action] = q_value
+        self.update_action_values()
+        self.backups += self.env.num_states
 
         # 策略更新：对每个状态，选择Q值最大的动作
         self.policy_update()
 
+        new_actions = greedy_actions(np.asarray(self.policy, dtype=np.float64))
+        self.policy_changes = int(np.count_nonzero(old_actions != new_actions))
+
 
 class TruncatedPolicyIteration(PolicyIteration):
-    def __init__(self, *args, **kwargs):
+    """
+    截断策略迭代: 每次策略评估最多做 truncated_iterations 次 sweep。
+
+    truncation="adaptive" 时, 评估的 sweep 次数按把残差降到 theta * (1 - gamma)
+    所需的次数除以 (1 + policy_changes) 估计, 并限制在 evaluation_cap 以内;
+    评估平均每个 sweep 使 Bellman 残差缩小的比例不如只做策略改进时,
+    evaluation_cap 减半, 否则加倍。evaluation_cap 降为 0 后每 probe_interval
+    次外层迭代试探一次 sweep。策略改进同时完成新策略下的第一次 sweep,
+    评估对留在原地的动作直接求解对角项 (见 GaussSeidelValueIteration)。
+    numpy 后端的改进和评估是同步 (Jacobi) 更新, python 后端按交替的方向原地更新。
+    """
+
+    def __init__(self, *args, truncation="fixed", **kwargs):
         super().__init__(*args, **kwargs)
+        if truncation not in TRUNCATION_MODES:
+            raise ValueError(
+                f"Unknown truncation: {truncation}, expected one of {TRUNCATION_MODES}"
+            )
+        self.truncation = truncation
         self.truncated_iterations = 100
+        self.probe_interval = 8  # evaluation_cap 为 0 时每隔多少次外层迭代试探一次评估
+        self.bellman_residual = np.inf  # 最近一次策略改进时的 Bellman 残差
+        self.evaluation_cap = None  # adaptive 模式单次评估的 sweep 上限, None 表示 truncated_iterations
+        self.improvement_rate = self.gamma  # 只做策略改进时每次外层迭代残差缩小的比例
 
-    def policy_evaluation(self):
-        for _ in range(self.truncated_iterations):
-            state_values_ = copy.deepcopy(self.state_values)
+    def reset_statistics(self):
+        super().reset_statistics()
+        self.bellman_residual = np.inf
+        self.evaluation_cap = None
+        self.improvement_rate = self.gamma
+
+    @property
+    def evaluation_budget(self):
+        if self.truncation == "fixed":
+            return self.truncated_iterations
+        if self.current_iteration_num == 0:
+            # 初始策略是随机的, 评估它没有意义, 直接从策略改进开始
+            return 0
+        if not np.isfinite(self.residual) or not 0 < self.gamma < 1:
+            return 0
+        target = self.theta * (1 - self.gamma)
+        if self.residual <= target:
+            return 0
+        needed = np.log(target / self.residual) / np.log(self.gamma)
+        budget = int(np.ceil(needed / (1 + self.policy_changes))) - 1
+        cap = self.truncated_iterations
+        if self.evaluation_cap == 0:
+            # 评估曾经不划算, 定期用一次 sweep 重新判断
+            cap = int(self.current_iteration_num % self.probe_interval == 0)
+        elif self.evaluation_cap is not None:
+            cap = min(cap, self.evaluation_cap)
+        return min(max(budget, 0), cap)
+
+    def evaluation_model(self):
+        """
+        当前策略下的 Gauss-Seidel 评估模型: 每个状态的常数项 sum_a π(a|s) r(s, a),
+        对角项系数 1 - gamma * sum_{a: s' = s} π(a|s), 以及离开自身的转移权重
+        gamma * π(a|s) (s' = s 的动作为 0), 形状分别为 [S], [S], [S, A]。
+        """
+        num_states = self.env.num_states
+        weights = self.policy_weights()
+        stays = self.env.next_state_table == np.arange(num_states)[:, None]
+        constants = (weights * self.env.reward_table).sum(axis=1)
+        diagonals = 1 - self.gamma * (weights * stays).sum(axis=1)
+        moves = np.where(stays, 0.0, self.gamma * weights)
+        return constants, diagonals, moves
+
+    def iterative_policy_evaluation(self):
+        if self.truncation == "fixed":
+            super().iterative_policy_evaluation()
+            return
+
+        next_state_table = self.env.next_state_table
+        constants, diagonals, moves = self.evaluation_model()
+        budget = self.evaluation_budget
+        num_sweeps = 0
+        residual = 0.0
+        if self.backend == "numpy":
+            values = np.asarray(self.state_values, dtype=np.float64)
+            while num_sweeps < budget:
+                num_sweeps += 1
+                new_values = (
+                    constants + (moves * values[next_state_table]).sum(axis=1)
+                ) / diagonals
+                residual = float(np.max(np.abs(new_values - values)))
+                values = new_values
+                if residual <= self.theta:
+                    break
+        else:
+            transitions = [[] for _ in range(self.env.num_states)]
+            for state, action in zip(*np.nonzero(moves)):
+                transitions[state].append(
+                    (float(moves[state, action]), int(next_state_table[state, action]))
+                )
+            constants = constants.tolist()
+            diagonals = diagonals.tolist()
+            values = np.asarray(self.state_values, dtype=np.float64).tolist()
+            while num_sweeps < budget:
+                num_sweeps += 1
+                residual = 0.0
+                for state, state_moves in enumerate(transitions):
+                    value = constants[state]
+                    for weight, next_state in state_moves:
+                        value += weight * values[next_state]
+                    value /= diagonals[state]
+                    residual = max(residual, abs(value - values[state]))
+                    values[state] = value
+                if residual <= self.theta:
+                    break
+            values = np.array(values)
+
+        self.set_state_values(values)
+        self.inner_sweeps = num_sweeps
+        if num_sweeps:
+            self.residual = residual
+
+    def policy_improvement(self):
+        if self.truncation == "fixed":
+            super().policy_improvement()
+            return
+
+        old_residual = self.bellman_residual
+        self.improvement_sweep()
+        self.residual = self.bellman_residual
+
+        # 比较这次外层迭代 (评估的 sweep 加上策略改进) 平均每个 sweep 的收缩比例
+        if 0 < self.bellman_residual and 0 < old_residual < np.inf:
+            rate = (self.bellman_residual / old_residual) ** (1 / (self.inner_sweeps + 1))
+            cap = self.evaluation_cap
+            cap = self.truncated_iterations if cap is None else cap
+            if self.inner_sweeps == 0:
+                self.improvement_rate = rate
+            elif rate > self.improvement_rate:
+                self.evaluation_cap = cap // 2
+            else:
+                self.evaluation_cap = min(max(1, 2 * cap), self.truncated_iterations)
+
+    @timed("policy_improvement")
+    def improvement_sweep(self):
+        """
+        计算 q(s, a), 更新策略并令 V(s) = max_a q(s, a); 与 GaussSeidelValueIteration
+        一样, 自环动作按不动点 r(s, a) / (1 - gamma) 比较。numpy 后端同步更新,
+        python 后端按 (每次外层迭代交替的) 状态顺序原地更新。
+        """
+        num_states = self.env.num_states
+        old_actions = greedy_actions(np.asarray(self.policy, dtype=np.float64))
+        gamma = self.gamma
+        if self.backend == "numpy":
+            next_state_table = self.env.next_state_table
+            reward_table = self.env.reward_table
+            values = np.asarray(self.state_values, dtype=np.float64)
+            q_values = reward_table + gamma * values[next_state_table]
+            if gamma < 1:
+                stays = next_state_table == np.arange(num_states)[:, None]
+                q_values = np.where(stays, reward_table / (1 - gamma), q_values)
+            new_values = q_values.max(axis=1)
+            residual = float(np.max(np.abs(new_values - values)))
+            values = new_values
+            action_values = reward_table + gamma * values[next_state_table]
+        else:
+            next_states = self.env.next_state_table.tolist()
+            rewards = self.env.reward_table.tolist()
+            values = np.asarray(self.state_values, dtype=np.float64).tolist()
+            states = range(num_states)
+            if self.current_iteration_num % 2 == 1:
+                states = reversed(states)
+
+            action_values = [None] * num_states
+            residual = 0.0
+            for state in states:
+                best = -np.inf
+                for reward, next_state in zip(rewards[state], next_states[state]):
+                    if next_state == state and gamma < 1:
+                        value = reward / (1 - gamma)
+                    else:
+                        value = reward + gamma * values[next_state]
+                    if value > best:
+                        best = value
+                residual = max(residual, abs(best - values[state]))
+                values[state] = best
+                action_values[state] = [
+                    reward + gamma * values[next_state]
+                    for reward, next_state in zip(rewards[state], next_states[state])
+                ]
+            values = np.array(values)
+        self.stats.add(sweeps=1, backups=num_states)
+        self.backups += num_states
+
+        self.set_state_values(values)
+        self.action_values = action_values
+        self.policy_update()
+        new_actions = greedy_actions(np.asarray(self.policy, dtype=np.float64))
+        self.policy_changes = int(np.count_nonzero(old_actions != new_actions))
+        self.bellman_residual = residual
 
+    def check_policy_convergence(self, old_state_values, new_state_values):
+        """
+        adaptive 模式下, 策略改进时的 Bellman 残差 max |max_a q(s, a) - V(s)|
+        不超过 theta 时收敛, 与 ValueIteration 的收敛条件相同;
+        fixed 模式保持原来的判断方式。
+        """
+        if self.truncation == "fixed":
+            return super().check_policy_convergence(old_state_values, new_state_values)
+        return self.bellman_residual <= self.theta
+
+
+class GaussSeidelValueIteration(ValueIteration):
+    """
+    原地 (Gauss-Seidel) 值迭代: 一次 sweep 内按 order 指定的顺序逐个更新
+    V(s) = max_a [r(s, a) + gamma * V(s')], 后更新的状态立即使用本次 sweep
+    中已经更新过的值。目标可达的网格上通常比同步的 ValueIteration 少很多次迭代。
+
+    与线性方程组的 Gauss-Seidel 方法一样, 对角项 (留在原地的动作) 直接求解:
+    自环动作 a 满足 q(s, a) = r(s, a) + gamma * V(s), 它的不动点是
+    r(s, a) / (1 - gamma), 因此
+        V(s) = max(max_{a: s' != s} [r(s, a) + gamma * V(s')], max_{a: s' = s} r(s, a) / (1 - gamma))
+    否则目标状态上的停留动作会让收敛速度退化为与同步迭代相同的 gamma^k。
+
+    每次 sweep 之后用新的状态值计算动作值和贪心策略, 保存到迭代历史;
+    elapsed 是最近一次 iteration() 的耗时 (秒)。
+
+    kernels (见 kernels.KERNEL_MODES): 为 "numba" 时 sweep 使用编译后的
+    kernels.gauss_seidel_sweep, 为 "python" 时使用下面基于列表的实现,
+    两者的运算顺序相同, 结果完全一致。默认 "auto", None 与 "python" 相同。
+    """
+
+    def __init__(self, *args, order="row_major", kernels="auto", **kwargs):
+        super().__init__(*args, **kwargs)
+        if order not in SWEEP_ORDERS:
+            raise ValueError(f"Unknown order: {order}, expected one of {SWEEP_ORDERS}")
+        self.order = order
+        self.kernels = resolve_kernels(kernels)
+        self.elapsed = 0.0
+        self._sweep_order = None
+        self._local_model = None
+        self._csr_model = None
+
+    def sweep_order(self):
+        """本次 sweep 访问状态的顺序"""
+        if self._sweep_order is None:
+            if self.order == "bfs":
+                self._sweep_order = bfs_order(
+                    self.env.next_state_table, self.env.target_state_idx
+                ).tolist()
+            else:
+                self._sweep_order = list(range(self.env.num_states))
+        if self.order == "reverse" or (
+            self.order == "alternating" and self.current_iteration_num % 2 == 1
+        ):
+            return reversed(self._sweep_order)
+        return self._sweep_order
+
+    def local_model(self):
+        """
+        每个状态离开自身的 (reward, next_state) 列表, 以及自环动作的不动点值
+        (没有自环动作或 gamma >= 1 时为 -inf, 此时自环按普通转移处理)。
+        """
+        if self._local_model is None:
+            next_states = self.env.next_state_table.tolist()
+            rewards = self.env.reward_table.tolist()
+            transitions = []
+            self_values = []
             for state in range(self.env.num_states):
-                # 根据策略的概率分布计算状态值
-                # V(s) = sum_a π(a|s) * sum_{s',r} p(s',r|s,a) * [r + gamma * V(s')]
-                # 在当前确定性环境中，简化为：
-                # V(s) = sum_a π(a|s) * [r(s,a) + gamma * V(s')]
-                value = 0.0
-                for action in range(self.env.num_actions):
-                    next_state, reward = self.env.get_next_state_and_reward(
-                        state, action
-                    )
-                    action_prob = self.policy[state][action]
-                    value += action_prob * (
-                        reward + self.gamma * self.state_values[next_state]
-                    )
-                self.state_values[state] = value
-
-            if self.check_state_values_convergence(state_values_, self.state_values):
+                moves = []
+                self_value = -np.inf
+                for reward, next_state in zip(rewards[state], next_states[state]):
+                    if next_state == state and self.gamma < 1:
+                        self_value = max(self_value, reward / (1 - self.gamma))
+                    else:
+                        moves.append((reward, next_state))
+                transitions.append(moves)
+                self_values.append(self_value)
+            self._local_model = (transitions, self_values)
+        return self._local_model
+
+    def csr_model(self):
+        """local_model 的数组形式, 供编译后的内核使用: (indptr, 奖励, 下一个状态, 自环值)"""
+        if self._csr_model is None:
+            transitions, self_values = self.local_model()
+            lengths = [len(moves) for moves in transitions]
+            indptr = np.zeros(len(transitions) + 1, dtype=np.intp)
+            np.cumsum(lengths, out=indptr[1:])
+            moves = [move for state_moves in transitions for move in state_moves]
+            move_rewards = np.array([reward for reward, _ in moves], dtype=np.float64)
+            move_next = np.array([next_state for _, next_state in moves], dtype=np.intp)
+            self._csr_model = (
+                indptr,
+                move_rewards,
+                move_next,
+                np.array(self_values, dtype=np.float64),
+            )
+        return self._csr_model
+
+    @timed("sweep")
+    def sweep(self):
+        """按 sweep_order 原地更新一遍所有状态值"""
+        self.stats.add(sweeps=1, backups=self.env.num_states)
+        if self.kernels == "numba":
+            values = np.array(self.state_values, dtype=np.float64)
+            order = np.array(self.sweep_order(), dtype=np.intp)
+            indptr, move_rewards, move_next, self_values = self.csr_model()
+            gauss_seidel_sweep(
+                order, indptr, move_rewards, move_next, self_values, values, self.gamma
+            )
+            if self.backend == "numpy":
+                self.state_values = values
+            else:
+                self.state_values = values.tolist()
+            return
+        transitions, self_values = self.local_model()
+        values = list(self.state_values)
+        gamma = self.gamma
+        for state in self.sweep_order():
+            best = self_values[state]
+            for reward, next_state in transitions[state]:
+                value = reward + gamma * values[next_state]
+                if value > best:
+                    best = value
+            values[state] = best
+        if self.backend == "numpy":
+            self.state_values = np.array(values)
+        else:
+            self.state_values = values
+
+    def step_iteration(self):
+        """
+        执行一次 sweep
+
+        Returns:
+            converged (bool): 是否收敛
+        """
+        # 第一次迭代时清空历史记录, 并按当前的环境重新准备 sweep 顺序
+        if self.current_iteration_num == 0:
+            self.iteration_history.clear()
+            self._sweep_order = None
+            self._local_model = None
+            self._csr_model = None
+
+        if self.current_iteration_num >= self.max_iterations:
+            return True
+
+        old_state_values = list(self.state_values)
+        self.sweep()
+
+        # 用更新后的状态值计算动作值和贪心策略
+        self.update_action_values()
+        self.policy_update()
+
+        self.current_iteration_num += 1
+        self.add_iteration_history(
+            self.current_iteration_num,
+            self.state_values,
+            self.policy,
+            self.action_values,
+        )
+        return self.check_state_values_convergence(old_state_values, self.state_values)
+
+    def iteration(self):
+        start_time = time.perf_counter()
+        self.current_iteration_num = 0
+        for iter_num in range(self.max_iterations):
+            if self.step_iteration():
+                break
+        self.elapsed = time.perf_counter() - start_time
+
+
+def compare_sweep_orders(env, orders=SWEEP_ORDERS, **kwargs):
+    """
+    对同一个环境分别用同步值迭代和各个 sweep 顺序的 Gauss-Seidel 值迭代求解,
+    kwargs 传给算法的构造函数 (theta, gamma, max_iterations 等)。
+
+    Returns:
+        list[dict]: 每种方式一行, 包含 order, iterations 和 seconds
+    """
+    rows = []
+    start_time = time.perf_counter()
+    algorithm = ValueIteration(env, **kwargs)
+    algorithm.iteration()
+    rows.append(
+        dict(
+            order="synchronous",
+            iterations=algorithm.current_iteration_num,
+            seconds=time.perf_counter() - start_time,
+        )
+    )
+    for order in orders:
+        algorithm = GaussSeidelValueIteration(env, order=order, **kwargs)
+        algorithm.iteration()
+        rows.append(
+            dict(
+                order=order,
+                iterations=algorithm.current_iteration_num,
+                seconds=algorithm.elapsed,
+            )
+        )
+    return rows
+
+
+class PrioritizedSweeping(GaussSeidelValueIteration):
+    """
+    优先级扫描: 用最大堆保存 Bellman 误差 |max_a q(s, a) - V(s)| 超过 theta 的状态,
+    每次取出误差最大的状态原地更新, 然后只重新计算它的前驱 (通过预先构建的
+    反向转移图找到) 的误差。所有状态的误差都不超过 theta 时停止, 与 ValueIteration
+    中 max |V_{k+1} - V_k| <= theta 的收敛条件相同。
+
+    值不再变化的区域不会被反复扫描, 在大型稀疏地图上总的 backup 次数远少于
+    num_states * 迭代次数。每 num_states 次 backup 记为一次迭代并保存到历史记录,
+    backups 是累计计算的 Bellman backup 次数 (包括更新和重新计算误差)。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.backups = 0
+        self._predecessors = None
+        self._queue = None
+
+    def predecessors(self):
+        """每个状态去重后的前驱列表 (不包括自身)"""
+        if self._predecessors is None:
+            num_states = self.env.num_states
+            indptr, indices = predecessor_index(self.env.next_state_table)
+            successors = np.repeat(np.arange(num_states), np.diff(indptr))
+            keys = np.unique(successors * num_states + indices)
+            successors, sources = np.divmod(keys, num_states)
+            keep = successors != sources
+            successors, sources = successors[keep], sources[keep]
+            bounds = np.searchsorted(successors, np.arange(num_states + 1))
+            sources = sources.tolist()
+            self._predecessors = [
+                sources[bounds[state] : bounds[state + 1]]
+                for state in range(num_states)
+            ]
+        return self._predecessors
+
+    def backup(self, values, state):
+        transitions, self_values = self.local_model()
+        best = self_values[state]
+        for reward, next_state in transitions[state]:
+            value = reward + self.gamma * values[next_state]
+            if value > best:
+                best = value
+        return best
+
+    def _start_queue(self):
+        """计算所有状态的 Bellman 误差, 把超过 theta 的状态放入堆中"""
+        values = list(self.state_values)
+        errors = [
+            abs(self.backup(values, state) - values[state])
+            for state in range(self.env.num_states)
+        ]
+        self.backups += len(values)
+        self.stats.add(backups=len(values))
+        # heapq 是最小堆, 保存 (-误差, 状态); priorities 记录每个状态最新的误差,
+        # 堆中与之不一致的条目已经过期
+        heap = [
+            (-error, state) for state, error in enumerate(errors) if error > self.theta
+        ]
+        heapq.heapify(heap)
+        priorities = [error if error > self.theta else 0.0 for error in errors]
+        self._queue = (values, heap, priorities)
+
+    @timed("sweep")
+    def sweep(self):
+        """
+        从堆中取出最多 num_states 个误差最大的状态更新, 返回剩余的堆
+        """
+        values, heap, priorities = self._queue
+        predecessors = self.predecessors()
+        start_backups = self.backups
+        budget = self.backups + self.env.num_states
+        while heap and self.backups < budget:
+            neg_error, state = heapq.heappop(heap)
+            if -neg_error != priorities[state]:
+                continue
+            priorities[state] = 0.0
+            values[state] = self.backup(values, state)
+            self.backups += 1
+            for predecessor in predecessors[state]:
+                error = abs(self.backup(values, predecessor) - values[predecessor])
+                self.backups += 1
+                if error > self.theta and error != priorities[predecessor]:
+                    priorities[predecessor] = error
+                    heapq.heappush(heap, (-error, predecessor))
+                elif error <= self.theta:
+                    priorities[predecessor] = 0.0
+        # 丢弃堆顶过期的条目, 堆为空说明所有状态都已收敛
+        while heap and -heap[0][0] != priorities[heap[0][1]]:
+            heapq.heappop(heap)
+
+        if self.backend == "numpy":
+            self.state_values = np.array(values)
+        else:
+            self.state_values = list(values)
+        self.stats.add(backups=self.backups - start_backups)
+        return heap
+
+    def step_iteration(self):
+        """
+        执行最多 num_states 次优先级最高的更新
+
+        Returns:
+            converged (bool): 是否所有状态的 Bellman 误差都不超过 theta
+        """
+        if self.current_iteration_num == 0:
+            self.iteration_history.clear()
+            self._local_model = None
+            self._predecessors = None
+            self.backups = 0
+            self._start_queue()
+
+        if self.current_iteration_num >= self.max_iterations:
+            return True
+
+        heap = self.sweep()
+
+        self.update_action_values()
+        self.policy_update()
+
+        self.current_iteration_num += 1
+        self.add_iteration_history(
+            self.current_iteration_num,
+            self.state_values,
+            self.policy,
+            self.action_values,
+            backups=self.backups,
+        )
+        return not heap
+
+
+def interpolate_values(coarse_env, coarse_values, env, gamma):
+    """
+    把粗网格 coarse_env (CoarseGridWorld) 上的状态值双线性插值到 env 的每个状态,
+    粗格子的中心对应它包含的细格子的中心; gamma 是 env 上的折扣因子。
+
+    周围四个粗格子的状态值都为正时对 log V 插值: 目标附近的状态值随距离
+    按 gamma 的幂衰减, log V 沿直线是线性的, 插值没有误差; 否则 (包括信息
+    还没有传播到、状态值仍为 0 的粗格子) 直接对 V 插值。地图边缘在最外侧
+    粗格子中心之外的细格子取最近的中心之间的插值, 对 log V 插值时再乘以
+    gamma 的 (到中心所在行列的步数) 次幂。
+    """
+    coarse_width, coarse_height = coarse_env.env_size
+    factor = coarse_env.factor
+    grid = np.asarray(coarse_values, dtype=np.float64).reshape(
+        coarse_height, coarse_width
+    )
+    positive = grid > 0
+    log_grid = np.log(np.where(positive, grid, 1.0))
+    cells = state_cells(env)
+    width = env.env_size[0]
+    center = factor // 2
+    xs = (cells % width + coarse_env.offset[0] - center) / factor
+    ys = (cells // width + coarse_env.offset[1] - center) / factor
+    clipped_xs = np.clip(xs, 0, coarse_width - 1)
+    clipped_ys = np.clip(ys, 0, coarse_height - 1)
+    outside_steps = (np.abs(xs - clipped_xs) + np.abs(ys - clipped_ys)) * factor
+    x0 = clipped_xs.astype(np.intp)
+    y0 = clipped_ys.astype(np.intp)
+    x1 = np.minimum(x0 + 1, coarse_width - 1)
+    y1 = np.minimum(y0 + 1, coarse_height - 1)
+    tx = clipped_xs - x0
+    ty = clipped_ys - y0
+
+    def bilinear(grid):
+        top = grid[y0, x0] * (1 - tx) + grid[y0, x1] * tx
+        bottom = grid[y1, x0] * (1 - tx) + grid[y1, x1] * tx
+        return top * (1 - ty) + bottom * ty
+
+    geometric = positive[y0, x0] & positive[y0, x1] & positive[y1, x0] & positive[y1, x1]
+    return np.where(
+        geometric,
+        np.exp(bilinear(log_grid) + outside_steps * np.log(gamma)),
+        bilinear(grid),
+    )
+
+
+def pin_trapped_states(env, values, gamma):
+    """
+    每个动作都留在原地的状态 (例如被禁止状态包围的禁止状态) 的状态值
+    就是 max_a r(s, a) / (1 - gamma), 插值无法得到, 直接原地设置。
+    """
+    if gamma >= 1:
+        return values
+    next_states = env.next_state_table
+    trapped = np.all(next_states == np.arange(env.num_states)[:, None], axis=1)
+    values[trapped] = env.reward_table[trapped].max(axis=1) / (1 - gamma)
+    return values
+
+
+def relax_near_target(env, values, gamma, radius, theta, max_iterations):
+    """
+    只在目标周围 (2 * radius - 1) x (2 * radius - 1) 的格子上原地做同步值迭代,
+    窗口外的状态值保持不变, 直到窗口内的变化不超过 theta。
+
+    目标的状态值包含停留在目标上的奖励, 与周围状态值之间不满足按 gamma
+    的幂衰减的关系, 插值时用到目标所在粗格子的细格子误差较大; 这些误差会
+    沿着最优路径向外传播到整张地图, 所以在细网格上先局部修正。
+    """
+    cells = state_cells(env)
+    width = env.env_size[0]
+    target_x, target_y = env.target_state
+    window = np.flatnonzero(
+        (np.abs(cells % width - target_x) < radius)
+        & (np.abs(cells // width - target_y) < radius)
+    )
+    next_states = env.next_state_table[window]
+    rewards = env.reward_table[window]
+    for _ in range(max_iterations):
+        new_values = (rewards + gamma * values[next_states]).max(axis=1)
+        delta = np.abs(new_values - values[window]).max()
+        values[window] = new_values
+        if delta <= theta:
+            break
+    return values
+
+
+class MultigridValueIteration(ValueIteration):
+    """
+    由粗到细的多重网格值迭代。
+
+    值迭代中目标的信息每次 sweep 只传播一个格子, 大地图上需要很多次迭代。
+    这里先用 coarsen_grid_world 把地图逐级粗化 (每级边长除以 factor), 直到
+    较短的边不超过 min_size; 在最粗的一级上从零开始值迭代, 然后把结果
+    插值到下一级作为初始值, 逐级求解, 最后在原始地图上从插值得到的初始值
+    开始普通的值迭代。粗网格上的求解只用于初始化, 不影响最终结果的收敛条件。
+
+    空旷的地图和由大块障碍物组成的地图上, 原始地图只需要一两次迭代;
+    宽度只有一两个格子的墙和零散的障碍物在粗化后消失, 粗网格上的路径与
+    原始地图差别较大, 初始值带来的提升有限。
+
+    levels 记录最近一次求解中每一级粗网格 (从粗到细) 的 env_size、迭代次数和
+    耗时 (秒); current_iteration_num 和迭代历史只包含原始地图上的迭代。
+    """
+
+    def __init__(self, *args, factor=3, min_size=16, **kwargs):
+        super().__init__(*args, **kwargs)
+        if factor < 2:
+            raise ValueError(f"factor must be at least 2, got {factor}")
+        self.factor = factor
+        self.min_size = min_size
+        self.levels = []
+
+    def coarse_levels(self):
+        """从细到粗的粗网格列表, 每一项是 (env, gamma)"""
+        levels = []
+        env, gamma = self.env, self.gamma
+        while min(env.env_size) > self.min_size:
+            env = coarsen_grid_world(env, self.factor, gamma)
+            gamma = gamma**self.factor
+            levels.append((env, gamma))
+        return levels
+
+    def warm_start(self):
+        """
+        在粗网格上逐级求解, 返回插值到 self.env 上的状态值;
+        地图已经不超过 min_size 时返回 None
+        """
+        self.levels = []
+        levels = self.coarse_levels()
+        values = None
+        finer_levels = [(self.env, self.gamma)] + levels[:-1]
+        for (env, gamma), (finer_env, finer_gamma) in reversed(
+            list(zip(levels, finer_levels))
+        ):
+            start_time = time.perf_counter()
+            solver = ValueIteration(
+                env,
+                theta=self.theta * (1 - gamma),
+                gamma=gamma,
+                max_iterations=self.max_iterations,
+                history=IterationHistory(
+                    env.num_states,
+                    env.num_actions,
+                    keep_action_values=False,
+                    retention="last",
+                    last=1,
+                ),
+            )
+            if values is not None:
+                solver.state_values = values
+            solver.iteration()
+            self.stats.add(
+                sweeps=solver.current_iteration_num,
+                backups=solver.current_iteration_num * env.num_states,
+            )
+            values = interpolate_values(
+                env, solver.state_values, finer_env, finer_gamma
+            )
+            values = pin_trapped_states(finer_env, values, finer_gamma)
+            values = relax_near_target(
+                finer_env,
+                values,
+                finer_gamma,
+                self.factor,
+                self.theta,
+                self.max_iterations,
+            )
+            self.levels.append(
+                dict(
+                    env_size=tuple(env.env_size),
+                    iterations=solver.current_iteration_num,
+                    seconds=time.perf_counter() - start_time,
+                )
+            )
+        return values
+
+    @timed("warm_start")
+    def initialize(self):
+        """用 warm_start 的结果作为原始地图上的初始状态值"""
+        values = self.warm_start()
+        if values is None:
+            return
+        if self.backend == "numpy":
+            self.state_values = values
+        else:
+            self.state_values = values.tolist()
+
+    def step_iteration(self):
+        if self.current_iteration_num == 0:
+            self.initialize()
+        return super().step_iteration()
+
+    def iteration(self):
+        self.current_iteration_num = 0
+        for iter_num in range(self.max_iterations):
+            if self.step_iteration():
                 break
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from grid_world import GridWorld, SparseGridWorld, VectorGridWorld, rollout
+from value_iteration import ValueIteration
+
+
+def test_assigning_model_fields_rebuilds_the_model():
+    env = GridWorld()
+    assert env.reward_table.min() == -1
+    env.reward_forbidden = -10
+    assert env.reward_table.min() == -10
+
+    env.forbidden_states = [(0, 1)]
+    assert env.is_forbidden(0, 1) and not env.is_forbidden(2, 1)
+    assert env.next_state_table[0, 0] == 0  # 向下进入禁止状态, 留在原地
+
+    env.target_state = (0, 0)
+    assert env.target_state_idx == 0
+    assert env.reward_table[0, 4] == env.reward_target
+
+    env.env_size = (3, 3)
+    env.forbidden_states = []
+    assert env.next_state_table.shape == (9, 5)
+
+
+def test_sparse_start_state_rebuilds_the_model():
+    env = SparseGridWorld(forbidden_states=[(1, 0), (0, 1)])
+    assert env.num_states == 2  # 起点被围住, 只剩起点和目标
+    env.start_state = (4, 4)
+    assert env.num_states == 22
+    assert np.all(env.next_state_table < env.num_states)
+
+
+def test_vector_env_matches_single_steps():
+    env = GridWorld()
+    rng = np.random.default_rng(0)
+    start_states = rng.integers(env.num_states, size=64)
+    vec_env = VectorGridWorld(env, 64, start_states=start_states)
+    states, _ = vec_env.reset()
+    for _ in range(20):
+        actions = rng.integers(env.num_actions, size=64)
+        next_states, rewards, dones, _ = vec_env.step(actions)
+        for i in range(64):
+            expected = env.get_next_state_and_reward(int(states[i]), int(actions[i]))
+            assert (next_states[i], rewards[i]) == expected
+        assert np.array_equal(dones, next_states == env.target_state_idx)
+        # 到达目标的智能体回到各自的起始状态
+        assert np.array_equal(vec_env.states, np.where(dones, start_states, next_states))
+        states = vec_env.states
+
+
+def test_rollout_follows_the_policy():
+    env = GridWorld()
+    algorithm = ValueIteration(env)
+    algorithm.iteration()
+    actions = np.argmax(np.asarray(algorithm.policy), axis=1)
+    start_states = [0, env.target_state_idx - 1]
+    states, taken, rewards, lengths, reached = rollout(env, actions, start_states, 50)
+    assert reached.all()
+    assert states.shape == (2, taken.shape[1] + 1) and taken.shape == rewards.shape
+    for i, length in enumerate(lengths):
+        assert states[i, length] == env.target_state_idx
+        assert np.array_equal(taken[i, :length], actions[states[i, :length]])
+
+
+def test_rollout_rejects_empty_episodes():
+    with pytest.raises(ValueError):
+        rollout(GridWorld(), np.zeros(25, dtype=int), [0], 0)
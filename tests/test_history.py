@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from grid_world import GridWorld
+from history import INITIAL_BLOCK_BYTES, IterationHistory
+from value_iteration import ValueIteration
+
+
+def solve(history):
+    algorithm = ValueIteration(GridWorld(), history=history)
+    algorithm.iteration()
+    return history
+
+
+def assert_same_records(history, expected):
+    assert len(history) == len(expected)
+    for record, expected_record in zip(history, expected):
+        assert record["iteration"] == expected_record["iteration"]
+        np.testing.assert_array_equal(
+            record["state_values"], expected_record["state_values"]
+        )
+        np.testing.assert_array_equal(record["policy"], expected_record["policy"])
+        np.testing.assert_array_equal(
+            record["action_values"], expected_record["action_values"]
+        )
+
+
+def test_history_matches_the_solver_iterations():
+    env = GridWorld()
+    history = IterationHistory(env.num_states, env.num_actions, initial_capacity=2)
+    algorithm = ValueIteration(env, history=history)
+    algorithm.iteration()
+    assert len(history) == algorithm.current_iteration_num
+    assert [record["iteration"] for record in history] == list(
+        range(1, algorithm.current_iteration_num + 1)
+    )
+    np.testing.assert_array_equal(history[-1]["state_values"], algorithm.state_values)
+    np.testing.assert_array_equal(history[-1]["policy"], algorithm.policy)
+
+
+@pytest.mark.parametrize(
+    "options, iterations",
+    [
+        (dict(retention="every", every=3), [3, 6]),
+        (dict(retention="last", last=2), [6, 7]),
+    ],
+)
+def test_retention(options, iterations):
+    history = IterationHistory(3, 2, **options)
+    for iteration in range(1, 8):
+        history.append(iteration, np.full(3, iteration), np.eye(3, 2), np.zeros((3, 2)))
+    assert [record["iteration"] for record in history] == iterations
+    assert [record["state_values"][0] for record in history] == iterations
+
+
+def test_first_block_fits_the_byte_budget():
+    # 10^6 个状态时一条带动作值的记录约 49 MB, 第一块只分配一条
+    history = IterationHistory(10**6, 5)
+    assert history.capacity == 1
+    assert history.nbytes <= max(INITIAL_BLOCK_BYTES, history.row_nbytes)
+    assert IterationHistory(25, 5).capacity == 16
+
+
+@pytest.mark.parametrize(
+    "options",
+    [dict(), dict(retention="every", every=3), dict(retention="last", last=4)],
+)
+def test_spilled_history_round_trip(tmp_path, options):
+    env = GridWorld()
+    expected = list(solve(IterationHistory(env.num_states, env.num_actions, **options)))
+
+    spill_dir = str(tmp_path / "history")
+    history = IterationHistory(
+        env.num_states,
+        env.num_actions,
+        initial_capacity=2,
+        spill_dir=spill_dir,
+        **options,
+    )
+    solve(history)
+    assert_same_records(history, expected)
+
+    # 只读地重新打开
+    reopened = IterationHistory.open(spill_dir)
+    assert_same_records(reopened, expected)
+    with pytest.raises(ValueError):
+        reopened.append(0, expected[0]["state_values"], expected[0]["policy"], None)
+
+    # export / load 到另一个 spill_dir
+    loaded = IterationHistory(
+        env.num_states, env.num_actions, spill_dir=str(tmp_path / "loaded"), **options
+    )
+    loaded.load(history.export())
+    assert_same_records(loaded, expected)
+    assert_same_records(IterationHistory.open(str(tmp_path / "loaded")), expected)
@@ -0,0 +1,100 @@
+import numpy as np
+
+from grid_world import GridWorld
+from kernels import (
+    LCG_MODULUS,
+    LCG_MULTIPLIER,
+    kernel,
+    resolve_kernels,
+    sample_returns,
+)
+from monte_carlo_iteration import MonteCarloGreedy
+from value_iteration import GaussSeidelValueIteration
+
+
+def next_seed(rng_state):
+    return rng_state * LCG_MULTIPLIER % LCG_MODULUS
+
+
+def numpy_sample_returns(
+    next_states,
+    rewards,
+    num_states,
+    target_state,
+    greedy_actions,
+    state,
+    action,
+    seeds,
+    gamma,
+    epsilon,
+    max_length,
+):
+    """sample_returns 的 NumPy 版本: 所有 episode 作为数组一起推进"""
+    num_actions = len(next_states) // num_states
+    rng_state = np.array(seeds, dtype=np.int64)
+    current_state = np.full(len(seeds), state)
+    current_action = np.full(len(seeds), action)
+    returns = np.zeros(len(seeds))
+    discount = 1.0
+    active = np.ones(len(seeds), dtype=bool)
+    for _ in range(max_length):
+        index = current_action * num_states + current_state
+        next_state = next_states[index]
+        returns[active] += discount * rewards[index][active]
+        discount *= gamma
+        active &= next_state != target_state
+        if not active.any():
+            break
+        current_state = np.where(active, next_state, current_state)
+        rng_state = np.where(active, next_seed(rng_state), rng_state)
+        explore = active & (rng_state / LCG_MODULUS <= epsilon)
+        rng_state = np.where(explore, next_seed(rng_state), rng_state)
+        current_action = np.where(
+            explore, rng_state % num_actions, greedy_actions[current_state]
+        )
+    return returns.mean()
+
+
+def test_sample_returns_matches_numpy():
+    env = GridWorld()
+    next_states = env.next_state_table.ravel(order="F")
+    rewards = env.reward_table.ravel(order="F")
+    greedy = np.random.default_rng(1).integers(env.num_actions, size=env.num_states)
+    seeds = np.random.default_rng(2).integers(1, LCG_MODULUS, size=50)
+    for mode in ("python", resolve_kernels("auto")):
+        sample = kernel(sample_returns, mode)
+        for state, action in [(0, 0), (7, 3), (env.num_states - 1, 4)]:
+            args = (
+                next_states,
+                rewards,
+                env.num_states,
+                env.target_state_idx,
+                greedy,
+                state,
+                action,
+                seeds,
+                0.9,
+                0.3,
+                200,
+            )
+            assert np.isclose(
+                sample(*args), numpy_sample_returns(*args), rtol=0, atol=1e-12
+            )
+
+
+def test_default_kernels_are_the_same():
+    env = GridWorld()
+    assert MonteCarloGreedy(env).kernels == resolve_kernels("auto")
+    assert GaussSeidelValueIteration(env).kernels == resolve_kernels("auto")
+    assert MonteCarloGreedy(env, kernels=None).kernels is None
+
+
+def test_kernel_modes_give_the_same_policy():
+    results = []
+    for mode in ("auto", "python"):
+        algorithm = MonteCarloGreedy(GridWorld(), seed=0, kernels=mode)
+        algorithm.num_samples = 5
+        algorithm.max_iterations = 3
+        algorithm.iteration()
+        results.append(np.asarray(algorithm.action_values))
+    assert np.array_equal(results[0], results[1])
@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+from maps import list_maps, map_path
+
+
+def test_map_path_rejects_traversal(tmp_path):
+    (tmp_path / "maps").mkdir()
+    (tmp_path / "maps" / "room.txt").write_text("S..\n...\n..G\n")
+    (tmp_path / "secret.txt").write_text("#")
+    directory = str(tmp_path / "maps")
+    assert list_maps(directory) == ["room.txt"]
+    assert map_path(directory, "room.txt") == os.path.join(directory, "room.txt")
+    for map_id in ("../secret.txt", str(tmp_path / "secret.txt"), "", "missing.txt"):
+        with pytest.raises(ValueError):
+            map_path(directory, map_id)
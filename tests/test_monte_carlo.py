@@ -0,0 +1,136 @@
+import gc
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from grid_world import GridWorld
+from monte_carlo_iteration import MonteCarloGreedy, batched_returns
+from value_iteration import ValueIteration
+
+
+def deterministic_return(env, state, action, greedy_actions, gamma, max_length):
+    """epsilon = 0 时从 (s, a) 出发的折扣回报, 到达目标时结束"""
+    return_, discount = 0.0, 1.0
+    for _ in range(max_length):
+        state, reward = env.get_next_state_and_reward(state, action)
+        return_ += discount * reward
+        discount *= gamma
+        if state == env.target_state_idx:
+            break
+        action = greedy_actions[state]
+    return return_
+
+
+def test_batched_returns_without_exploration():
+    env = GridWorld()
+    greedy_actions = np.random.default_rng(0).integers(
+        env.num_actions, size=env.num_states
+    )
+    pairs = np.arange(env.num_states * env.num_actions)
+    returns = batched_returns(
+        env.next_state_table,
+        env.reward_table,
+        env.target_state_idx,
+        greedy_actions,
+        pairs // env.num_actions,
+        pairs % env.num_actions,
+        0.9,
+        0.0,
+        50,
+        np.random.default_rng(0),
+    )
+    expected = [
+        deterministic_return(env, state, action, greedy_actions, 0.9, 50)
+        for state, action in zip(pairs // env.num_actions, pairs % env.num_actions)
+    ]
+    np.testing.assert_allclose(returns, expected, rtol=0, atol=1e-12)
+
+
+def test_batched_estimation_is_reproducible():
+    results = []
+    for _ in range(2):
+        algorithm = MonteCarloGreedy(GridWorld(), seed=0, batched=True)
+        algorithm.num_samples = 10
+        algorithm.max_iterations = 3
+        algorithm.iteration()
+        results.append(np.asarray(algorithm.action_values))
+    assert np.array_equal(results[0], results[1])
+
+
+def parallel_algorithm(seed, num_workers):
+    algorithm = MonteCarloGreedy(GridWorld(), seed=seed, num_workers=num_workers)
+    algorithm.num_samples = 10
+    algorithm.max_episode_length = 50
+    return algorithm
+
+
+def parallel_action_values(num_workers, num_iterations=2):
+    algorithm = parallel_algorithm(0, num_workers)
+    for _ in range(num_iterations):
+        algorithm.step_iteration()
+    algorithm.close()
+    return np.asarray(algorithm.action_values)
+
+
+def test_parallel_estimation_does_not_depend_on_num_workers():
+    expected = parallel_action_values(1)
+    for num_workers in (2, 4):
+        assert np.array_equal(parallel_action_values(num_workers), expected)
+
+
+def test_in_process_workers_are_per_instance():
+    # 两个对象交替迭代, 与分别单独运行的结果相同
+    first = parallel_algorithm(0, 1)
+    second = parallel_algorithm(1, 1)
+    for _ in range(2):
+        first.step_iteration()
+        second.step_iteration()
+    first.close()
+    second.step_iteration()
+    second.close()
+    assert np.array_equal(np.asarray(first.action_values), parallel_action_values(1))
+    expected = parallel_algorithm(1, 1)
+    for _ in range(3):
+        expected.step_iteration()
+    expected.close()
+    assert np.array_equal(second.action_values, expected.action_values)
+
+
+def test_abandoned_algorithm_releases_shared_memory():
+    algorithm = parallel_algorithm(0, 1)
+    algorithm.step_iteration()
+    name = algorithm._policy_shm.name
+    del algorithm
+    gc.collect()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+@pytest.mark.parametrize("visit", ["first", "every"])
+def test_visit_estimation_without_exploration(visit):
+    # 最优策略下所有 episode 都到达目标, epsilon = 0 时每次经过 (s, a)
+    # 之后的回报都等于从 (s, a) 出发的确定性回报
+    env = GridWorld()
+    solver = ValueIteration(env)
+    solver.iteration()
+    greedy_actions = np.argmax(solver.policy, axis=1)
+    algorithm = MonteCarloGreedy(env, seed=0, visit=visit, instrument=True)
+    algorithm.policy = solver.policy
+    algorithm.epsilon = 0.0
+    algorithm.num_samples = 3
+    algorithm.estimation()
+    expected = [
+        [
+            deterministic_return(env, state, action, greedy_actions, 0.9, 1000)
+            for action in range(env.num_actions)
+        ]
+        for state in range(env.num_states)
+    ]
+    np.testing.assert_allclose(algorithm.action_values, expected, rtol=0, atol=1e-12)
+    assert algorithm.stats.counters["episodes"] < env.num_states * env.num_actions * 3
+
+
+def test_visit_modes_reject_num_workers():
+    with pytest.raises(ValueError):
+        MonteCarloGreedy(GridWorld(), visit="first", num_workers=2)
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from grid_world import GridWorld
+from sessions import SessionRegistry
+from value_iteration import ValueIteration
+
+
+def new_session():
+    env = GridWorld()
+    return env, ValueIteration(env)
+
+
+def recording_registry(**kwargs):
+    evicted = []
+    done = threading.Semaphore(0)
+
+    def on_evict(session):
+        evicted.append(session.session_id)
+        done.release()
+
+    return SessionRegistry(on_evict=on_evict, **kwargs), evicted, done
+
+
+def test_sessions_are_independent():
+    registry, evicted, _ = recording_registry()
+    first = registry.put("a", *new_session())
+    second = registry.put("b", *new_session())
+    assert registry.get("a") is first
+    assert registry.get("b") is second
+    assert registry.get("c") is None
+    assert first.lock is not second.lock
+    assert evicted == []
+
+
+def test_least_recently_used_session_is_evicted_over_budget():
+    session_bytes = SessionRegistry().put("x", *new_session()).nbytes
+    registry, evicted, done = recording_registry(memory_budget=2 * session_bytes)
+    registry.put("a", *new_session())
+    registry.put("b", *new_session())
+    registry.get("a")  # b 变为最久未使用
+    registry.put("c", *new_session())
+    assert done.acquire(timeout=5)
+    assert evicted == ["b"]
+    assert registry.get("b") is None
+    assert registry.get("a") is not None and registry.get("c") is not None
+
+
+def test_expired_sessions_are_removed():
+    registry, evicted, done = recording_registry(ttl=0.05)
+    registry.put("a", *new_session())
+    time.sleep(0.1)
+    assert registry.get("a") is None
+    assert done.acquire(timeout=5)
+    assert evicted == ["a"]
+
+
+def test_replaced_session_is_released_after_its_requests():
+    registry, evicted, done = recording_registry()
+    old = registry.put("a", *new_session())
+    with old.lock:
+        registry.put("a", *new_session())
+        # 旧会话的请求还没有结束, 不能释放
+        assert not done.acquire(timeout=0.1)
+    assert done.acquire(timeout=5)
+    assert evicted == ["a"]
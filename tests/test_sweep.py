@@ -0,0 +1,67 @@
+import csv
+
+import sweep
+
+
+def test_expand_runs_takes_the_product_and_explicit_runs():
+    spec = {
+        "maps": [{"env_size": [6, 6], "density": 0.2, "seed": 3, "count": 2}],
+        "algorithms": [
+            "ValueIteration",
+            {"name": "TruncatedPolicyIteration", "truncation": "adaptive"},
+        ],
+        "params": {"gamma": [0.9, 0.99]},
+        "runs": [{"map": {"env_size": [5, 5]}, "algorithm": "PolicyIteration"}],
+    }
+    runs = sweep.expand_runs(spec)
+    assert len(runs) == 2 * 2 * 2 + 1
+    assert {run["map"]["seed"] for run in runs[:-1]} == {3, 4}
+    assert runs[2]["options"] == {"truncation": "adaptive"}
+    assert len({run["run_id"] for run in runs}) == len(runs)
+    # run_id 只由运行的内容决定
+    assert [run["run_id"] for run in sweep.expand_runs(spec)] == [
+        run["run_id"] for run in runs
+    ]
+
+
+def test_execute_records_env_size_and_map_file(tmp_path):
+    path = tmp_path / "corridor.txt"
+    path.write_text("S...\n.##.\n...G\n")
+    (run,) = sweep.expand_runs(
+        {"maps": [{"file": str(path)}], "algorithms": ["ValueIteration"]}
+    )
+    row = sweep.execute(run)
+    assert row["status"] == "done", row.get("error")
+    assert row["env_size"] == "4x3"
+    assert row["map_file"] == "corridor.txt"
+    assert row["num_states"] == 12
+
+
+def test_execute_records_failures():
+    (run,) = sweep.expand_runs(
+        {
+            "maps": [{"env_size": [5, 5]}],
+            "algorithms": ["ValueIteration"],
+            "params": {"no_such_parameter": [1]},
+        }
+    )
+    row = sweep.execute(run)
+    assert row["status"] == "failed"
+    assert "no_such_parameter" in row["error"]
+
+
+def test_run_sweep_skips_finished_runs(tmp_path):
+    runs = sweep.expand_runs(
+        {
+            "maps": [{"env_size": [5, 5]}],
+            "algorithms": ["ValueIteration", "PolicyIteration"],
+        }
+    )
+    output = tmp_path / "results.csv"
+    sweep.run_sweep(runs, str(output), num_workers=1)
+    sweep.run_sweep(runs, str(output), num_workers=1)
+    with open(output, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert tuple(rows[0]) == sweep.COLUMNS
+    assert sorted(row["run_id"] for row in rows) == sorted(run["run_id"] for run in runs)
+    assert all(row["status"] == "done" for row in rows)
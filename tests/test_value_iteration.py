@@ -0,0 +1,163 @@
+import numpy as np
+import pytest
+
+from grid_world import GridWorld
+from value_iteration import (
+    SWEEP_ORDERS,
+    GaussSeidelValueIteration,
+    MultigridValueIteration,
+    PolicyIteration,
+    PrioritizedSweeping,
+    TruncatedPolicyIteration,
+    ValueIteration,
+    bicgstab,
+)
+
+THETA = 1e-8
+# theta 是状态值的收敛阈值, 各算法与最优值的误差在 theta / (1 - gamma) 量级
+TOLERANCE = 1e-5
+
+
+def random_env(size=24, density=0.2, seed=0):
+    rng = np.random.default_rng(seed)
+    cells = np.argwhere(rng.random((size, size)) < density)
+    corners = ((0, 0), (size - 1, size - 1))
+    forbidden = [(int(x), int(y)) for y, x in cells if (x, y) not in corners]
+    return GridWorld(
+        env_size=(size, size),
+        target_state=(size - 1, size - 1),
+        forbidden_states=forbidden,
+    )
+
+
+ENVS = {"default": GridWorld, "random": random_env}
+
+
+def optimal_values(make_env):
+    algorithm = ValueIteration(make_env(), theta=1e-12)
+    algorithm.iteration()
+    return np.asarray(algorithm.state_values)
+
+
+SOLVERS = {
+    "value_iteration_python": lambda env, **kw: ValueIteration(
+        env, backend="python", **kw
+    ),
+    "gauss_seidel": lambda env, **kw: GaussSeidelValueIteration(env, **kw),
+    **{
+        f"gauss_seidel_{order}": (
+            lambda env, order=order, **kw: GaussSeidelValueIteration(
+                env, order=order, **kw
+            )
+        )
+        for order in SWEEP_ORDERS
+    },
+    "prioritized": lambda env, **kw: PrioritizedSweeping(env, **kw),
+    "policy_direct": lambda env, **kw: PolicyIteration(env, evaluation="direct", **kw),
+    "policy_krylov": lambda env, **kw: PolicyIteration(env, evaluation="krylov", **kw),
+    "policy_iterative": lambda env, **kw: PolicyIteration(env, **kw),
+    "truncated_fixed": lambda env, **kw: TruncatedPolicyIteration(env, **kw),
+    "truncated_adaptive": lambda env, **kw: TruncatedPolicyIteration(
+        env, truncation="adaptive", **kw
+    ),
+    "truncated_adaptive_krylov": lambda env, **kw: TruncatedPolicyIteration(
+        env, truncation="adaptive", evaluation="krylov", **kw
+    ),
+    "multigrid": lambda env, **kw: MultigridValueIteration(env, min_size=8, **kw),
+}
+
+
+@pytest.mark.parametrize("env_name", ENVS)
+@pytest.mark.parametrize("solver", SOLVERS)
+def test_solver_reaches_value_iteration_optimum(env_name, solver):
+    make_env = ENVS[env_name]
+    algorithm = SOLVERS[solver](make_env(), theta=THETA, seed=0)
+    algorithm.iteration()
+    values = np.asarray(algorithm.state_values)
+    np.testing.assert_allclose(values, optimal_values(make_env), rtol=0, atol=TOLERANCE)
+
+
+# 迭代法策略评估在 numpy 后端是同步 (Jacobi) 更新, 在 python 后端是原地更新,
+# 收敛到同一个结果, 但外层迭代次数可以不同
+@pytest.mark.parametrize(
+    "make_algorithm, same_iterations",
+    [
+        (ValueIteration, True),
+        (PolicyIteration, False),
+        (lambda env, **kw: PolicyIteration(env, evaluation="direct", **kw), True),
+        (
+            lambda env, **kw: TruncatedPolicyIteration(
+                env, truncation="adaptive", **kw
+            ),
+            False,
+        ),
+    ],
+)
+def test_numpy_and_python_backends_agree(make_algorithm, same_iterations):
+    results = []
+    for backend in ("numpy", "python"):
+        algorithm = make_algorithm(random_env(size=10), seed=0, backend=backend)
+        algorithm.iteration()
+        results.append(algorithm)
+    numpy_result, python_result = results
+    if same_iterations:
+        assert numpy_result.current_iteration_num == python_result.current_iteration_num
+    np.testing.assert_allclose(
+        np.asarray(numpy_result.state_values, dtype=np.float64),
+        np.asarray(python_result.state_values, dtype=np.float64),
+        rtol=0,
+        atol=TOLERANCE,
+    )
+    assert np.array_equal(
+        np.argmax(np.asarray(numpy_result.policy), axis=1),
+        np.argmax(np.asarray(python_result.policy), axis=1),
+    )
+
+
+def test_krylov_budget_of_zero_does_no_work():
+    algorithm = TruncatedPolicyIteration(
+        GridWorld(), truncation="adaptive", evaluation="krylov"
+    )
+    algorithm.evaluation_cap = 0
+    algorithm.current_iteration_num = 1  # 不是试探评估的迭代
+    algorithm.policy_improvement()
+    values = np.array(algorithm.state_values)
+    algorithm.policy_evaluation()
+    assert algorithm.inner_sweeps == 0
+    assert np.array_equal(algorithm.state_values, values)
+
+
+def test_evaluation_cap_recovers():
+    algorithm = TruncatedPolicyIteration(GridWorld(), truncation="adaptive")
+    algorithm.evaluation_cap = 0
+    algorithm.current_iteration_num = algorithm.probe_interval
+    algorithm.residual = 1.0
+    algorithm.policy_changes = 0
+    # 评估不划算之后仍然定期试探, 试探划算时上限重新加倍
+    assert algorithm.evaluation_budget == 1
+    algorithm.bellman_residual = 1.0
+    algorithm.improvement_rate = 1.0
+    algorithm.inner_sweeps = 1
+    algorithm.improvement_sweep = lambda: setattr(algorithm, "bellman_residual", 0.5)
+    algorithm.policy_improvement()
+    assert algorithm.evaluation_cap == 1
+
+
+def test_bicgstab_reports_the_true_residual_on_breakdown():
+    b = np.ones(3)
+    with np.errstate(all="raise"):
+        x, num_iterations, residual = bicgstab(
+            lambda x: 0 * x, b, np.zeros(3), 1e-6, 10
+        )
+    assert num_iterations == 1
+    assert residual == 1.0
+
+
+def test_krylov_falls_back_when_bicgstab_stops_early():
+    algorithm = PolicyIteration(GridWorld(), theta=THETA, evaluation="krylov")
+    algorithm.krylov_max_iterations = 1
+    algorithm.iteration()
+    assert algorithm.residual <= THETA * (1 - algorithm.gamma)
+    np.testing.assert_allclose(
+        algorithm.state_values, optimal_values(GridWorld), rtol=0, atol=TOLERANCE
+    )
@@ -0,0 +1,295 @@
+import base64
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import app as webapp
+from jobs import Job
+from occupancy import OccupancyGrid
+from solve_cache import SolveCache, solve_key
+
+
+@pytest.fixture
+def solve_cache(monkeypatch):
+    cache = SolveCache()
+    monkeypatch.setattr(webapp, "solve_cache", cache)
+    return cache
+
+
+def new_client(**config):
+    client = webapp.app.test_client()
+    response = client.post("/api/init", json=config)
+    assert response.status_code == 200, response.get_json()
+    return client
+
+
+def test_sessions_are_per_client():
+    first = new_client(gamma=0.5)
+    second = new_client()
+    first.post("/api/run_value_iteration")
+    response = first.post("/api/get_iteration", json={"iteration": 1})
+    assert response.status_code == 200
+    response = second.post("/api/get_iteration", json={"iteration": 1})
+    assert response.status_code == 400  # 第二个会话还没有迭代
+
+
+def key_arguments(forbidden_states):
+    return dict(
+        algorithm="value_iteration",
+        env_size=(5, 5),
+        start_state=(0, 0),
+        target_state=(4, 4),
+        forbidden_states=forbidden_states,
+        gamma=0.9,
+        theta=0.001,
+        max_iterations=100,
+        seed=None,
+    )
+
+
+def test_solve_key_ignores_obstacle_order_and_source():
+    states = [(2, 1), (3, 3), (1, 3)]
+    key = solve_key(**key_arguments(states))
+    assert solve_key(**key_arguments(states[::-1])) == key
+    assert solve_key(**key_arguments(OccupancyGrid.from_states(states, (5, 5)))) == key
+    assert solve_key(**key_arguments(states[:2])) != key
+    assert solve_key(**dict(key_arguments(states), gamma=0.8)) != key
+
+
+def test_solve_cache_hit(solve_cache):
+    first = new_client(gamma=0.85).post("/api/run_value_iteration")
+    assert first.headers["X-Solve-Cache"] == "miss"
+    second = new_client(gamma=0.85).post("/api/run_value_iteration")
+    assert second.headers["X-Solve-Cache"] == "hit"
+    assert second.get_json() == first.get_json()
+    assert solve_cache.hits == 1
+
+
+def test_stepping_does_not_poison_the_cache(solve_cache):
+    reference = new_client(gamma=0.8).post("/api/run_value_iteration").get_json()
+    solve_cache._entries.clear()
+
+    client = new_client(gamma=0.8)
+    for _ in range(5):
+        client.post("/api/step_iteration", json={})
+    response = client.post("/api/run_value_iteration")
+    assert response.headers["X-Solve-Cache"] == "miss"
+    assert response.get_json()["total_iterations"] == reference["total_iterations"]
+
+    response = new_client(gamma=0.8).post("/api/run_value_iteration")
+    assert response.headers["X-Solve-Cache"] == "hit"
+    assert response.get_json() == reference
+
+
+@pytest.mark.parametrize(
+    "config",
+    [
+        {"seed": "abc"},
+        {"seed": -1},
+        {"seed": 1.5},
+        {"env_size": [3, 3]},  # 默认目标 (4, 4) 在网格之外
+        {"target_state": [5, 0]},
+        {"start_state": [-1, 0]},
+        {"start_state": [2, 1]},  # 禁止状态
+        {"target_state": "ab"},
+    ],
+)
+def test_init_rejects_invalid_config(config):
+    response = webapp.app.test_client().post("/api/init", json=config)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_init_rejects_unknown_map_id():
+    client = webapp.app.test_client()
+    response = client.post("/api/init", json={"map_id": "../README.md"})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"start_states": [[9, 9]]},  # 在网格之外
+        {"start_states": [[2, 1]]},  # 禁止状态
+        {"start_states": [[1]]},
+        {"start_states": [[1.5, 0]]},
+        {"start_states": "x"},
+        {"max_steps": "abc"},
+        {"epsilon": [1]},
+    ],
+)
+def test_rollout_rejects_invalid_input(body):
+    client = new_client()
+    client.post("/api/run_value_iteration")
+    response = client.post("/api/rollout", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_rollout_all_start_states():
+    client = new_client()
+    client.post("/api/run_value_iteration")
+    result = client.post("/api/rollout", json={"start_states": "all"}).get_json()
+    # 5x5 网格去掉 3 个禁止状态和目标
+    assert result["num_rollouts"] == 21
+    assert all(result["reached"])
+
+
+def stream_events(client):
+    """逐个读取 /api/stream_iteration 的 (事件名, 数据)"""
+    response = client.get("/api/stream_iteration", buffered=False)
+    for chunk in response.response:
+        text = chunk.decode() if isinstance(chunk, bytes) else chunk
+        for block in text.strip().split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in block.split("\n"))
+            yield lines["event"], json.loads(lines["data"])
+
+
+def in_thread(function):
+    """在另一个线程中调用 function, 返回结果; 5 秒内没有返回时测试失败"""
+    result = {}
+    thread = threading.Thread(
+        target=lambda: result.update(value=function()), daemon=True
+    )
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive(), "request blocked on the session lock"
+    return result["value"]
+
+
+def test_stream_matches_a_full_solve(solve_cache):
+    expected = new_client(gamma=0.75).post("/api/run_value_iteration").get_json()
+    solve_cache._entries.clear()
+    events = list(stream_events(new_client(gamma=0.75)))
+    names = [name for name, _ in events]
+    assert names[0] == "start" and names[-1] == "done"
+    assert names.count("iteration") == expected["total_iterations"]
+    assert events[-1][1]["total_iterations"] == expected["total_iterations"]
+    np.testing.assert_allclose(
+        events[-1][1]["action_values"], expected["action_values"]
+    )
+
+
+def test_stream_does_not_hold_the_session_lock_between_events(solve_cache):
+    client = new_client(gamma=0.95)
+    events = stream_events(client)
+    assert next(events)[0] == "start"
+    assert next(events)[0] == "iteration"
+    # 流暂停在 yield 处, 同一会话的其他请求不被阻塞
+    response = in_thread(
+        lambda: client.post("/api/get_iteration", json={"iteration": 1})
+    )
+    assert response.status_code == 200
+    # 同一会话开始另一次求解后, 这个流结束
+    in_thread(lambda: client.post("/api/run_value_iteration"))
+    assert [name for name, _ in events] == ["cancelled"]
+
+
+def wait_for_job(client, job_id):
+    for _ in range(500):
+        job = client.get(f"/api/jobs/{job_id}").get_json()
+        if job["status"] in ("done", "failed", "cancelled"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_job_result_matches_a_full_solve(solve_cache):
+    expected = new_client(gamma=0.7).post("/api/run_value_iteration").get_json()
+    solve_cache._entries.clear()
+    client = new_client(gamma=0.7)
+    job = client.post("/api/jobs")
+    assert job.status_code == 202
+    job_id = job.get_json()["job_id"]
+    assert wait_for_job(client, job_id)["status"] == "done"
+    assert client.get(f"/api/jobs/{job_id}/result").get_json() == expected
+    # 其他会话看不到这个任务
+    assert new_client().get(f"/api/jobs/{job_id}").status_code == 404
+
+
+def test_job_does_not_hold_the_session_lock(solve_cache, monkeypatch):
+    client = new_client(gamma=0.95)
+    paused = threading.Event()
+    resume = threading.Event()
+    report = Job.report
+
+    def slow_report(job, completed):
+        report(job, completed)
+        paused.set()
+        resume.wait(timeout=5)
+
+    # 任务在两次迭代之间报告进度时暂停
+    monkeypatch.setattr(Job, "report", slow_report)
+    job_id = client.post("/api/jobs").get_json()["job_id"]
+    assert paused.wait(timeout=5)
+    response = in_thread(lambda: client.post("/api/rollout", json={}))
+    assert response.status_code == 200
+    resume.set()
+    assert wait_for_job(client, job_id)["status"] == "done"
+
+
+def decode(array):
+    if isinstance(array, list):
+        return np.asarray(array)
+    data = base64.b64decode(array["data"])
+    return np.frombuffer(data, dtype=array["dtype"]).reshape(array["shape"])
+
+
+@pytest.mark.parametrize("encoding", ["json", "binary"])
+def test_compact_payload_matches_json(encoding):
+    json_client = new_client(gamma=0.8)
+    compact_client = new_client(gamma=0.8)
+    values = None
+    for iteration in range(1, 6):
+        full = json_client.post("/api/step_iteration", json={}).get_json()
+        since = iteration - 1 if iteration > 1 else None
+        compact = compact_client.post(
+            "/api/step_iteration", json={"encoding": encoding, "since": since}
+        ).get_json()
+        assert compact["total_iterations"] == full["total_iterations"]
+        if since is None:
+            values = decode(compact["state_values"]).astype(np.float64)
+            actions = decode(compact["best_actions"]).copy()
+        else:
+            # 增量结果只包含发生变化的状态
+            changed = decode(compact["changed_states"])
+            values[changed] = decode(compact["state_values"])
+            actions[changed] = decode(compact["best_actions"])
+        np.testing.assert_allclose(values, full["state_values"], rtol=1e-6)
+        assert actions.tolist() == [p["best_action_idx"] for p in full["policy"]]
+
+    # 历史结果与 step_iteration 使用相同的格式
+    full = json_client.post("/api/get_iteration", json={"iteration": 3}).get_json()
+    compact = compact_client.post(
+        "/api/get_iteration", json={"iteration": 3, "encoding": encoding}
+    ).get_json()
+    np.testing.assert_allclose(
+        decode(compact["state_values"]), full["state_values"], rtol=1e-6
+    )
+
+
+@pytest.mark.parametrize("since", ["2", 1.5, True, [1]])
+def test_iteration_endpoints_reject_invalid_since(since):
+    client = new_client()
+    client.post("/api/step_iteration", json={})
+    client.post("/api/step_iteration", json={})
+    body = {"encoding": "json", "since": since}
+    response = client.post("/api/step_iteration", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+    response = client.post("/api/get_iteration", json=dict(body, iteration=1))
+    assert response.status_code == 400
+    # 不合法的请求不会推进算法
+    response = client.post("/api/step_iteration", json={})
+    assert response.get_json()["total_iterations"] == 3
+
+
+def test_profile_is_disabled_by_default(monkeypatch):
+    client = new_client()
+    assert client.post("/api/profile").status_code == 404
+    monkeypatch.setattr(webapp, "PROFILE_ENABLED", True)
+    response = client.post("/api/profile", json={"limit": 5})
+    assert response.status_code == 200
@@ -1,20 +1,287 @@
-from flask import Flask, render_template, jsonify, request
+from flask import (
+    Flask,
+    Response,
+    render_template,
+    jsonify,
+    request,
+    g,
+    stream_with_context,
+)
+import base64
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import pstats
+import secrets
 import sys
 import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
 
 # 添加src目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-from grid_world import GridWorld
+from grid_world import GridWorld, rollout
+from history import IterationHistory
+from iteration import greedy_actions
 from value_iteration import ValueIteration, PolicyIteration, TruncatedPolicyIteration
 from monte_carlo_iteration import MonteCarloGreedy
+from jobs import JobQueue, QueueFull
+import kernels
+from maps import list_maps, load_map, map_path
+from sessions import SessionRegistry
+from solve_cache import SolveCache, solve_key
 
 app = Flask(__name__)
 
-# 全局变量存储环境和分析器
-env = None
-algorithm = None  # 存储算法实例（可以是ValueIteration或PolicyIteration）
+# 迭代历史写入磁盘时使用的目录
+HISTORY_DIR = os.environ.get(
+    "RL_HISTORY_DIR", os.path.join(tempfile.gettempdir(), "rl_history")
+)
+
+# /api/init 中 map_id 引用的地图文件所在的目录
+MAPS_DIR = os.environ.get(
+    "RL_MAPS_DIR", os.path.join(os.path.dirname(__file__), "..", "maps")
+)
+
+# 请求体 (包括上传的地图文件) 的大小上限
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("RL_MAX_UPLOAD_MB", 64)) * 1024**2
+
+# 保存会话 id 的 cookie
+SESSION_COOKIE = "rl_session"
+
+# 单次 rollout 请求的步数上限
+MAX_ROLLOUT_STEPS = 10000
+
+# 后台求解任务：RL_JOB_WORKERS 个工作线程，最多 RL_JOB_QUEUE 个排队或运行中的任务，
+# 长时间的求解不会占用处理交互请求的线程
+jobs = JobQueue(
+    max_workers=int(os.environ.get("RL_JOB_WORKERS", 2)),
+    max_pending=int(os.environ.get("RL_JOB_QUEUE", 8)),
+)
+
+# 相同配置的求解结果只计算一次，RL_SOLVE_CACHE_DIR 不为空时同时写入磁盘
+solve_cache = SolveCache(
+    max_bytes=int(os.environ.get("RL_SOLVE_CACHE_MB", 64)) * 1024**2,
+    cache_dir=os.environ.get("RL_SOLVE_CACHE_DIR") or None,
+)
+
+
+# /api/profile：默认关闭，RL_ENABLE_PROFILE=1 时开启；同一时间只能运行一个 profiler
+PROFILE_ENABLED = os.environ.get("RL_ENABLE_PROFILE", "0") == "1"
+PROFILE_SORTS = ("cumulative", "tottime")
+profile_lock = threading.Lock()
+
+# 安装了 numba 时在后台线程中编译 (或从缓存读取) 内核，第一个请求不需要等待编译
+kernel_warm_up = {"seconds": None}
+
+
+def warm_up_kernels():
+    kernel_warm_up["seconds"] = kernels.warm_up()
+
+
+if kernels.HAVE_NUMBA:
+    threading.Thread(target=warm_up_kernels, daemon=True).start()
+
+
+def release_algorithm(algorithm):
+    """释放算法占用的进程池和磁盘上的迭代历史"""
+    if hasattr(algorithm, "close"):
+        algorithm.close()
+    spill_dir = algorithm.iteration_history.spill_dir
+    if spill_dir is not None:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def release_session(session):
+    """会话被替换或移除时释放它的算法"""
+    release_algorithm(session.algorithm)
+    # 仍在这个会话上逐步求解的 SSE 流和后台任务据此停止
+    session.algorithm = None
+
+
+def restart_algorithm(session):
+    """
+    用会话的配置新建算法实例替换原来的实例，返回新实例。
+
+    step_iteration 之后算法停在中间状态；完整求解和缓存的结果都应该从初始
+    状态开始，否则缓存中会存入只包含剩余迭代的结果。
+    """
+    if session.make_algorithm is None:
+        return session.algorithm
+    release_algorithm(session.algorithm)
+    session.algorithm = session.make_algorithm()
+    return session.algorithm
+
+
+# 每个会话一组 (env, algorithm)，按内存预算和 TTL 移除
+sessions = SessionRegistry(
+    memory_budget=int(os.environ.get("RL_SESSION_MEMORY_MB", 512)) * 1024**2,
+    ttl=int(os.environ.get("RL_SESSION_TTL", 30 * 60)),
+    on_evict=release_session,
+)
+
+
+def with_session(view):
+    """
+    找到当前请求的会话，在会话的锁内调用 view(env, algorithm)
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        session = sessions.get(request.cookies.get(SESSION_COOKIE))
+        if session is None:
+            return jsonify({"error": "Environment not initialized"}), 400
+        g.session = session
+        with session.lock:
+            return view(session.env, session.algorithm, *args, **kwargs)
+
+    return wrapper
+
+
+# 响应中数组的编码方式
+# 不指定: 原来的格式, policy 是每个状态一个 dict 的列表
+# json: 紧凑格式, 每个数组是一个列表, 策略只保存最优动作
+# binary: 紧凑格式, 每个数组是 base64 编码的 Float32/Int8 数据, 前端直接读入 TypedArray
+ENCODINGS = ("json", "binary")
+
+
+def policy_list(env, policy, probabilities=None):
+    """
+    把策略转换为前端使用的每个状态一个 dict 的列表。
+
+    probabilities 不为 None 时作为每个状态的动作概率返回, 否则返回策略本身的行。
+    """
+    policy = np.asarray(policy)
+    best_actions = greedy_actions(policy.astype(np.float64)).tolist()
+    rows = policy.tolist() if probabilities is None else None
+    entries = []
+    for state_idx, best_action_idx in enumerate(best_actions):
+        x, y = env.state_idx_to_xy(state_idx)
+        entries.append(
+            {
+                "state_idx": state_idx,
+                "x": x,
+                "y": y,
+                "best_action_idx": best_action_idx,
+                "action": list(env.action_space[best_action_idx]),
+                "policy": probabilities if rows is None else rows[state_idx],
+            }
+        )
+    return entries
+
+
+def encode_array(array, dtype, encoding):
+    """json 编码时返回列表, binary 编码时按 dtype 转换后返回 base64 数据和形状"""
+    if encoding != "binary":
+        return np.asarray(array).tolist()
+    array = np.ascontiguousarray(array, dtype=dtype)
+    return {
+        "dtype": array.dtype.name,
+        "shape": list(array.shape),
+        "data": base64.b64encode(array.tobytes()).decode("ascii"),
+    }
+
+
+def compact_payload(state_values, policy, action_values, encoding, previous=None):
+    """
+    紧凑格式的状态值、最优动作和动作值。
+
+    previous 是客户端已有的 (state_values, policy, action_values) 时只返回
+    发生变化的状态, changed_states 给出这些状态的索引。
+    """
+    state_values = np.asarray(state_values, dtype=np.float64)
+    best_actions = greedy_actions(np.asarray(policy, dtype=np.float64))
+    action_values = (
+        None if action_values is None else np.asarray(action_values, dtype=np.float64)
+    )
+    action_dtype = np.int8 if np.asarray(policy).shape[1] <= 127 else np.int32
+    payload = {"encoding": encoding}
+    if previous is not None:
+        old_values, old_policy, old_action_values = previous
+        changed = (state_values != old_values) | (
+            best_actions != greedy_actions(np.asarray(old_policy, dtype=np.float64))
+        )
+        if action_values is not None and old_action_values is not None:
+            changed |= np.any(action_values != old_action_values, axis=1)
+        changed_states = np.flatnonzero(changed)
+        state_values = state_values[changed_states]
+        best_actions = best_actions[changed_states]
+        if action_values is not None:
+            action_values = action_values[changed_states]
+        payload["changed_states"] = encode_array(changed_states, np.int32, encoding)
+    payload["state_values"] = encode_array(state_values, np.float32, encoding)
+    payload["best_actions"] = encode_array(best_actions, action_dtype, encoding)
+    payload["action_values"] = (
+        None
+        if action_values is None
+        else encode_array(action_values, np.float32, encoding)
+    )
+    return payload
+
+
+def values_payload(
+    env,
+    state_values,
+    policy,
+    action_values,
+    encoding=None,
+    previous=None,
+    probabilities=None,
+):
+    """
+    所有接口共用的状态值、策略和动作值。
+
+    encoding 为 None 时返回逐状态的 JSON 列表 (probabilities 见 policy_list),
+    否则返回 compact_payload 的紧凑格式, previous 只用于紧凑格式。
+    """
+    if encoding is not None:
+        return compact_payload(state_values, policy, action_values, encoding, previous)
+    return {
+        "state_values": np.asarray(state_values, dtype=np.float64).tolist(),
+        "policy": policy_list(env, policy, probabilities),
+        "action_values": (
+            None
+            if action_values is None
+            else np.asarray(action_values, dtype=np.float64).tolist()
+        ),
+    }
+
+
+def request_encoding(data):
+    """返回请求指定的编码方式, 不合法时抛出 ValueError"""
+    encoding = data.get("encoding")
+    if encoding is not None and encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding: {encoding}, expected one of {ENCODINGS}")
+    return encoding
+
+
+def history_arrays(history, iteration_num):
+    """返回第 iteration_num 次迭代的 (state_values, policy, action_values)"""
+    item = history[iteration_num - 1]
+    return item["state_values"], item["policy"], item["action_values"]
+
+
+def request_since(data):
+    """返回请求中的 since (客户端当前显示的迭代次数), 不合法时抛出 ValueError"""
+    since = data.get("since")
+    if since is not None and (not isinstance(since, int) or isinstance(since, bool)):
+        raise ValueError(f"since must be an integer or null, got {since!r}")
+    return since
+
+
+def previous_arrays(history, since):
+    """since 在历史范围内时返回该次迭代的结果, 否则返回 None (发送完整结果)"""
+    if since is None or not 1 <= since <= len(history):
+        return None
+    return history_arrays(history, since)
 
 
 @app.route("/")
@@ -25,11 +292,20 @@ def index():
 
 @app.route("/api/init", methods=["POST"])
 def init_env():
-    """初始化环境"""
-    global env, algorithm
+    """
+    初始化环境
 
+    地图可以是 JSON 中的 env_size / forbidden_states, 也可以是 MAPS_DIR 中的
+    map_id, 或者以 multipart/form-data 上传的 map 文件 (其余参数以 JSON 放在
+    config 字段中); 后两种情况下 start_state / target_state 默认取地图中的
+    标记或左上角 / 右下角。
+    """
     # 获取前端传来的参数
-    data = request.get_json() or {}
+    upload = request.files.get("map")
+    if upload is not None:
+        data = json.loads(request.form.get("config") or "{}")
+    else:
+        data = request.get_json() or {}
 
     # 解析参数，提供默认值
     algorithm_type = data.get("algorithm", "value_iteration")
@@ -39,112 +315,200 @@ def init_env():
     forbidden_states = [
         tuple(s) for s in data.get("forbidden_states", [[2, 1], [3, 3], [1, 3]])
     ]
+    gamma = float(data.get("gamma", 0.9))
+    theta = float(data.get("theta", 0.001))
+    max_iterations = int(data.get("max_iterations", 100))
+    seed = data.get("seed", None)
+    if seed is not None and (
+        not isinstance(seed, int) or isinstance(seed, bool) or seed < 0
+    ):
+        return jsonify({"error": "seed must be a non-negative integer or null"}), 400
+    # 蒙特卡洛采样使用的内核 (见 kernels.KERNEL_MODES)，默认与算法相同为 auto，
+    # null 表示不使用内核
+    kernel_mode = data.get("kernels", "auto")
+    try:
+        kernel_mode = kernels.resolve_kernels(kernel_mode)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
 
     # 创建环境
-    env = GridWorld(
-        env_size=env_size,
-        start_state=start_state,
-        target_state=target_state,
-        forbidden_states=forbidden_states,
-    )
-
-    # 根据算法类型创建对应的算法实例
-    if algorithm_type == "policy_iteration":
-        algorithm = PolicyIteration(env, theta=0.001, gamma=0.9, max_iterations=100)
-    elif algorithm_type == "truncated_policy_iteration":
-        algorithm = TruncatedPolicyIteration(
-            env, theta=0.001, gamma=0.9, max_iterations=100
+    if upload is not None or "map_id" in data:
+        try:
+            if upload is not None:
+                env = load_map(
+                    io.BytesIO(upload.read()),
+                    name=upload.filename,
+                    start_state=data.get("start_state"),
+                    target_state=data.get("target_state"),
+                )
+            else:
+                env = load_map(
+                    map_path(MAPS_DIR, data["map_id"]),
+                    start_state=data.get("start_state"),
+                    target_state=data.get("target_state"),
+                )
+        except (ValueError, OSError) as error:
+            return jsonify({"error": str(error)}), 400
+        env_size = env.env_size
+        start_state = env.start_state
+        target_state = env.target_state
+    else:
+        # 起点和目标必须在网格内并且不是禁止状态, 与 load_map 相同
+        try:
+            if not (
+                len(env_size) == 2
+                and all(isinstance(v, int) and v > 0 for v in env_size)
+            ):
+                raise ValueError(
+                    f"env_size {list(env_size)!r} must be two positive integers"
+                )
+            start_state = grid_cell(start_state, env_size, "Start state")
+            target_state = grid_cell(target_state, env_size, "Target state")
+            for label, state in (("Start", start_state), ("Target", target_state)):
+                if state in forbidden_states:
+                    raise ValueError(f"{label} state {state} is forbidden")
+        except ValueError as error:
+            return jsonify({"error": str(error)}), 400
+        env = GridWorld(
+            env_size=env_size,
+            start_state=start_state,
+            target_state=target_state,
+            forbidden_states=forbidden_states,
         )
-    elif algorithm_type == "monte_carlo":
-        algorithm = MonteCarloGreedy(env, theta=0.001, gamma=0.9, max_iterations=100)
-    else:  # 默认使用值迭代
-        algorithm = ValueIteration(env, theta=0.001, gamma=0.9, max_iterations=100)
-
-    # 转换初始策略和状态值为列表格式
-    # 注意：初始策略是随机整数列表，需要转换为有效的概率分布
-    policy_list = []
-    for state_idx in range(env.num_states):
-        x, y = env.state_idx_to_xy(state_idx)
 
-        # 初始策略是随机整数列表，转换为均匀分布
-        policy_state = algorithm.policy[state_idx]
-        num_actions = len(policy_state)
+    spill_history = data.get("spill_history", False)
 
-        # 将随机整数列表转换为均匀分布（每个动作概率相等）
-        uniform_policy = [1.0 / num_actions] * num_actions
+    def make_algorithm():
+        """根据算法类型创建对应的算法实例"""
+        # spill_history 为 True 时迭代历史保存在内存映射文件中，
+        # 查看某次迭代时只读取对应的一行
+        history = None
+        if spill_history:
+            os.makedirs(HISTORY_DIR, exist_ok=True)
+            history = IterationHistory(
+                env.num_states,
+                env.num_actions,
+                spill_dir=tempfile.mkdtemp(dir=HISTORY_DIR),
+            )
 
-        # 找到最优动作索引（对于均匀分布，可以选择第一个动作，或者根据随机整数选择）
-        # 为了显示初始策略，我们选择随机整数中最大的那个对应的动作
-        best_action_idx = max(range(num_actions), key=lambda i: policy_state[i])
+        if algorithm_type == "policy_iteration":
+            algorithm = PolicyIteration(
+                env,
+                theta=theta,
+                gamma=gamma,
+                max_iterations=max_iterations,
+                seed=seed,
+                history=history,
+            )
+        elif algorithm_type == "truncated_policy_iteration":
+            algorithm = TruncatedPolicyIteration(
+                env,
+                theta=theta,
+                gamma=gamma,
+                max_iterations=max_iterations,
+                seed=seed,
+                history=history,
+            )
+        elif algorithm_type == "monte_carlo":
+            algorithm = MonteCarloGreedy(
+                env,
+                theta=theta,
+                gamma=gamma,
+                max_iterations=max_iterations,
+                seed=seed,
+                history=history,
+                kernels=kernel_mode,
+            )
+        else:  # 默认使用值迭代
+            algorithm = ValueIteration(
+                env,
+                theta=theta,
+                gamma=gamma,
+                max_iterations=max_iterations,
+                seed=seed,
+                history=history,
+            )
+        return algorithm
 
-        policy_list.append(
-            {
-                "state_idx": state_idx,
-                "x": x,
-                "y": y,
-                "best_action_idx": best_action_idx,
-                "action": list(env.action_space[best_action_idx]),
-                "policy": uniform_policy,  # 返回均匀分布作为初始策略
-            }
+    algorithm = make_algorithm()
+
+    # 初始策略是随机整数列表，显示随机整数最大的动作，概率按均匀分布返回
+    uniform_policy = [1.0 / env.num_actions] * env.num_actions
+
+    # 同一个浏览器重新初始化时替换原来的会话
+    session_id = request.cookies.get(SESSION_COOKIE) or secrets.token_urlsafe(16)
+    session = sessions.put(session_id, env, algorithm)
+    session.make_algorithm = make_algorithm
+
+    # 值迭代的结果与初始策略无关；其他算法依赖随机初始策略或采样，
+    # 只有固定了 seed 才能复用结果
+    if algorithm_type == "value_iteration" or seed is not None:
+        session.solve_key = solve_key(
+            algorithm_type,
+            env_size,
+            start_state,
+            target_state,
+            env.occupancy,
+            gamma,
+            theta,
+            max_iterations,
+            seed,
+            kernel_mode if algorithm_type == "monte_carlo" else None,
         )
 
-    return jsonify(
+    response = jsonify(
         {
             "algorithm": algorithm_type,
             "env_size": list(env.env_size),
             "start_state": list(env.start_state),
             "target_state": list(env.target_state),
-            "forbidden_states": [list(s) for s in env.forbidden_states],
+            # 按位压缩的禁止状态 (OccupancyGrid.bits), 前端按位读取
+            "forbidden_bits": encode_array(env.occupancy.bits, np.uint8, "binary"),
             "num_states": env.num_states,
             "num_actions": env.num_actions,
             "action_space": [list(a) for a in env.action_space],
-            "state_values": [float(v) for v in algorithm.state_values],
-            "policy": policy_list,
-            "action_values": [
-                [float(v) for v in row] for row in algorithm.action_values
-            ],
+            **values_payload(
+                env,
+                algorithm.state_values,
+                algorithm.policy,
+                algorithm.action_values,
+                probabilities=uniform_policy,
+            ),
         }
     )
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="Lax")
+    return response
 
 
 @app.route("/api/run_value_iteration", methods=["POST"])
-def run_value_iteration():
-    """运行迭代算法（值迭代或策略迭代）"""
-    global env, algorithm
+@with_session
+def run_value_iteration(env, algorithm):
+    """运行迭代算法（值迭代或策略迭代），总是从初始状态开始求解"""
+    algorithm = restart_algorithm(g.session)
 
-    if env is None or algorithm is None:
-        return jsonify({"error": "Environment not initialized"}), 400
+    # 相同配置已经求解过时直接恢复结果
+    key = g.session.solve_key
+    entry = solve_cache.get(key) if key is not None else None
+    if entry is not None:
+        restore_solution(algorithm, entry)
+        response = app.response_class(entry["response"], mimetype="application/json")
+        response.headers["X-Solve-Cache"] = "hit"
+        return response
 
     # 运行迭代算法（捕获输出）
-    import io
-    import contextlib
-
     f = io.StringIO()
     with contextlib.redirect_stdout(f):
         algorithm.iteration()
 
-    # 转换策略和状态值为列表格式
-    policy_list = []
-    for state_idx in range(env.num_states):
-        x, y = env.state_idx_to_xy(state_idx)
-        # 找到最优动作索引
-        best_action_idx = 0
-        max_prob = algorithm.policy[state_idx][0]
-        for i, prob in enumerate(algorithm.policy[state_idx]):
-            if prob > max_prob:
-                max_prob = prob
-                best_action_idx = i
-        policy_list.append(
-            {
-                "state_idx": state_idx,
-                "x": x,
-                "y": y,
-                "best_action_idx": best_action_idx,
-                "action": list(env.action_space[best_action_idx]),
-                "policy": algorithm.policy[state_idx],
-            }
-        )
+    response = jsonify(solution_payload(env, algorithm))
+    if key is not None:
+        solve_cache.put(key, snapshot_solution(algorithm, response.get_data()))
+        response.headers["X-Solve-Cache"] = "miss"
+    return response
 
+
+def solution_payload(env, algorithm):
+    """求解完成后返回给前端的状态值、策略和动作值"""
     # 获取总迭代次数
     total_iterations = (
         len(algorithm.iteration_history)
@@ -152,60 +516,430 @@ def run_value_iteration():
         else 0
     )
 
+    payload = values_payload(
+        env, algorithm.state_values, algorithm.policy, algorithm.action_values
+    )
+    payload["total_iterations"] = total_iterations
+    return payload
+
+
+def snapshot_solution(algorithm, response_data):
+    """把求解结果和迭代历史复制成缓存条目"""
+    entry = {
+        f"history_{name}": np.array(array)
+        for name, array in algorithm.iteration_history.export().items()
+    }
+    entry["state_values"] = np.array(algorithm.state_values, dtype=np.float64)
+    entry["action_values"] = np.array(algorithm.action_values, dtype=np.float64)
+    entry["policy"] = np.array(algorithm.policy)
+    entry["response"] = response_data
+    return entry
+
+
+def restore_solution(algorithm, entry):
+    """把缓存条目写回算法，之后的 get_iteration 和 step 与重新求解时一致"""
+    history = {
+        name[len("history_") :]: array
+        for name, array in entry.items()
+        if name.startswith("history_")
+    }
+    algorithm.iteration_history.load(history)
+    if algorithm.backend == "numpy":
+        algorithm.state_values = entry["state_values"].copy()
+        algorithm.action_values = entry["action_values"].copy()
+        algorithm.policy = entry["policy"].copy()
+    else:
+        algorithm.state_values = entry["state_values"].tolist()
+        algorithm.action_values = entry["action_values"].tolist()
+        algorithm.policy = entry["policy"].tolist()
+    if hasattr(algorithm, "current_iteration_num"):
+        iterations = history["iterations"]
+        algorithm.current_iteration_num = int(iterations[-1]) if len(iterations) else 0
+
+
+@app.route("/api/cache_stats", methods=["GET"])
+def cache_stats():
+    """求解缓存的命中统计"""
+    return jsonify(solve_cache.stats())
+
+
+@app.route("/api/maps", methods=["GET"])
+def available_maps():
+    """MAPS_DIR 中可以作为 /api/init 的 map_id 使用的地图"""
+    return jsonify({"maps": list_maps(MAPS_DIR)})
+
+
+@app.route("/api/kernels", methods=["GET"])
+def kernel_capabilities():
+    """可用的内核后端，以及启动时预编译的耗时 (还没有完成时为 null)"""
+    return jsonify(dict(kernels.capabilities(), warm_up_seconds=kernel_warm_up["seconds"]))
+
+
+def profiled_copy(env, algorithm):
+    """创建与会话中算法配置相同、开启阶段统计的新实例，不影响会话的状态"""
+    profiled = type(algorithm)(
+        env,
+        theta=algorithm.theta,
+        gamma=algorithm.gamma,
+        max_iterations=algorithm.max_iterations,
+        backend=algorithm.backend,
+        seed=algorithm.seed,
+        instrument=True,
+    )
+    if hasattr(algorithm, "kernels"):
+        profiled.kernels = algorithm.kernels
+    # MonteCarloGreedy 在构造函数中覆盖了 max_iterations
+    profiled.max_iterations = algorithm.max_iterations
+    return profiled
+
+
+def hot_functions(profiler, sort, limit):
+    """按 sort 排序返回 profiler 中最耗时的 limit 个函数"""
+    stats = pstats.Stats(profiler)
+    stats.sort_stats(sort)
+    functions = []
+    for func in stats.fcn_list[:limit]:
+        primitive_calls, calls, tottime, cumtime, _ = stats.stats[func]
+        filename, line, name = func
+        functions.append(
+            {
+                "function": name,
+                "file": os.path.basename(filename),
+                "line": line,
+                "calls": calls,
+                "primitive_calls": primitive_calls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            }
+        )
+    return functions
+
+
+@app.route("/api/profile", methods=["POST"])
+@with_session
+def profile_solve(env, algorithm):
+    """
+    在 cProfile 下用当前会话的配置完整求解一次，返回最耗时的函数和各阶段的统计。
+
+    请求体：sort（cumulative 或 tottime，默认 cumulative），limit（默认 20）。
+    求解使用新的算法实例，会话中的结果和迭代历史不变。
+    """
+    if not PROFILE_ENABLED:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    data = request.get_json(silent=True) or {}
+    sort = data.get("sort", "cumulative")
+    if sort not in PROFILE_SORTS:
+        return (
+            jsonify({"error": f"Unknown sort: {sort}, expected one of {PROFILE_SORTS}"}),
+            400,
+        )
+    limit = max(1, int(data.get("limit", 20)))
+
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({"error": "Another profile is running"}), 409
+    try:
+        profiled = profiled_copy(env, algorithm)
+        profiler = cProfile.Profile()
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            profiler.enable()
+            try:
+                profiled.iteration()
+            finally:
+                profiler.disable()
+                if hasattr(profiled, "close"):
+                    profiled.close()
+        elapsed = time.perf_counter() - start_time
+    finally:
+        profile_lock.release()
+
     return jsonify(
         {
-            "state_values": [float(v) for v in algorithm.state_values],
-            "policy": policy_list,
-            "action_values": [
-                [float(v) for v in row] for row in algorithm.action_values
-            ],
-            "total_iterations": total_iterations,
+            "algorithm": type(profiled).__name__,
+            "elapsed": elapsed,
+            "iterations": getattr(profiled, "current_iteration_num", None),
+            "statistics": profiled.statistics(),
+            "sort": sort,
+            "functions": hot_functions(profiler, sort, limit),
         }
     )
 
 
-@app.route("/api/step_iteration", methods=["POST"])
-def step_iteration():
-    """执行一次迭代"""
-    global env, algorithm
+def solve_steps(algorithm):
+    """
+    逐次迭代，每次迭代后产出 (迭代次数, 是否结束)。algorithm 应该是
+    restart_algorithm 返回的新实例，这样结果才是从头开始的完整求解。
+
+    生成器被提前关闭时同样会释放算法的进程池。
+    """
+    try:
+        while True:
+            converged = algorithm.step_iteration()
+            iteration = algorithm.current_iteration_num
+            finished = converged or iteration >= algorithm.max_iterations
+            yield iteration, finished
+            if finished:
+                break
+    finally:
+        if hasattr(algorithm, "close"):
+            algorithm.close()
+
+
+class SolveSuperseded(Exception):
+    """逐步求解期间会话中的算法被替换 (重新求解、初始化或会话被移除)"""
+
+
+def session_solve_steps(session, algorithm, observe):
+    """
+    与 solve_steps 相同地逐次迭代, 但只在每次迭代和 observe(迭代次数, 是否结束)
+    期间持有会话的锁, 产出 observe 的结果时不持有锁, 同一会话的其他请求
+    (step、get_iteration、rollout 等) 可以在两次迭代之间执行。
+    会话中的算法不再是 algorithm 时抛出 SolveSuperseded。
+    """
+    steps = solve_steps(algorithm)
+    try:
+        while True:
+            with session.lock:
+                if session.algorithm is not algorithm:
+                    raise SolveSuperseded("the session started another solve")
+                iteration, finished = next(steps)
+                result = observe(iteration, finished)
+            yield result
+            if finished:
+                return
+    finally:
+        with session.lock:
+            steps.close()
 
-    if env is None or algorithm is None:
+
+def sse_event(event, data):
+    """按 Server-Sent Events 格式编码一个事件"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+@app.route("/api/stream_iteration", methods=["GET"])
+def stream_iteration():
+    """
+    逐次迭代运行算法，通过 Server-Sent Events 推送进度。
+
+    每 every 次迭代推送一个 iteration 事件，包含迭代次数、残差
+    (状态值变化的最大绝对值) 以及自上一个事件以来发生变化的状态值和最优动作；
+    结束时推送 done 事件。客户端断开连接时停止求解。会话的锁只在每次迭代期间
+    持有；同一会话在此期间开始了另一次求解 (或被重新初始化) 时推送 cancelled 事件并结束。
+    """
+    session = sessions.get(request.cookies.get(SESSION_COOKIE))
+    if session is None:
         return jsonify({"error": "Environment not initialized"}), 400
+    every = max(1, request.args.get("every", 1, type=int))
+
+    def changes(old_values, old_actions, values, actions):
+        changed_states = np.flatnonzero(values != old_values)
+        changed_actions = np.flatnonzero(actions != old_actions)
+        return {
+            "changed_states": changed_states.tolist(),
+            "changed_values": values[changed_states].tolist(),
+            "policy_states": changed_actions.tolist(),
+            "policy_actions": actions[changed_actions].tolist(),
+        }
+
+    def current(algorithm):
+        values = np.array(algorithm.state_values, dtype=np.float64)
+        actions = greedy_actions(np.asarray(algorithm.policy, dtype=np.float64))
+        return values, actions
+
+    def generate():
+        with session.lock:
+            env, algorithm = session.env, session.algorithm
+            start = sse_event(
+                "start",
+                {
+                    "num_states": env.num_states,
+                    "max_iterations": algorithm.max_iterations,
+                },
+            )
+            # 上一个事件发出时的状态值和最优动作，即客户端正在显示的结果
+            sent_values, sent_actions = current(algorithm)
+            algorithm = restart_algorithm(session)
+
+            key = session.solve_key
+            entry = solve_cache.get(key) if key is not None else None
+            if entry is not None:
+                # 已经求解过，一个事件推送全部结果
+                restore_solution(algorithm, entry)
+                values, actions = current(algorithm)
+                event = {"iteration": algorithm.current_iteration_num, "residual": 0.0}
+                event.update(changes(sent_values, sent_actions, values, actions))
+        # 第一个事件立即发出，前端不用等待第一次迭代
+        yield start
+
+        if entry is not None:
+            yield sse_event("iteration", event)
+        else:
+            values = sent_values
+            # 只在每次迭代期间持有会话的锁，yield 时释放，客户端慢也不会阻塞
+            # 同一会话的其他请求；客户端断开时生成器在 yield 处关闭，求解随之停止
+            steps = session_solve_steps(
+                session,
+                algorithm,
+                lambda iteration, finished: (iteration, finished, *current(algorithm)),
+            )
+            try:
+                for iteration, finished, new_values, actions in steps:
+                    old_values, values = values, new_values
+                    if finished or iteration % every == 0:
+                        event = {
+                            "iteration": iteration,
+                            "residual": float(np.max(np.abs(values - old_values))),
+                        }
+                        event.update(changes(sent_values, sent_actions, values, actions))
+                        yield sse_event("iteration", event)
+                        sent_values, sent_actions = values, actions
+            except SolveSuperseded as error:
+                yield sse_event("cancelled", {"error": str(error)})
+                return
+
+        with session.lock:
+            if session.algorithm is not algorithm:
+                done = sse_event(
+                    "cancelled", {"error": "the session started another solve"}
+                )
+            else:
+                if entry is None and key is not None:
+                    payload = jsonify(solution_payload(env, algorithm)).get_data()
+                    solve_cache.put(key, snapshot_solution(algorithm, payload))
+                done = sse_event(
+                    "done",
+                    {
+                        "total_iterations": len(algorithm.iteration_history),
+                        "action_values": np.asarray(
+                            algorithm.action_values, dtype=np.float64
+                        ).tolist(),
+                    },
+                )
+        yield done
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/jobs", methods=["POST"])
+def submit_job():
+    """提交一个后台求解任务，立即返回任务 id"""
+    # 不在这里获取会话的锁：同一会话已有任务在运行时也要立即返回
+    session = sessions.get(request.cookies.get(SESSION_COOKIE))
+    if session is None:
+        return jsonify({"error": "Environment not initialized"}), 400
+    env, algorithm = session.env, session.algorithm
+
+    def solve(job):
+        with session.lock:
+            # 等待会话锁期间可能已经被取消
+            if job.cancel_requested:
+                return None
+            algorithm = restart_algorithm(session)
+            key = session.solve_key
+            entry = solve_cache.get(key) if key is not None else None
+            if entry is not None:
+                restore_solution(algorithm, entry)
+                job.report(job.total)
+                return json.loads(entry["response"])
+        # 只在每次迭代期间持有会话的锁，任务运行时会话的其他请求不会被阻塞；
+        # 会话开始另一次求解时抛出 SolveSuperseded，任务失败
+        steps = session_solve_steps(
+            session, algorithm, lambda iteration, finished: iteration
+        )
+        for iteration in steps:
+            job.report(iteration)
+            if job.cancel_requested:
+                steps.close()
+                return None
+        with session.lock:
+            if session.algorithm is not algorithm:
+                raise SolveSuperseded("the session started another solve")
+            with app.app_context():
+                payload = solution_payload(env, algorithm)
+                if key is not None:
+                    solve_cache.put(
+                        key, snapshot_solution(algorithm, jsonify(payload).get_data())
+                    )
+        return payload
+
+    try:
+        job = jobs.submit(session.session_id, solve, total=algorithm.max_iterations)
+    except QueueFull as error:
+        response = jsonify({"error": f"Job queue is full: {error}"})
+        response.headers["Retry-After"] = "5"
+        return response, 429
+    return jsonify(job.to_dict()), 202
+
+
+def find_job(job_id):
+    """返回当前会话提交的任务，其他会话的任务视为不存在"""
+    job = jobs.get(job_id)
+    if job is None or job.owner != request.cookies.get(SESSION_COOKIE):
+        return None
+    return job
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """查询任务状态、进度和预计剩余时间"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """取消任务"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    jobs.cancel(job_id)
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    """获取已完成任务的结果，格式与 /api/run_value_iteration 相同"""
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if job.status != "done":
+        return jsonify({"error": f"Job is {job.status}", **job.to_dict()}), 409
+    return jsonify(job.result)
+
+
+@app.route("/api/step_iteration", methods=["POST"])
+@with_session
+def step_iteration(env, algorithm):
+    """
+    执行一次迭代
+
+    请求可以指定 encoding 使用紧凑格式; 同时指定 since (客户端当前显示的迭代次数)
+    时只返回相对于该次迭代发生变化的状态。
+    """
 
     # 检查算法是否有step_iteration方法
     if not hasattr(algorithm, "step_iteration"):
         return jsonify({"error": "Algorithm does not support step iteration"}), 400
 
-    # 执行一次迭代（捕获输出）
-    import io
-    import contextlib
+    data = request.get_json(silent=True) or {}
+    try:
+        encoding = request_encoding(data)
+        since = request_since(data)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
 
+    # 执行一次迭代（捕获输出）
     f = io.StringIO()
     with contextlib.redirect_stdout(f):
         converged = algorithm.step_iteration()
 
-    # 转换策略和状态值为列表格式
-    policy_list = []
-    for state_idx in range(env.num_states):
-        x, y = env.state_idx_to_xy(state_idx)
-        # 找到最优动作索引
-        best_action_idx = 0
-        max_prob = algorithm.policy[state_idx][0]
-        for i, prob in enumerate(algorithm.policy[state_idx]):
-            if prob > max_prob:
-                max_prob = prob
-                best_action_idx = i
-        policy_list.append(
-            {
-                "state_idx": state_idx,
-                "x": x,
-                "y": y,
-                "best_action_idx": best_action_idx,
-                "action": list(env.action_space[best_action_idx]),
-                "policy": algorithm.policy[state_idx],
-            }
-        )
-
     # 获取总迭代次数
     total_iterations = (
         len(algorithm.iteration_history)
@@ -220,27 +954,26 @@ def step_iteration():
         else total_iterations
     )
 
-    return jsonify(
-        {
-            "state_values": [float(v) for v in algorithm.state_values],
-            "policy": policy_list,
-            "action_values": [
-                [float(v) for v in row] for row in algorithm.action_values
-            ],
-            "total_iterations": total_iterations,
-            "current_iteration": current_iteration,
-            "converged": converged,
-        }
+    payload = values_payload(
+        env,
+        algorithm.state_values,
+        algorithm.policy,
+        algorithm.action_values,
+        encoding,
+        previous_arrays(algorithm.iteration_history, since) if encoding else None,
+    )
+    payload.update(
+        total_iterations=total_iterations,
+        current_iteration=current_iteration,
+        converged=converged,
     )
+    return jsonify(payload)
 
 
 @app.route("/api/get_iteration", methods=["POST"])
-def get_iteration():
+@with_session
+def get_iteration(env, algorithm):
     """获取指定迭代次数的结果"""
-    global env, algorithm
-
-    if env is None or algorithm is None:
-        return jsonify({"error": "Environment not initialized"}), 400
 
     data = request.get_json() or {}
     iteration_num = data.get("iteration", 1)
@@ -259,59 +992,33 @@ def get_iteration():
             400,
         )
 
+    try:
+        encoding = request_encoding(data)
+        since = request_since(data)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
     # 获取指定迭代次数的数据
     history_item = algorithm.iteration_history[iteration_num - 1]
-    state_values = history_item["state_values"]
-    policy = history_item["policy"]
-
-    # 转换策略为列表格式
-    policy_list = []
-    for state_idx in range(env.num_states):
-        x, y = env.state_idx_to_xy(state_idx)
-        # 找到最优动作索引
-        best_action_idx = 0
-        max_prob = policy[state_idx][0]
-        for i, prob in enumerate(policy[state_idx]):
-            if prob > max_prob:
-                max_prob = prob
-                best_action_idx = i
-        policy_list.append(
-            {
-                "state_idx": state_idx,
-                "x": x,
-                "y": y,
-                "best_action_idx": best_action_idx,
-                "action": list(env.action_space[best_action_idx]),
-                "policy": policy[state_idx],
-            }
-        )
-
-    return jsonify(
-        {
-            "iteration": iteration_num,
-            "state_values": [float(v) for v in state_values],
-            "policy": policy_list,
-            "action_values": [
-                [float(v) for v in row] for row in history_item["action_values"]
-            ],
-        }
+    payload = values_payload(
+        env,
+        history_item["state_values"],
+        history_item["policy"],
+        history_item["action_values"],
+        encoding,
+        previous_arrays(algorithm.iteration_history, since) if encoding else None,
     )
+    payload["iteration"] = iteration_num
+    return jsonify(payload)
 
 
 @app.route("/api/step", methods=["POST"])
-def step_env():
+@with_session
+def step_env(env, algorithm):
     """执行一步"""
-    global env, algorithm
-
-    if env is None:
-        return jsonify({"error": "Environment not initialized"}), 400
-
     # 获取当前状态的最优动作
     state_idx = env.xy_to_state_idx(env.agent_state[0], env.agent_state[1])
 
-    if algorithm is None:
-        return jsonify({"error": "Algorithm not run"}), 400
-
     # 获取请求参数，支持指定使用哪个迭代的策略
     data = request.get_json() or {}
     iteration_num = data.get("iteration", None)
@@ -337,12 +1044,8 @@ def step_env():
         policy_to_use = algorithm.policy
 
     # 找到最优动作索引
-    best_action_idx = 0
-    max_prob = policy_to_use[state_idx][0]
-    for i, prob in enumerate(policy_to_use[state_idx]):
-        if prob > max_prob:
-            max_prob = prob
-            best_action_idx = i
+    state_policy = np.asarray(policy_to_use[state_idx : state_idx + 1], dtype=np.float64)
+    best_action_idx = int(greedy_actions(state_policy)[0])
     action = env.action_space[best_action_idx]
 
     # 执行动作
@@ -361,5 +1064,115 @@ def step_env():
     )
 
 
+def grid_cell(value, env_size, label):
+    """把请求中的 [x, y] 转换为网格内的 (x, y), 不合法时抛出 ValueError"""
+    if (
+        not isinstance(value, (list, tuple))
+        or len(value) != 2
+        or not all(isinstance(v, int) and not isinstance(v, bool) for v in value)
+    ):
+        raise ValueError(f"{label} {value!r} is not an [x, y] pair of integers")
+    x, y = value
+    width, height = env_size
+    if not (0 <= x < width and 0 <= y < height):
+        raise ValueError(f"{label} {(x, y)} is outside the {width}x{height} grid")
+    return x, y
+
+
+def rollout_start_states(env, start_states):
+    """
+    把 /api/rollout 的 start_states 参数转换为状态索引。
+
+    起始位置必须是网格内、不是禁止状态的 [x, y], 否则抛出 ValueError。
+    """
+    if start_states == "all":
+        free = ~env.occupancy.mask().ravel()
+        free[env.target_state_idx] = False
+        return np.flatnonzero(free)
+    if start_states is None:
+        return [env.xy_to_state_idx(*env.start_state)]
+    if not isinstance(start_states, list):
+        raise ValueError('start_states must be a list of [x, y] pairs or "all"')
+    indices = []
+    for state in start_states:
+        x, y = grid_cell(state, env.env_size, "Start state")
+        if env.is_forbidden(x, y):
+            raise ValueError(f"Start state {(x, y)} is forbidden")
+        indices.append(env.xy_to_state_idx(x, y))
+    return indices
+
+
+@app.route("/api/rollout", methods=["POST"])
+@with_session
+def rollout_env(env, algorithm):
+    """
+    在服务端按贪心 (或 epsilon-贪心) 策略运行完整的 episode。
+
+    请求参数:
+        iteration: 使用第几次迭代的策略, 默认使用当前策略
+        start_states: 起始位置 [[x, y], ...], "all" 表示除目标和禁止状态外的
+            每个状态, 默认只从环境的起始位置出发
+        epsilon: 随机选择动作的概率, 默认 0
+        max_steps: 每个 episode 的步数上限
+        seed: 随机数种子
+        encoding: 数组的编码方式, 默认 json
+    返回每个 episode 的状态索引序列、动作、奖励、长度、是否到达目标和折扣回报。
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        encoding = request_encoding(data) or "json"
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    history = algorithm.iteration_history
+    iteration_num = data.get("iteration")
+    if iteration_num is not None and history:
+        if iteration_num < 1 or iteration_num > len(history):
+            return (
+                jsonify(
+                    {
+                        "error": f"Iteration number must be between 1 and {len(history)}"
+                    }
+                ),
+                400,
+            )
+        policy_to_use = history[iteration_num - 1]["policy"]
+    else:
+        policy_to_use = algorithm.policy
+    actions = greedy_actions(np.asarray(policy_to_use, dtype=np.float64))
+
+    try:
+        start_states = rollout_start_states(env, data.get("start_states"))
+        max_steps = int(data.get("max_steps", 2 * env.num_states))
+        epsilon = float(data.get("epsilon", 0.0))
+    except (TypeError, ValueError) as error:
+        return jsonify({"error": str(error)}), 400
+    if len(start_states) == 0:
+        return jsonify({"error": "No start states"}), 400
+    max_steps = min(max(max_steps, 1), MAX_ROLLOUT_STEPS)
+    rng = np.random.default_rng(data.get("seed"))
+
+    states, actions, rewards, lengths, reached = rollout(
+        env, actions, start_states, max_steps, epsilon=epsilon, rng=rng
+    )
+    # 只累计每个 episode 结束之前的奖励
+    steps = np.arange(rewards.shape[1])
+    discounts = np.where(steps < lengths[:, None], algorithm.gamma**steps, 0.0)
+    returns = (discounts * rewards).sum(axis=1)
+
+    return jsonify(
+        {
+            "encoding": encoding,
+            "num_rollouts": len(lengths),
+            "states": encode_array(states, np.int32, encoding),
+            "actions": encode_array(actions, np.int8, encoding),
+            "rewards": encode_array(rewards, np.float32, encoding),
+            "lengths": encode_array(lengths, np.int32, encoding),
+            "reached": np.asarray(reached).tolist(),
+            "returns": encode_array(returns, np.float32, encoding),
+        }
+    )
+
+
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    app.run(debug=True, host="0.0.0.0", port=5000, threaded=True)
@@ -0,0 +1,131 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 任务状态
+# queued: 等待空闲的工作线程
+# running: 正在执行
+# done / failed / cancelled: 已结束
+FINISHED = ("done", "failed", "cancelled")
+
+
+class QueueFull(Exception):
+    """排队和运行中的任务已经达到上限"""
+
+
+class Job:
+    def __init__(self, owner, total):
+        self.job_id = secrets.token_urlsafe(12)
+        self.owner = owner  # 提交任务的会话 id
+        self.status = "queued"
+        self.completed = 0  # 已完成的步数 (迭代次数)
+        self.total = total  # 步数上限
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def report(self, completed):
+        self.completed = completed
+
+    @property
+    def eta(self):
+        """按已完成步数的平均耗时估计剩余秒数, 无法估计时为 None"""
+        if self.status != "running" or not self.completed:
+            return None
+        elapsed = time.time() - self.started
+        return elapsed / self.completed * max(self.total - self.completed, 0)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "completed": self.completed,
+            "total": self.total,
+            "progress": self.completed / self.total if self.total else 0.0,
+            "eta": self.eta,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """
+    在有界线程池中执行耗时的求解任务。
+
+    最多 max_workers 个任务同时运行, 排队和运行中的任务总数达到
+    max_pending 时 submit 抛出 QueueFull。任务函数 fn(job) 应当
+    定期调用 job.report 并在 job.cancel_requested 为 True 时尽快返回。
+    已结束的任务最多保留 max_finished 个, 供查询结果。
+    """
+
+    def __init__(self, max_workers=2, max_pending=8, max_finished=100):
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="solve-job"
+        )
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """排队和运行中的任务数"""
+        return sum(job.status not in FINISHED for job in self._jobs.values())
+
+    def submit(self, owner, fn, total):
+        job = Job(owner, total)
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} jobs already pending")
+            self._jobs[job.job_id] = job
+            self._prune()
+        job._future = self._executor.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """取消任务; 排队中的任务直接移出队列, 运行中的任务在下一步结束"""
+        job = self._jobs.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job._cancel.set()
+        if job._future is not None and job._future.cancel():
+            self._finish(job, "cancelled")
+        return job
+
+    def _run(self, job, fn):
+        if job.cancel_requested:
+            self._finish(job, "cancelled")
+            return
+        job.status = "running"
+        job.started = time.time()
+        try:
+            job.result = fn(job)
+        except Exception as error:
+            job.error = f"{type(error).__name__}: {error}"
+            self._finish(job, "failed")
+            return
+        self._finish(job, "cancelled" if job.cancel_requested else "done")
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.status in FINISHED]
+        for job in finished[: max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job.job_id]
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def session_nbytes(env, algorithm):
+    """估计一个会话中环境和算法占用的内存 (字节)"""
+    nbytes = 0
+    # 转移表只在被访问之后才存在
+    for table in (env._next_state_table, env._reward_table):
+        if table is not None:
+            nbytes += table.nbytes
+    if algorithm is not None:
+        for values in (
+            algorithm.state_values,
+            algorithm.action_values,
+            algorithm.policy,
+        ):
+            nbytes += np.asarray(values).nbytes
+        history = algorithm.iteration_history
+        # 写入磁盘的历史记录不占用内存
+        if history.spill_dir is None:
+            nbytes += history.nbytes
+    return nbytes
+
+
+class Session:
+    def __init__(self, session_id, env, algorithm):
+        self.session_id = session_id
+        self.env = env
+        self.algorithm = algorithm
+        # 求解配置的内容地址，结果不可复用时为 None
+        self.solve_key = None
+        # 按会话的配置创建新的算法实例，完整求解时从初始状态开始
+        self.make_algorithm = None
+        # 同一个会话的请求串行执行
+        self.lock = threading.RLock()
+        self.last_access = time.monotonic()
+
+    @property
+    def nbytes(self):
+        return session_nbytes(self.env, self.algorithm)
+
+
+class SessionRegistry:
+    """
+    按会话 id 保存 (env, algorithm), 每个会话有自己的锁。
+
+    超过 ttl 秒没有访问的会话会被移除; 所有会话的内存估计超过
+    memory_budget 字节时, 按最近最少使用的顺序移除会话。
+    被移除的会话会传给 on_evict, 用于释放磁盘上的历史记录等资源。
+    """
+
+    def __init__(self, memory_budget=512 * 1024**2, ttl=30 * 60, on_evict=None):
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, session_id):
+        """返回会话并把它标记为最近使用; 不存在或已过期时返回 None"""
+        with self._lock:
+            expired = self._evict_expired()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_access = time.monotonic()
+                self._sessions.move_to_end(session_id)
+        for old_session in expired:
+            self._release(old_session)
+        return session
+
+    def put(self, session_id, env, algorithm):
+        """创建或替换会话, 然后按内存预算移除最久未使用的其他会话"""
+        session = Session(session_id, env, algorithm)
+        with self._lock:
+            old = self._sessions.pop(session_id, None)
+            self._sessions[session_id] = session
+            evicted = [old] if old is not None else []
+            evicted += self._evict_expired()
+            evicted += self._evict_over_budget()
+        for old_session in evicted:
+            self._release(old_session)
+        return session
+
+    def remove(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._release(session)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [
+            session
+            for session in self._sessions.values()
+            if now - session.last_access > self.ttl
+        ]
+        for session in expired:
+            del self._sessions[session.session_id]
+        return expired
+
+    def _evict_over_budget(self):
+        evicted = []
+        total = sum(session.nbytes for session in self._sessions.values())
+        # 至少保留最近使用的那个会话
+        while total > self.memory_budget and len(self._sessions) > 1:
+            _, session = self._sessions.popitem(last=False)
+            total -= session.nbytes
+            evicted.append(session)
+        return evicted
+
+    def _release(self, session):
+        if self.on_evict is None:
+            return
+        # 在后台线程中等待正在处理该会话的请求结束, 不阻塞当前请求
+        threading.Thread(
+            target=self._release_when_idle, args=(session,), daemon=True
+        ).start()
+
+    def _release_when_idle(self, session):
+        with session.lock:
+            self.on_evict(session)
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from occupancy import OccupancyGrid
+
+
+def solve_key(
+    algorithm,
+    env_size,
+    start_state,
+    target_state,
+    forbidden_states,
+    gamma,
+    theta,
+    max_iterations,
+    seed,
+    kernels=None,
+):
+    """
+    对一次求解的全部输入计算内容地址。
+
+    forbidden_states 可以是 OccupancyGrid 或 (x, y) 列表, 后者先转换为
+    OccupancyGrid; 按位压缩的网格以 sha256 写入配置, 不需要为每个禁止状态
+    创建 Python 对象, 同一组禁止状态无论顺序和来源都得到同一个 key。
+    所有字段按固定顺序序列化为 JSON 后取 sha256。
+    kernels 为 None 时不写入配置。
+    """
+    if not isinstance(forbidden_states, OccupancyGrid):
+        forbidden_states = OccupancyGrid.from_states(forbidden_states, env_size)
+    bits = forbidden_states.bits
+    config = dict(
+        algorithm=algorithm,
+        env_size=list(env_size),
+        start_state=list(start_state),
+        target_state=list(target_state),
+        forbidden_bits=dict(
+            shape=list(bits.shape),
+            sha256=hashlib.sha256(np.ascontiguousarray(bits).tobytes()).hexdigest(),
+        ),
+        gamma=float(gamma),
+        theta=float(theta),
+        max_iterations=int(max_iterations),
+        seed=seed,
+    )
+    if kernels is not None:
+        config["kernels"] = kernels
+    text = json.dumps(config, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def entry_nbytes(entry):
+    return sum(
+        value.nbytes if isinstance(value, np.ndarray) else len(value)
+        for value in entry.values()
+    )
+
+
+class SolveCache:
+    """
+    按 solve_key 保存已经求解过的结果。
+
+    每个条目是一个 {名字: np.ndarray 或 bytes} 的字典, 包含收敛后的
+    状态值、策略、动作值、迭代历史和序列化好的响应。内存中按最近最少使用
+    的顺序保留, 总大小不超过 max_bytes; 指定 cache_dir 时条目同时写成
+    cache_dir/<key>.npz, 进程重启后仍然可以命中。
+    """
+
+    def __init__(self, max_bytes=64 * 1024**2, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        """返回 key 对应的条目, 不存在时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._read(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._insert(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._insert(key, entry)
+        if self.cache_dir is not None:
+            self._write(key, entry)
+
+    def _insert(self, key, entry):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._nbytes -= entry_nbytes(old)
+        nbytes = entry_nbytes(entry)
+        # 单个条目超过上限时只写磁盘
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._nbytes += nbytes
+        while self._nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= entry_nbytes(evicted)
+
+    def _read(self, key):
+        if self.cache_dir is None or not os.path.exists(self._path(key)):
+            return None
+        with np.load(self._path(key)) as data:
+            entry = {name: data[name] for name in data.files}
+        entry["response"] = entry["response"].tobytes()
+        return entry
+
+    def _write(self, key, entry):
+        arrays = dict(entry)
+        arrays["response"] = np.frombuffer(entry["response"], dtype=np.uint8)
+        # 先写临时文件再替换, 其他进程不会读到写了一半的文件
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, self._path(key))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._nbytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -11,6 +11,7 @@ let isAutoPlaying = false;
 let autoPlayInterval = null;
 let isSimulating = false; // 是否正在模拟策略移动
 let forbiddenStates = [[2, 1], [3, 3], [1, 3]]; // 默认禁止状态
+let forbiddenBits = null; // 当前环境按位压缩的禁止状态 (Uint8Array)
 let currentAgentPos = null; // 当前智能体位置
 let totalIterations = 0; // 总迭代次数
 let currentIteration = 0; // 当前查看的迭代次数
@@ -91,11 +92,14 @@ function drawGrid() {
     }
     
     // 禁止状态
-    envData.forbidden_states.forEach(state => {
-        if (!currentAgentPos || state[0] !== currentAgentPos[0] || state[1] !== currentAgentPos[1]) {
-            drawCell(state[0], state[1], colors.forbidden, 'X');
+    for (let y = 0; y < gridHeight; y++) {
+        for (let x = 0; x < gridWidth; x++) {
+            if (!isForbidden(x, y)) continue;
+            if (!currentAgentPos || x !== currentAgentPos[0] || y !== currentAgentPos[1]) {
+                drawCell(x, y, colors.forbidden, 'X');
+            }
         }
-    });
+    }
     
     // 起始状态（始终绘制，智能体会覆盖在上面）
     // 注意：如果智能体在起始位置，智能体会覆盖起始标记，但标记仍然会被绘制作为背景
@@ -435,6 +439,7 @@ async function initEnvironment() {
         }
         
         envData = await response.json();
+        forbiddenBits = decodeArray(envData.forbidden_bits);
         
         // 获取初始策略和状态值
         if (envData.state_values && envData.policy) {
@@ -468,69 +473,164 @@ async function initEnvironment() {
     }
 }
 
-async function runValueIteration() {
-    try {
-        const algorithm = document.getElementById('algorithmSelect').value;
-        let algorithmName = '值迭代';
-        if (algorithm === 'policy_iteration') {
-            algorithmName = '策略迭代';
-        } else if (algorithm === 'truncated_policy_iteration') {
-            algorithmName = '截断策略迭代';
-        } else if (algorithm === 'monte_carlo') {
-            algorithmName = '蒙特卡洛方法';
+function runValueIteration() {
+    const algorithm = document.getElementById('algorithmSelect').value;
+    let algorithmName = '值迭代';
+    if (algorithm === 'policy_iteration') {
+        algorithmName = '策略迭代';
+    } else if (algorithm === 'truncated_policy_iteration') {
+        algorithmName = '截断策略迭代';
+    } else if (algorithm === 'monte_carlo') {
+        algorithmName = '蒙特卡洛方法';
+    }
+    updateControlInfo(`正在运行${algorithmName}算法...`);
+    document.getElementById('runBtn').disabled = true;
+    document.getElementById('stepIterBtn').disabled = true;
+
+    // 服务端每完成一次迭代推送一个事件，只包含变化的状态值和策略
+    const source = new EventSource('/api/stream_iteration?every=1');
+    let drawPending = false;
+
+    source.addEventListener('iteration', function(event) {
+        const data = JSON.parse(event.data);
+        data.changed_states.forEach((stateIdx, i) => {
+            stateValues[stateIdx] = data.changed_values[i];
+        });
+        data.policy_states.forEach((stateIdx, i) => {
+            setBestAction(stateIdx, data.policy_actions[i]);
+        });
+        currentIteration = data.iteration;
+        updateControlInfo(
+            `正在运行${algorithmName}算法... 第 ${data.iteration} 次迭代，残差 ${data.residual.toExponential(2)}`
+        );
+        // 一帧之内的多个事件只重绘一次
+        if (!drawPending) {
+            drawPending = true;
+            requestAnimationFrame(function() {
+                drawPending = false;
+                currentAgentPos = null;
+                drawGrid();
+            });
         }
-        updateControlInfo(`正在运行${algorithmName}算法...`);
-        const response = await fetch('/api/run_value_iteration', { method: 'POST' });
-        const data = await response.json();
-        
-        stateValues = data.state_values;
-        policy = data.policy;
+    });
+
+    source.addEventListener('done', function(event) {
+        source.close();
+        const data = JSON.parse(event.data);
         actionValues = data.action_values || null;
         totalIterations = data.total_iterations || 0;
-        
-        // 更新迭代次数输入框的最大值
-        const iterationInput = document.getElementById('iterationInput');
-        if (totalIterations > 0) {
-            iterationInput.max = totalIterations;
-            iterationInput.value = totalIterations; // 默认显示最后一次迭代
-            currentIteration = totalIterations; // 设置当前迭代为最后一次
-            document.getElementById('viewIterationBtn').disabled = false;
-            updateIterationInfo(`共 ${totalIterations} 次迭代`);
-            // 更新迭代历史导航按钮状态
-            updateIterationButtons();
-        } else {
-            iterationInput.max = 1;
-            currentIteration = 0;
-            document.getElementById('viewIterationBtn').disabled = true;
-            updateIterationInfo('运行算法后可查看历史迭代');
-            document.getElementById('prevIterBtn').disabled = true;
-            document.getElementById('nextIterBtn').disabled = true;
-        }
-        
-        // 重置智能体位置为起始位置（先清除，让drawGrid可以绘制起始位置标记）
-        currentAgentPos = null;
-        
-        // 绘制网格（包括状态值和策略）
-        drawGrid();
-        
-        // 绘制智能体在起始位置（这会更新currentAgentPos）
-        if (envData && envData.start_state && envData.start_state.length === 2) {
-            drawAgent(envData.start_state[0], envData.start_state[1]);
+        finishRun(algorithmName);
+    });
+
+    // 同一会话中开始了另一次求解，这次的结果不再有效
+    source.addEventListener('cancelled', function(event) {
+        source.close();
+        const data = JSON.parse(event.data);
+        updateControlInfo(`算法运行已取消: ${data.error}`);
+        document.getElementById('runBtn').disabled = false;
+        document.getElementById('stepIterBtn').disabled = false;
+    });
+
+    source.onerror = function() {
+        source.close();
+        console.error('算法运行失败: 事件流中断');
+        updateControlInfo('算法运行失败: 事件流中断');
+        document.getElementById('runBtn').disabled = false;
+    };
+}
+
+// 算法运行结束后更新迭代历史和按钮状态
+function finishRun(algorithmName) {
+    // 更新迭代次数输入框的最大值
+    const iterationInput = document.getElementById('iterationInput');
+    if (totalIterations > 0) {
+        iterationInput.max = totalIterations;
+        iterationInput.value = totalIterations; // 默认显示最后一次迭代
+        currentIteration = totalIterations; // 设置当前迭代为最后一次
+        document.getElementById('viewIterationBtn').disabled = false;
+        updateIterationInfo(`共 ${totalIterations} 次迭代`);
+    } else {
+        iterationInput.max = 1;
+        currentIteration = 0;
+        document.getElementById('viewIterationBtn').disabled = true;
+        updateIterationInfo('运行算法后可查看历史迭代');
+    }
+
+    // 重置智能体位置为起始位置（先清除，让drawGrid可以绘制起始位置标记）
+    currentAgentPos = null;
+
+    // 绘制网格（包括状态值和策略）
+    drawGrid();
+
+    // 绘制智能体在起始位置（这会更新currentAgentPos）
+    if (envData && envData.start_state && envData.start_state.length === 2) {
+        drawAgent(envData.start_state[0], envData.start_state[1]);
+    }
+
+    updateStateValues(stateValues);
+    updateControlInfo(`${algorithmName}完成！共 ${totalIterations} 次迭代`);
+    // 启用迭代历史导航按钮和模拟按钮
+    updateIterationButtons();
+    // 运行算法完成后，禁用迭代一次按钮（因为已经运行到收敛）
+    document.getElementById('runBtn').disabled = false;
+    document.getElementById('stepIterBtn').disabled = true;
+    document.getElementById('simulateBtn').disabled = false;
+    document.getElementById('stepSimBtn').disabled = false;
+}
+
+// binary 编码中 dtype 对应的 TypedArray
+const typedArrayTypes = {
+    uint8: Uint8Array,
+    float32: Float32Array,
+    int8: Int8Array,
+    int32: Int32Array
+};
+
+// 把 binary 编码的数组解码为 TypedArray，不需要逐个解析数字
+function decodeArray(encoded) {
+    const binary = atob(encoded.data);
+    const bytes = new Uint8Array(binary.length);
+    for (let i = 0; i < binary.length; i++) {
+        bytes[i] = binary.charCodeAt(i);
+    }
+    return new typedArrayTypes[encoded.dtype](bytes.buffer);
+}
+
+// 按位压缩的禁止状态：第 y 行第 x 列是第 y 行的第 (x >> 3) 个字节的第 (x & 7) 位
+function isForbidden(x, y) {
+    if (!forbiddenBits) return false;
+    const rowBytes = envData.forbidden_bits.shape[1];
+    return (forbiddenBits[y * rowBytes + (x >> 3)] >> (x & 7)) & 1;
+}
+
+// 设置某个状态的最优动作
+function setBestAction(stateIdx, actionIdx) {
+    const p = policy[stateIdx];
+    p.best_action_idx = actionIdx;
+    p.action = envData.action_space[actionIdx];
+    p.policy = envData.action_space.map((_, a) => (a === actionIdx ? 1 : 0));
+}
+
+// 把紧凑格式的响应写入 stateValues、policy 和 actionValues
+// 响应带有 changed_states 时只包含这些状态，其余状态保持不变
+function applyCompactPayload(data) {
+    const values = decodeArray(data.state_values);
+    const bestActions = decodeArray(data.best_actions);
+    const qValues = data.action_values ? decodeArray(data.action_values) : null;
+    const numActions = envData.num_actions;
+
+    if (!data.changed_states) {
+        stateValues = values;
+        actionValues = qValues ? [] : null;
+    }
+    const states = data.changed_states ? decodeArray(data.changed_states) : null;
+    for (let i = 0; i < values.length; i++) {
+        const stateIdx = states ? states[i] : i;
+        stateValues[stateIdx] = values[i];
+        setBestAction(stateIdx, bestActions[i]);
+        if (qValues && actionValues) {
+            actionValues[stateIdx] = qValues.subarray(i * numActions, (i + 1) * numActions);
         }
-        
-        updateStateValues(data.state_values);
-        // 设置当前迭代为最后一次迭代
-        currentIteration = totalIterations;
-        updateControlInfo(`${algorithmName}完成！共 ${totalIterations} 次迭代`);
-        // 启用迭代历史导航按钮和模拟按钮
-        updateIterationButtons();
-        // 运行算法完成后，禁用迭代一次按钮（因为已经运行到收敛）
-        document.getElementById('stepIterBtn').disabled = true;
-        document.getElementById('simulateBtn').disabled = false;
-        document.getElementById('stepSimBtn').disabled = false;
-    } catch (error) {
-        console.error('算法运行失败:', error);
-        updateControlInfo('算法运行失败: ' + error.message);
     }
 }
 
@@ -636,7 +736,14 @@ async function stepIteration() {
         }
         
         updateControlInfo(`正在执行${algorithmName}的一次迭代...`);
-        const response = await fetch('/api/step_iteration', { method: 'POST' });
+        // 请求紧凑格式，只返回相对于当前显示的迭代发生变化的状态
+        const response = await fetch('/api/step_iteration', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ encoding: 'binary', since: currentIteration || null })
+        });
         
         if (!response.ok) {
             const errorData = await response.json();
@@ -645,9 +752,7 @@ async function stepIteration() {
         
         const data = await response.json();
         
-        stateValues = data.state_values;
-        policy = data.policy;
-        actionValues = data.action_values || null;
+        applyCompactPayload(data);
         totalIterations = data.total_iterations || 0;
         currentIteration = data.current_iteration || 0;
         
@@ -680,7 +785,7 @@ async function stepIteration() {
             drawAgent(envData.start_state[0], envData.start_state[1]);
         }
         
-        updateStateValues(data.state_values);
+        updateStateValues(stateValues);
         
         // 如果收敛，禁用迭代一次按钮
         if (data.converged) {
@@ -722,7 +827,11 @@ async function viewIteration() {
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({ iteration: iterationNum })
+            body: JSON.stringify({
+                iteration: iterationNum,
+                encoding: 'binary',
+                since: currentIteration || null
+            })
         });
         
         if (!response.ok) {
@@ -733,9 +842,7 @@ async function viewIteration() {
         const data = await response.json();
         
         // 更新状态值和策略
-        stateValues = data.state_values;
-        policy = data.policy;
-        actionValues = data.action_values || null;
+        applyCompactPayload(data);
         
         // 重置智能体位置为起始位置
         currentAgentPos = null;
@@ -749,7 +856,7 @@ async function viewIteration() {
         }
         
         // 更新状态值显示
-        updateStateValues(data.state_values);
+        updateStateValues(stateValues);
         
         // 更新当前迭代次数
         currentIteration = iterationNum;
@@ -818,7 +925,8 @@ async function stepSimulation() {
 }
 
 // 开始/停止模拟策略移动
-function startSimulation() {
+// 整个 episode 由服务端一次算出，前端只负责逐步播放
+async function startSimulation() {
     if (isSimulating) {
         stopSimulation();
         return;
@@ -829,14 +937,68 @@ function startSimulation() {
         return;
     }
     
+    let data;
+    try {
+        // 使用当前查看的迭代的策略
+        const iterationToUse = currentIteration > 0 ? currentIteration : totalIterations;
+        const response = await fetch('/api/rollout', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ iteration: iterationToUse || null })
+        });
+        data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.error || '模拟失败');
+        }
+    } catch (error) {
+        console.error('模拟失败:', error);
+        updateControlInfo('模拟失败: ' + error.message);
+        return;
+    }
+    
+    const length = data.lengths[0];
+    const path = data.states[0]
+        .slice(0, length + 1)
+        .map(idx => [idx % gridWidth, Math.floor(idx / gridWidth)]);
+    const actionNames = { '0,1': 'DOWN', '1,0': 'RIGHT', '0,-1': 'UP', '-1,0': 'LEFT', '0,0': 'STAY' };
+    
+    // 起点就是目标时没有可以播放的步骤
+    if (length === 0 || path.length < 2) {
+        drawGrid();
+        drawAgent(path[0][0], path[0][1]);
+        updateControlInfo(`起点 (${path[0][0]}, ${path[0][1]}) 已经是目标`);
+        return;
+    }
+    
     isSimulating = true;
     document.getElementById('simulateBtn').textContent = '停止模拟';
     document.getElementById('simulateBtn').classList.remove('btn-danger');
     document.getElementById('simulateBtn').classList.add('btn-warning');
     document.getElementById('stepSimBtn').disabled = true;
     
-    autoPlayInterval = setInterval(async () => {
-        await stepSimulation();
+    let step = 0;
+    autoPlayInterval = setInterval(() => {
+        step += 1;
+        const state = path[step];
+        drawGrid();
+        drawTrajectory(path.slice(0, step + 1));
+        drawAgent(state[0], state[1]);
+        
+        const actionKey = envData.action_space[data.actions[0][step - 1]].join(',');
+        const actionName = actionNames[actionKey] || actionKey;
+        updateControlInfo(
+            `步骤 ${step}/${length}: 动作=${actionName}, 奖励=${data.rewards[0][step - 1]}, ` +
+            `位置=(${state[0]}, ${state[1]})`
+        );
+        
+        if (step >= length) {
+            stopSimulation();
+            updateControlInfo(
+                data.reached[0] ? '🎉 到达目标状态！' : `已达到步数上限 ${length}，未到达目标`
+            );
+        }
     }, 500);
 }
 